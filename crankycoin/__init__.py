@@ -1,7 +1,18 @@
 from block import *
 from blockchain import *
+from blockfile import *
+from codec import *
 from config import *
 from errors import *
+from headers import *
+from inventory import *
+from lanes import *
+from mempool import *
+from metrics import *
+from miner import *
 from node import *
+from peers import *
+from streaming import *
 from transaction import *
 from wallet import *
+from wire import *
@@ -5,14 +5,36 @@ import pyscrypt
 
 from config import *
 from errors import *
+from transaction import *
+
+
+def calculate_hash(hashable):
+    """
+    :return: scrypt hash of a block header's hashable string
+    :rtype: str
+    """
+    hash_object = pyscrypt.hash(
+        password=hashable,
+        salt=hashable,
+        N=1024,
+        r=1,
+        p=1,
+        dkLen=32)
+    return hash_object.encode('hex')
+
+
+def meets_difficulty(block_hash, difficulty):
+    return block_hash[:difficulty].count('0') == difficulty
 
 
 class BlockHeader(object):
 
+    __slots__ = ('version', 'previous_hash', 'merkle_root', 'nonce', 'timestamp')
+
     def __init__(self, previous_hash, merkle_root, timestamp=None, nonce=0):
         self.version = config['network']['version']
-        self.previous_hash = previous_hash
-        self.merkle_root = merkle_root
+        self.previous_hash = str(previous_hash)
+        self.merkle_root = str(merkle_root)
         self.nonce = nonce
         self.timestamp = timestamp if timestamp is not None else int(time.time())
 
@@ -23,18 +45,20 @@ class BlockHeader(object):
             format(self.timestamp, 'x') + \
             "{0:0>8}".format(self.nonce, 'x')
 
+    def to_dict(self):
+        return {slot: getattr(self, slot) for slot in self.__slots__}
+
     def to_json(self):
-        return json.dumps(self, default=lambda o: {key.lstrip('_'): value for key, value in o.__dict__.items()},
-                          sort_keys=True)
+        return json.dumps(self.to_dict(), sort_keys=True)
 
     def __repr__(self):
         return "<Block Header {}>".format(self.merkle_root)
 
     def __str__(self):
-        return str(self.__dict__)
+        return str(self.to_dict())
 
     def __eq__(self, other):
-        return self.__dict__ == other.__dict__
+        return all(getattr(self, slot) == getattr(other, slot) for slot in self.__slots__)
 
     def __ne__(self, other):
         return not self == other
@@ -42,24 +66,66 @@ class BlockHeader(object):
 
 class Block(object):
 
+    SHORT_ID_LENGTH = 12
+
+    __slots__ = ('_index', '_transactions', '_pending_transactions', 'block_header', '_hashed_header', '_current_hash')
+
     transactions = []
 
-    def __init__(self, index, transactions, previous_hash, timestamp=None, nonce=0):
+    def __init__(self, index, transactions, previous_hash, timestamp=None, nonce=0, merkle_root=None):
         """
         :param index: index # of block
         :type index: int
-        :param transactions: list of transactions
+        :param transactions: list of transactions, or a callable returning them to decode them on first use
         :type transactions: list of transaction objects
         :param previous_hash: previous block hash
         :type previous_hash: str
         :param timestamp: timestamp of block mined
         :type timestamp: int
+        :param merkle_root: merkle root claimed by the sender, required when transactions are deferred.
+            Validation checks it against the transactions.
+        :type merkle_root: str
         """
         self._index = index
-        self._transactions = transactions
-        merkle_root = self._calculate_merkle_root()
+        self._pending_transactions = None
+        if callable(transactions):
+            self._transactions = None
+            self._pending_transactions = transactions
+        else:
+            self._transactions = transactions
+        if merkle_root is None:
+            merkle_root = self.calculate_merkle_root()
         self.block_header = BlockHeader(previous_hash, merkle_root, timestamp, nonce)
-        self._current_hash = self._calculate_block_hash()
+        self._hashed_header = None
+        self._current_hash = None
+
+    @classmethod
+    def from_dict(cls, block_dict, defer_transactions=False):
+        """
+        Builds a block from the dict form of its json.  Its hash is computed on first use, once.
+
+        :param defer_transactions: leave the transactions undecoded until something reads them,
+            trusting the header's merkle root until validation checks it
+        :type defer_transactions: bool
+        """
+        block_header = block_dict['block_header']
+        transaction_dicts = block_dict['transactions']
+        if defer_transactions:
+            transactions = lambda: [Transaction.from_dict(transaction) for transaction in transaction_dicts]
+            merkle_root = block_header['merkle_root']
+        else:
+            transactions = [Transaction.from_dict(transaction) for transaction in transaction_dicts]
+            merkle_root = None
+        block = cls(
+            block_dict['index'],
+            transactions,
+            block_header['previous_hash'],
+            block_header['timestamp'],
+            block_header['nonce'],
+            merkle_root
+        )
+        block.block_header.version = block_header.get('version', block.block_header.version)
+        return block
 
     @property
     def index(self):
@@ -67,11 +133,28 @@ class Block(object):
 
     @property
     def transactions(self):
-        return self._transactions
+        transactions = self._transactions
+        if transactions is None:
+            # decoding twice from racing threads is harmless; both lists are equal
+            transactions = self._pending_transactions()
+            self._transactions = transactions
+            self._pending_transactions = None
+        return transactions
+
+    @property
+    def previous_hash(self):
+        return self.block_header.previous_hash
 
     @property
     def current_hash(self):
-        return self._calculate_block_hash()
+        """
+        Computed on first use and cached until the header changes, e.g. when a miner sets a new nonce
+        """
+        hashable = self.block_header.to_hashable()
+        if hashable != self._hashed_header:
+            self._current_hash = self._calculate_block_hash()
+            self._hashed_header = hashable
+        return self._current_hash
 
     @property
     def hash_difficulty(self):
@@ -87,20 +170,15 @@ class Block(object):
         :return: scrypt hash
         :rtype: str
         """
-        header = self.block_header.to_hashable()
-        hash_object = pyscrypt.hash(
-            password=header,
-            salt=header,
-            N=1024,
-            r=1,
-            p=1,
-            dkLen=32)
-        return hash_object.encode('hex')
-
-    def _calculate_merkle_root(self):
-        if len(self._transactions) < 1:
+        return calculate_hash(self.block_header.to_hashable())
+
+    def calculate_merkle_root(self):
+        transactions = self.transactions
+        if len(transactions) < 1:
             raise InvalidTransactions(self._index, "Zero transactions in block. Coinbase transaction required")
-        merkle_base = [t.tx_hash for t in self._transactions]
+        # the tree hashes hex digests, as it always has; building it from raw digests would change the root
+        # every node agrees on
+        merkle_base = [t.tx_hash for t in transactions]
         while len(merkle_base) > 1:
             temp_merkle_base = []
             for i in range(0, len(merkle_base), 2):
@@ -115,18 +193,58 @@ class Block(object):
             merkle_base = temp_merkle_base
         return merkle_base[0]
 
+    @staticmethod
+    def short_transaction_id(block_hash, tx_hash):
+        """
+        Short transaction ids are salted with the block hash so that colliding ids can't be precomputed
+
+        :return: truncated sha256 hash
+        :rtype: str
+        """
+        return hashlib.sha256(block_hash + tx_hash).hexdigest()[:Block.SHORT_ID_LENGTH]
+
+    def to_dict(self):
+        return {
+            "index": self._index,
+            "transactions": [transaction.to_dict() for transaction in self.transactions],
+            "block_header": self.block_header.to_dict(),
+            "current_hash": self.current_hash
+        }
+
     def to_json(self):
-        return json.dumps(self, default=lambda o: {key.lstrip('_'): value for key, value in o.__dict__.items()},
-                          sort_keys=True)
+        # without sort_keys json.dumps runs on the C encoder; nothing hashes this form
+        return json.dumps(self.to_dict())
+
+    def to_compact_json(self, prefilled=None):
+        """
+        Block header plus short transaction ids, for peers to rebuild the block from their mempool
+
+        :param prefilled: positions of transactions to include in full.  The coinbase transaction always is.
+        :type prefilled: list of int
+        """
+        block_hash = self.current_hash
+        positions = set(prefilled or [])
+        transactions = self.transactions
+        positions.add(len(transactions) - 1)
+        return json.dumps({
+            "index": self._index,
+            "block_header": self.block_header.to_dict(),
+            "current_hash": block_hash,
+            "short_ids": [self.short_transaction_id(block_hash, t.tx_hash) for t in transactions],
+            "prefilled": {str(position): transactions[position].to_dict() for position in positions}
+        }, sort_keys=True)
 
     def __repr__(self):
         return "<Block {}>".format(self._index)
 
     def __str__(self):
-        return str(self.__dict__)
+        return str({"index": self._index, "transactions": self.transactions, "block_header": self.block_header})
 
     def __eq__(self, other):
-        return self.__dict__ == other.__dict__
+        # the cached hash is derived from the header, so it is left out
+        return self._index == other._index and \
+            self.transactions == other.transactions and \
+            self.block_header == other.block_header
 
     def __ne__(self, other):
         return not self == other
\ No newline at end of file
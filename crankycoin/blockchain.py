@@ -1,9 +1,13 @@
 import time
+from array import array
 from math import floor
-from multiprocessing import Lock, Manager
+from multiprocessing import Lock
 
 from block import *
 from errors import *
+from headers import *
+from mempool import *
+from metrics import *
 from transaction import *
 
 
@@ -16,13 +20,29 @@ class Blockchain(object):
     TARGET_TIME_PER_BLOCK = config['network']['target_time_per_block']
     DIFFICULTY_ADJUSTMENT_SPAN = config['network']['difficulty_adjustment_span']
     SIGNIFICANT_DIGITS = config['network']['significant_digits']
+    # every node must build the same genesis block, so nothing in it may depend on the clock
+    GENESIS_TIMESTAMP = 0
 
     blocks = []
-
-    def __init__(self, blocks=None):
+    _metrics = None
+    _required_difficulties = None
+    headers = None
+
+    def __init__(self, blocks=None, metrics=None, unconfirmed_transactions=None):
+        """
+        :param unconfirmed_transactions: mempool to use, by default a new SharedMempool
+        :type unconfirmed_transactions: SharedMempool
+        """
+        self.blocks = []
+        self.headers = HeaderChain()
+        # hash difficulty required of the block following each height
+        self._required_difficulties = array('h')
+        self._metrics = metrics
         self.blocks_lock = Lock()
         self.unconfirmed_transactions_lock = Lock()
-        self.unconfirmed_transactions = Manager().list
+        if unconfirmed_transactions is None:
+            unconfirmed_transactions = SharedMempool()
+        self.unconfirmed_transactions = unconfirmed_transactions
         if blocks is None:
             genesis_block = self.get_genesis_block()
             self.add_block(genesis_block)
@@ -36,35 +56,63 @@ class Blockchain(object):
             "03dd1e57d05d9cab1d8d9b727568ad951ac2d9ecd082bc36f69e021b8427812924",
             500000,
             0,
-            ""
+            "",
+            self.GENESIS_TIMESTAMP
         )
         genesis_transaction_two = Transaction(
             "0",
             "03dd1e3defd36c8c0c7282ca1a324851efdb15f742cac0c5b258ef7b290ece9e5d",
             500000,
             0,
-            ""
+            "",
+            self.GENESIS_TIMESTAMP
         )
         genesis_transactions = [genesis_transaction_one, genesis_transaction_two]
-        genesis_block = Block(0, genesis_transactions, "", 0)
+        genesis_block = Block(0, genesis_transactions, "", self.GENESIS_TIMESTAMP)
         return genesis_block
 
+    @property
+    def metrics(self):
+        """
+        Block rejections per validation stage
+        """
+        if self._metrics is None:
+            self._metrics = Metrics()
+        return self._metrics
+
     def _check_genesis_block(self, block):
         if block != self.get_genesis_block():
             raise GenesisBlockMismatch(block.index, "Genesis Block Mismatch: {}".format(block))
         return
 
+    def _check_structure(self, block):
+        for field in ('timestamp', 'nonce'):
+            value = getattr(block.block_header, field)
+            # exact types, so bools and floats are rejected too
+            if type(value) not in (int, long) or not 0 <= value <= HeaderChain.MAX_FIELD_VALUE:
+                raise InvalidBlockHeader(block.index, "Invalid block {}: {!r}".format(field, value))
+        if len(block.transactions) > self.MAX_TRANSACTIONS_PER_BLOCK + 1:
+            raise InvalidTransactions(block.index, "Too many transactions: {}".format(len(block.transactions)))
+        if block.transactions[-1].source != "0" or \
+                any(transaction.source == "0" for transaction in block.transactions[:-1]):
+            raise InvalidTransactions(block.index, "Block reward must be the last and only coinbase transaction")
+        if len(set(transaction.raw_tx_hash for transaction in block.transactions)) != len(block.transactions):
+            raise InvalidTransactions(block.index, "Transactions not valid.  Duplicate transaction detected")
+        if block.calculate_merkle_root() != block.block_header.merkle_root:
+            raise InvalidTransactions(block.index, "Transactions do not match the merkle root")
+        return
+
     def _check_hash_and_hash_pattern(self, block):
         hash_difficulty = self.calculate_hash_difficulty()
-        if block.current_hash[:hash_difficulty].count('0') != hash_difficulty:
+        if not meets_difficulty(block.current_hash, hash_difficulty):
             raise InvalidHash(block.index, "Incompatible Block Hash: {}".format(block.current_hash))
         return
 
     def _check_index_and_previous_hash(self, block):
-        latest_block = self.get_latest_block()
-        if latest_block.index != block.index - 1:
+        height = self.get_height()
+        if height != block.index - 1:
             raise ChainContinuityError(block.index, "Incompatible block index: {}".format(block.index-1))
-        if latest_block.current_hash != block.previous_hash:
+        if self.headers.get_hash(height) != block.previous_hash:
             raise ChainContinuityError(block.index, "Incompatible block hash: {} and hash: {}".format(block.index-1, block.previous_hash))
         return
 
@@ -94,22 +142,34 @@ class Blockchain(object):
         return
 
     def validate_block(self, block):
-        # verify genesis block integrity
+        """
+        Validates a block in stages, cheapest first: chain continuity, which only needs the header, then
+        structure, size and merkle root, then the one scrypt hash for the proof of work, then signatures
+        and balances.  A block decoded with deferred transactions only decodes them once it is known to
+        extend the chain.  Rejections are counted per stage.
+        """
         # TODO implement and use Merkle tree
-        try:
+        if block.index == 0:
             # if genesis block, check if block is correct
-            if block.index == 0:
-                self._check_genesis_block(block)
-                return True
-            # current hash of data is correct and hash satisfies pattern
-            self._check_hash_and_hash_pattern(block)
-            # block index is correct and previous hash is correct
-            self._check_index_and_previous_hash(block)
-            # block reward is correct based on block index and halving formula
-            self._check_transactions_and_block_reward(block)
-        except BlockchainException as bce:
-            logger.warning("Validation Error (block id: %s): %s", bce.index, bce.message)
-            return False
+            stages = [("genesis", self._check_genesis_block)]
+        else:
+            stages = [
+                # block index is correct and previous hash is correct
+                ("continuity", self._check_index_and_previous_hash),
+                # transaction count, coinbase placement and merkle root
+                ("structure", self._check_structure),
+                # current hash of data is correct and hash satisfies pattern
+                ("proof_of_work", self._check_hash_and_hash_pattern),
+                # block reward is correct based on block index and halving formula
+                ("transactions", self._check_transactions_and_block_reward)
+            ]
+        for stage, check in stages:
+            try:
+                check(block)
+            except BlockchainException as bce:
+                self.metrics.increment("block_rejections.{}".format(stage))
+                logger.warning("Validation Error (block id: %s): %s", bce.index, bce.message)
+                return False
         return True
 
     def validate_transaction(self, transaction):
@@ -128,18 +188,52 @@ class Blockchain(object):
             return False
         return True
 
+    def validate_transactions(self, transactions):
+        """
+        Validates a batch of transactions with a single pass over the chain for replays and balances.
+        Transactions from the same source are checked against the balance left by the ones before them.
+
+        :return: a rejection reason for each transaction, or None if it is valid
+        :rtype: list
+        """
+        confirmed_hashes = self.find_confirmed_transactions([transaction.tx_hash for transaction in transactions])
+        balances = self.get_balances(set(transaction.source for transaction in transactions))
+        batch_hashes = set()
+        results = []
+        for transaction in transactions:
+            if transaction.tx_hash in batch_hashes or transaction in self.unconfirmed_transactions:
+                results.append('Duplicate transaction')
+            elif transaction.tx_hash in confirmed_hashes:
+                results.append('Replay transaction')
+            elif not transaction.verify():
+                results.append('Invalid transaction signature')
+            elif transaction.amount + transaction.fee > balances[transaction.source]:
+                results.append('Insufficient funds')
+            else:
+                balances[transaction.source] -= transaction.amount + transaction.fee
+                batch_hashes.add(transaction.tx_hash)
+                results.append(None)
+                continue
+            logger.warn('Transaction not valid.  {}: {}'.format(results[-1], transaction.tx_hash))
+        return results
+
     def alter_chain(self, blocks):
         #TODO enforce finality through key blocks
         fork_start = blocks[0].index
         alternate_blocks = self.blocks[0:fork_start]
         alternate_blocks.extend(blocks)
-        alternate_chain = Blockchain(alternate_blocks)
+        # the alternate chain is only validated, so it borrows this chain's mempool instead of mapping its own
+        alternate_chain = Blockchain(alternate_blocks, unconfirmed_transactions=self.unconfirmed_transactions)
 
         status = False
+        # the alternate chain holds only the blocks it accepted, so its size is what was validated
         if alternate_chain.get_size() > self.get_size():
             self.blocks_lock.acquire()
             try:
-                self.blocks = alternate_blocks
+                # blocks, headers and difficulties are taken together so they always cover the same heights
+                self.blocks = alternate_chain.blocks
+                self.headers = alternate_chain.headers
+                self._required_difficulties = alternate_chain._required_difficulties
                 status = True
             finally:
                 self.blocks_lock.release()
@@ -148,17 +242,27 @@ class Blockchain(object):
     def add_block(self, block):
         #TODO change this from memory to persistent
         status = False
-        if self.validate_block(block):
-            self.blocks_lock.acquire()
-            try:
+        # validate under the lock so concurrent validation workers can't both extend the same tip
+        self.blocks_lock.acquire()
+        try:
+            if self.validate_block(block):
+                # the header append is all or nothing, so the block is only added once it has succeeded
+                self.headers.append(block)
+                self._required_difficulties.append(self._calculate_hash_difficulty(block.index))
                 self.blocks.append(block)
                 status = True
-            finally:
-                self.blocks_lock.release()
+        finally:
+            self.blocks_lock.release()
         return status
 
-    def mine_block(self, reward_address):
-        #TODO add transaction fees
+    def create_candidate_block(self, reward_address):
+        """
+        Pops the best unconfirmed transactions into a new block on top of the latest block.
+        The block still needs a nonce satisfying the hash difficulty.
+
+        :return: unmined block or None if there are no transactions to mine
+        :rtype: Block
+        """
         transactions = []
         latest_block = self.get_latest_block()
         new_block_id = latest_block.index + 1
@@ -169,7 +273,7 @@ class Blockchain(object):
             unconfirmed_transaction = self.pop_next_unconfirmed_transaction()
             if unconfirmed_transaction is None:
                 break
-            if unconfirmed_transaction.tx_hash in [transaction.tx_hash for transaction in transactions]:
+            if unconfirmed_transaction.raw_tx_hash in [transaction.raw_tx_hash for transaction in transactions]:
                 continue
             if self.find_duplicate_transactions(unconfirmed_transaction.tx_hash):
                 continue
@@ -193,9 +297,17 @@ class Blockchain(object):
 
         timestamp = int(time.time())
 
-        i = 0
-        block = Block(new_block_id, transactions, previous_hash, timestamp)
+        return Block(new_block_id, transactions, previous_hash, timestamp)
+
+    def mine_block(self, reward_address):
+        block = self.create_candidate_block(reward_address)
+        if block is None:
+            return None
+        new_block_id = block.index
+        previous_hash = block.previous_hash
+        transactions = block.transactions
 
+        i = 0
         while block.hash_difficulty < self.calculate_hash_difficulty():
             latest_block = self.get_latest_block()
             if latest_block.index >= new_block_id or latest_block.current_hash != previous_hash:
@@ -228,10 +340,38 @@ class Blockchain(object):
                     balance += transaction.amount
         return balance
 
+    def get_balances(self, addresses):
+        balances = dict.fromkeys(addresses, 0)
+        for block in self.blocks:
+            for transaction in block.transactions:
+                if transaction.source in balances:
+                    balances[transaction.source] -= transaction.amount + transaction.fee
+                if transaction.destination in balances:
+                    balances[transaction.destination] += transaction.amount
+        return balances
+
+    def find_confirmed_transactions(self, transaction_hashes):
+        """
+        :return: the subset of transaction_hashes already included in a block
+        :rtype: set
+        """
+        # compare raw digests, so only the confirmed hashes are hex encoded
+        digests = set(transaction_hash.decode('hex') for transaction_hash in transaction_hashes
+                      if transaction_hash is not None)
+        confirmed = set()
+        for block in self.blocks:
+            for transaction in block.transactions:
+                if transaction.raw_tx_hash in digests:
+                    confirmed.add(transaction.tx_hash)
+        return confirmed
+
     def find_duplicate_transactions(self, transaction_hash):
+        if transaction_hash is None:
+            return False
+        digest = transaction_hash.decode('hex')
         for block in self.blocks:
             for transaction in block.transactions:
-                if transaction.tx_hash == transaction_hash:
+                if transaction.raw_tx_hash == digest:
                     return block.index
         return False
 
@@ -250,23 +390,34 @@ class Blockchain(object):
         return True
 
     def calculate_hash_difficulty(self, index=None):
+        """
+        Hash difficulty required of the block following the block at index, the latest block by default.
+        Looked up in the per-height table filled in as blocks are connected, so it costs no hashing.
+        """
+        required_difficulties = self._required_difficulties
+        if required_difficulties:
+            if index is None:
+                return required_difficulties[-1]
+            if 0 <= index < len(required_difficulties):
+                return required_difficulties[index]
+        return self._calculate_hash_difficulty(index)
+
+    def _calculate_hash_difficulty(self, index=None):
         if index is None:
-            block = self.get_latest_block()
-            index = block.index
-        else:
-            block = self.get_block_by_index(index)
+            index = self.get_height()
 
-        if block.index > self.DIFFICULTY_ADJUSTMENT_SPAN:
-            block_delta = self.get_block_by_index(index - self.DIFFICULTY_ADJUSTMENT_SPAN)
-            timestamp_delta = block.block_header.timestamp - block_delta.block_header.timestamp
+        if index > self.DIFFICULTY_ADJUSTMENT_SPAN:
+            hash_difficulty = self.headers.get_difficulty(index)
+            timestamp_delta = self.headers.get_timestamp(index) - \
+                self.headers.get_timestamp(index - self.DIFFICULTY_ADJUSTMENT_SPAN)
             # blocks were mined quicker than target
             if timestamp_delta < (self.TARGET_TIME_PER_BLOCK * self.DIFFICULTY_ADJUSTMENT_SPAN):
-                return block.hash_difficulty + 1
+                return hash_difficulty + 1
             # blocks were mined slower than target
             elif timestamp_delta > (self.TARGET_TIME_PER_BLOCK * self.DIFFICULTY_ADJUSTMENT_SPAN):
-                return block.hash_difficulty - 1
+                return hash_difficulty - 1
             # blocks were mined within the target time window
-            return block.hash_difficulty
+            return hash_difficulty
         # not enough blocks were mined for an adjustment
         return self.MINIMUM_HASH_DIFFICULTY
 
@@ -280,6 +431,16 @@ class Blockchain(object):
     def get_size(self):
         return len(self.blocks)
 
+    def get_height(self):
+        """
+        :return: index of the latest block, read from the header chain
+        :rtype: int
+        """
+        return len(self.headers) - 1
+
+    def get_block_hash(self, index):
+        return self.headers.get_hash(index)
+
     def get_latest_block(self):
         try:
             return self.blocks[-1]
@@ -299,7 +460,10 @@ class Blockchain(object):
         return self.blocks[start_index:stop_index+1]
 
     def get_all_unconfirmed_transactions(self):
-        return self.unconfirmed_transactions
+        return self.unconfirmed_transactions.get_all()
+
+    def get_unconfirmed_transactions_by_short_ids(self, block_hash, short_ids):
+        return self.unconfirmed_transactions.get_by_short_ids(block_hash, short_ids)
 
     def pop_next_unconfirmed_transaction(self):
         '''
@@ -307,44 +471,37 @@ class Blockchain(object):
         a block has been broadcasted.  During the block's validation process, the transactions
         should be compared with the nodes' mempool.
         '''
-        unconfirmed_transaction = None
-        if len(self.unconfirmed_transactions) > 0:
-            self.unconfirmed_transactions_lock.acquire()
-            try:
-                unconfirmed_transaction = self.unconfirmed_transactions.pop()
-            finally:
-                self.unconfirmed_transactions_lock.release()
-        return unconfirmed_transaction
+        return self.unconfirmed_transactions.pop()
 
     def push_unconfirmed_transaction(self, transaction):
         status = False
-        if self.validate_transaction(transaction):
-            self.unconfirmed_transactions_lock.acquire()
-            try:
-                for t in self.unconfirmed_transactions:
-                    if transaction.fee <= t.fee:
-                        self.unconfirmed_transactions.insert(self.unconfirmed_transactions.index(t), transaction)
-                        status = True
-                        break
-                if status is False:
-                    self.unconfirmed_transactions.append(transaction)
-                    status = True
-            finally:
-                self.unconfirmed_transactions_lock.release()
+        # validate under the lock so a concurrent request can't add the same transaction in between
+        self.unconfirmed_transactions_lock.acquire()
+        try:
+            if self.validate_transaction(transaction):
+                status = self.unconfirmed_transactions.push(transaction)
+        finally:
+            self.unconfirmed_transactions_lock.release()
         return status
 
-    def remove_unconfirmed_transaction(self, transaction_hash):
-        status = False
+    def push_unconfirmed_transactions(self, transactions):
+        """
+        :return: a rejection reason for each transaction, or None if it was added to the pool
+        :rtype: list
+        """
+        # validate under the lock so a transaction validated against the pool isn't added twice by another request
         self.unconfirmed_transactions_lock.acquire()
         try:
-            for t in self.unconfirmed_transactions:
-                if t.tx_hash == transaction_hash:
-                    self.unconfirmed_transactions.pop(self.unconfirmed_transactions.index(t))
-                    status = True
-                    break
+            results = self.validate_transactions(transactions)
+            for i, transaction in enumerate(transactions):
+                if results[i] is None and not self.unconfirmed_transactions.push(transaction):
+                    results[i] = 'Rejected by mempool'
         finally:
             self.unconfirmed_transactions_lock.release()
-        return status
+        return results
+
+    def remove_unconfirmed_transaction(self, transaction_hash):
+        return self.unconfirmed_transactions.remove(transaction_hash)
 
     def __str__(self):
         return str(self.__dict__)
@@ -0,0 +1,101 @@
+import mmap
+import os
+import struct
+from array import array
+
+from codec import *
+
+
+class BlockFile(object):
+    """
+    Read only memory map of a block file written by save_blockchain, a single binary block list message.
+    Opening it only walks the length prefixes, so a block, or a run of consecutive blocks, can be served as
+    a slice of the stored bytes without being decoded or encoded again.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'rb')
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # an empty file can't be mapped
+            self._file.close()
+            raise InvalidEncoding("Empty block file")
+        self._offsets = array('L')
+        self._hashes = []
+        try:
+            self._index()
+        except (InvalidEncoding, struct.error) as e:
+            self.close()
+            raise InvalidEncoding(str(e))
+
+    def _index(self):
+        data = self._map
+        length = BinaryCodec._check_envelope(data[:BinaryCodec.ENVELOPE.size], BinaryCodec.BLOCKS)
+        end = BinaryCodec.ENVELOPE.size + length
+        if end != len(data):
+            raise InvalidEncoding("Payload length mismatch")
+        count, = BinaryCodec.LENGTH.unpack_from(data, BinaryCodec.ENVELOPE.size)
+        offset = BinaryCodec.ENVELOPE.size + BinaryCodec.LENGTH.size
+        for i in xrange(count):
+            # each entry is the block's length prefix followed by its payload
+            self._offsets.append(offset)
+            block_length, = BinaryCodec.LENGTH.unpack_from(data, offset)
+            payload = offset + BinaryCodec.LENGTH.size
+            previous_hash, hash_offset = BinaryCodec._unpack_string(data, payload + BinaryCodec.BLOCK_FIELDS.size)
+            self._hashes.append(BinaryCodec._unpack_string(data, hash_offset)[0])
+            offset = payload + block_length
+        if offset != end:
+            raise InvalidEncoding("Payload length mismatch")
+        self._offsets.append(offset)
+
+    def blocks(self):
+        """
+        :raises InvalidEncoding: if a stored block is malformed
+        :return: pairs of block and the hash stored with it
+        :rtype: list of tuple
+        """
+        return BinaryCodec.decode_blocks(self._map[:])
+
+    def get_hash(self, height):
+        return self._hashes[height]
+
+    def get_block_message(self, height):
+        """
+        :return: a block message for the stored block, as get_block serves it
+        :rtype: str
+        """
+        start = self._offsets[height] + BinaryCodec.LENGTH.size
+        return BinaryCodec._envelope(BinaryCodec.BLOCK, self._map[start:self._offsets[height + 1]])
+
+    def get_blocks_message(self, start_index, stop_index):
+        """
+        :return: a block list message for the stored blocks from start_index to stop_index inclusive.  Stored
+            entries are already length prefixed, so the list is one slice of the file.
+        :rtype: str
+        """
+        payload = self._map[self._offsets[start_index]:self._offsets[stop_index + 1]]
+        return BinaryCodec._envelope(BinaryCodec.BLOCKS,
+                                     BinaryCodec.LENGTH.pack(stop_index - start_index + 1) + payload)
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+    def __len__(self):
+        return len(self._hashes)
+
+    @staticmethod
+    def write(path, blocks):
+        """
+        Writes the blocks to a new file that then replaces path, so maps of the old file stay valid
+        """
+        temporary_path = path + ".tmp"
+        with open(temporary_path, 'wb') as block_file:
+            block_file.write(BinaryCodec.encode_blocks(blocks))
+        os.rename(temporary_path, path)
+
+
+if __name__ == "__main__":
+    pass
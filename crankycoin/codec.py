@@ -0,0 +1,381 @@
+import struct
+import threading
+from collections import OrderedDict
+
+from block import *
+from errors import *
+from transaction import *
+
+
+class BinaryCodec(object):
+    """
+    Versioned, length prefixed binary encoding of blocks and transactions for peers and storage.  JSON stays
+    the default for humans; peers ask for this format with the CONTENT_TYPE media type.
+
+    A message is an envelope (magic, format version, kind, payload length) followed by the payload.  Hex
+    strings (hashes, addresses, signatures) travel as raw bytes; anything else, e.g. the coinbase source
+    "0", travels as text, so every value decodes back to exactly the string that was hashed and signed.
+    Numbers keep their int or float type for the same reason.  Each transaction and block inside a payload
+    is length prefixed, so a reader can skip one without decoding it.
+    """
+
+    CONTENT_TYPE = 'application/x-crankycoin'
+    MAGIC = 'CRNK'
+    VERSION = 1
+
+    BLOCK = 1
+    BLOCKS = 2
+
+    ENVELOPE = struct.Struct('>4sBBI')  # magic, version, kind, payload length
+    LENGTH = struct.Struct('>I')
+    STRING = struct.Struct('>BH')  # encoding, length
+    NUMBER = struct.Struct('>c')
+    INTEGER = struct.Struct('>q')
+    FLOAT = struct.Struct('>d')
+    TIMESTAMP = struct.Struct('>Q')
+    BLOCK_FIELDS = struct.Struct('>QHQQ')  # index, header version, timestamp, nonce
+
+    TEXT = 0
+    HEX = 1
+    NONE = 2
+
+    @classmethod
+    def _pack_string(cls, value):
+        if value is None:
+            return cls.STRING.pack(cls.NONE, 0)
+        value = str(value)
+        try:
+            raw = value.decode('hex')
+        except TypeError:
+            raw = None
+        if raw is not None and raw.encode('hex') == value:
+            return cls.STRING.pack(cls.HEX, len(raw)) + raw
+        return cls.STRING.pack(cls.TEXT, len(value)) + value
+
+    @classmethod
+    def _unpack_string(cls, data, offset):
+        encoding, length = cls.STRING.unpack_from(data, offset)
+        offset += cls.STRING.size
+        if encoding == cls.NONE:
+            return None, offset
+        value = data[offset:offset + length]
+        if len(value) != length:
+            raise struct.error("string runs past the end of the message")
+        if encoding == cls.HEX:
+            return value.encode('hex'), offset + length
+        return value, offset + length
+
+    @classmethod
+    def _pack_number(cls, value):
+        if isinstance(value, float):
+            return cls.NUMBER.pack('d') + cls.FLOAT.pack(value)
+        return cls.NUMBER.pack('q') + cls.INTEGER.pack(value)
+
+    @classmethod
+    def _unpack_number(cls, data, offset):
+        kind, = cls.NUMBER.unpack_from(data, offset)
+        offset += cls.NUMBER.size
+        number = cls.FLOAT if kind == 'd' else cls.INTEGER
+        value, = number.unpack_from(data, offset)
+        return value, offset + number.size
+
+    @classmethod
+    def _pack_sized(cls, payload):
+        return cls.LENGTH.pack(len(payload)) + payload
+
+    @classmethod
+    def encode_transaction(cls, transaction):
+        return "".join((
+            cls._pack_string(transaction.source),
+            cls._pack_string(transaction.destination),
+            cls._pack_number(transaction.amount),
+            cls._pack_number(transaction.fee),
+            cls.TIMESTAMP.pack(transaction.timestamp),
+            cls._pack_string(transaction.signature)
+        ))
+
+    @classmethod
+    def decode_transaction(cls, data, offset=0):
+        """
+        :return: the transaction and the offset just past it
+        :rtype: tuple
+        """
+        source, offset = cls._unpack_string(data, offset)
+        destination, offset = cls._unpack_string(data, offset)
+        amount, offset = cls._unpack_number(data, offset)
+        fee, offset = cls._unpack_number(data, offset)
+        timestamp, = cls.TIMESTAMP.unpack_from(data, offset)
+        offset += cls.TIMESTAMP.size
+        signature, offset = cls._unpack_string(data, offset)
+        return Transaction(source, destination, amount, fee, signature, timestamp), offset
+
+    @classmethod
+    def encode_block_payload(cls, block):
+        block_header = block.block_header
+        parts = [
+            cls.BLOCK_FIELDS.pack(block.index, block_header.version, block_header.timestamp, block_header.nonce),
+            cls._pack_string(block_header.previous_hash),
+            cls._pack_string(block.current_hash),
+            cls.LENGTH.pack(len(block.transactions))
+        ]
+        parts.extend(cls._pack_sized(cls.encode_transaction(transaction)) for transaction in block.transactions)
+        return "".join(parts)
+
+    @classmethod
+    def _check_length(cls, offset, end, what):
+        """
+        :raises InvalidEncoding: if decoding an entry stopped short of, or ran past, its length prefix
+        """
+        if offset != end:
+            raise InvalidEncoding("{} length mismatch".format(what))
+
+    @classmethod
+    def decode_block_payload(cls, data, offset=0):
+        """
+        :raises InvalidEncoding: if a transaction doesn't fill exactly its length prefix
+        :return: the block, the hash the sender claims for it and the offset just past it.  The merkle root
+            and block hash are recomputed from the decoded fields, so the claimed hash can be checked.
+        :rtype: tuple
+        """
+        index, version, timestamp, nonce = cls.BLOCK_FIELDS.unpack_from(data, offset)
+        offset += cls.BLOCK_FIELDS.size
+        previous_hash, offset = cls._unpack_string(data, offset)
+        current_hash, offset = cls._unpack_string(data, offset)
+        count, = cls.LENGTH.unpack_from(data, offset)
+        offset += cls.LENGTH.size
+        transactions = []
+        for i in xrange(count):
+            length, = cls.LENGTH.unpack_from(data, offset)
+            offset += cls.LENGTH.size
+            transaction, end = cls.decode_transaction(data, offset)
+            cls._check_length(end, offset + length, "Transaction")
+            offset = end
+            transactions.append(transaction)
+        block = Block(index, transactions, previous_hash, timestamp, nonce)
+        block.block_header.version = version
+        return block, current_hash, offset
+
+    @classmethod
+    def _envelope(cls, kind, payload):
+        return cls.ENVELOPE.pack(cls.MAGIC, cls.VERSION, kind, len(payload)) + payload
+
+    @classmethod
+    def _check_envelope(cls, data, kind):
+        """
+        :raises InvalidEncoding: if the data doesn't start with an envelope of the kind in a version this node reads
+        :return: payload length
+        :rtype: int
+        """
+        if len(data) < cls.ENVELOPE.size:
+            raise InvalidEncoding("Truncated message")
+        magic, version, message_kind, length = cls.ENVELOPE.unpack_from(data, 0)
+        if magic != cls.MAGIC:
+            raise InvalidEncoding("Not a {} message".format(cls.CONTENT_TYPE))
+        if version != cls.VERSION:
+            raise InvalidEncoding("Unsupported format version {}".format(version))
+        if message_kind != kind:
+            raise InvalidEncoding("Expected message kind {}, got {}".format(kind, message_kind))
+        return length
+
+    @classmethod
+    def _open_envelope(cls, data, kind):
+        """
+        :raises InvalidEncoding: if the data is not a complete message of the kind in a version this node reads
+        :return: offset of the payload
+        :rtype: int
+        """
+        if len(data) - cls.ENVELOPE.size != cls._check_envelope(data, kind):
+            raise InvalidEncoding("Payload length mismatch")
+        return cls.ENVELOPE.size
+
+    @classmethod
+    def encode_block(cls, block):
+        return cls._envelope(cls.BLOCK, cls.encode_block_payload(block))
+
+    @classmethod
+    def decode_block(cls, data):
+        """
+        :raises InvalidEncoding: if the message is malformed
+        :return: the block and the hash the sender claims for it
+        :rtype: tuple
+        """
+        offset = cls._open_envelope(data, cls.BLOCK)
+        try:
+            block, current_hash, offset = cls.decode_block_payload(data, offset)
+        except (struct.error, InvalidTransactions) as e:
+            raise InvalidEncoding(str(e))
+        cls._check_length(offset, len(data), "Payload")
+        return block, current_hash
+
+    @classmethod
+    def encode_blocks(cls, blocks):
+        parts = [cls.LENGTH.pack(len(blocks))]
+        parts.extend(cls._pack_sized(cls.encode_block_payload(block)) for block in blocks)
+        return cls._envelope(cls.BLOCKS, "".join(parts))
+
+    @classmethod
+    def decode_blocks(cls, data):
+        """
+        :raises InvalidEncoding: if the message is malformed
+        :return: pairs of block and the hash the sender claims for it
+        :rtype: list of tuple
+        """
+        offset = cls._open_envelope(data, cls.BLOCKS)
+        try:
+            count, = cls.LENGTH.unpack_from(data, offset)
+            offset += cls.LENGTH.size
+            blocks = []
+            for i in xrange(count):
+                length, = cls.LENGTH.unpack_from(data, offset)
+                offset += cls.LENGTH.size
+                block, current_hash, end = cls.decode_block_payload(data, offset)
+                cls._check_length(end, offset + length, "Block")
+                offset = end
+                blocks.append((block, current_hash))
+        except (struct.error, InvalidTransactions) as e:
+            raise InvalidEncoding(str(e))
+        cls._check_length(offset, len(data), "Payload")
+        return blocks
+
+    @classmethod
+    def iter_decode_blocks(cls, chunks):
+        """
+        Decodes a block list message as it arrives in chunks, yielding each block as soon as its bytes are in
+
+        :raises InvalidEncoding: if the message is malformed or ends early
+        :return: pairs of block and the hash the sender claims for it
+        :rtype: generator
+        """
+        reader = _ChunkReader(chunks)
+        length = cls._check_envelope(reader.read(cls.ENVELOPE.size), cls.BLOCKS)
+        count, = cls.LENGTH.unpack(reader.read(cls.LENGTH.size))
+        consumed = cls.LENGTH.size
+        for i in xrange(count):
+            block_length, = cls.LENGTH.unpack(reader.read(cls.LENGTH.size))
+            consumed += cls.LENGTH.size + block_length
+            if consumed > length:
+                raise InvalidEncoding("Payload length mismatch")
+            try:
+                block, current_hash, offset = cls.decode_block_payload(reader.read(block_length))
+            except (struct.error, InvalidTransactions) as e:
+                raise InvalidEncoding(str(e))
+            cls._check_length(offset, block_length, "Block")
+            yield block, current_hash
+        if consumed != length or not reader.at_end():
+            raise InvalidEncoding("Payload length mismatch")
+
+
+class _ChunkReader(object):
+    """
+    Reads exact byte counts from an iterable of chunks of any size
+    """
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._buffer = ""
+
+    def read(self, size):
+        """
+        :raises InvalidEncoding: if the chunks run out first
+        """
+        parts = [self._buffer]
+        available = len(self._buffer)
+        while available < size:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                raise InvalidEncoding("Truncated message")
+            parts.append(chunk)
+            available += len(chunk)
+        data = "".join(parts)
+        self._buffer = data[size:]
+        return data[:size]
+
+    def at_end(self):
+        if self._buffer:
+            return False
+        for chunk in self._chunks:
+            if chunk:
+                self._buffer = chunk
+                return False
+        return True
+
+
+class EncodedBlockCache(object):
+    """
+    Least recently used cache of serialized blocks, json and binary, keyed by block hash.  A connected
+    block never changes, so the routes that serve single blocks send these bytes instead of encoding the
+    block again for every peer polling the tip.
+    """
+
+    CAPACITY = config['network']['encoded_block_cache_size']
+    JSON = 'application/json'
+
+    def __init__(self, capacity=CAPACITY):
+        self.capacity = capacity
+        self._lock = threading.Lock()
+        self._encodings = OrderedDict()
+
+    ENCODERS = {
+        JSON: lambda block: block.to_json(),
+        BinaryCodec.CONTENT_TYPE: BinaryCodec.encode_block
+    }
+
+    @classmethod
+    def _encode(cls, block, encodings=None):
+        encodings = dict(encodings or {})
+        for content_type, encode in cls.ENCODERS.items():
+            if content_type not in encodings:
+                encodings[content_type] = encode(block)
+        return encodings
+
+    def put(self, block, encodings=None):
+        """
+        Encodes a block that was just connected, before any peer asks for it.  Encodings that are already
+        cached, or given, e.g. the bytes the block was received as, are kept rather than encoded again.
+
+        :param encodings: serialized copies of the block, keyed by content type
+        :type encodings: dict
+        """
+        block_hash = block.current_hash
+        with self._lock:
+            cached = self._encodings.get(block_hash)
+        if cached is not None:
+            cached = dict(cached)
+            cached.update(encodings or {})
+            encodings = cached
+        encodings = self._encode(block, encodings)
+        with self._lock:
+            self._store(block_hash, encodings)
+
+    def get(self, block, content_type):
+        """
+        :return: the block serialized as the content type, encoded now if it wasn't cached
+        :rtype: str
+        """
+        block_hash = block.current_hash
+        with self._lock:
+            encodings = self._encodings.pop(block_hash, None)
+            if encodings is not None:
+                self._encodings[block_hash] = encodings
+                return encodings[content_type]
+        encodings = self._encode(block)
+        with self._lock:
+            self._store(block_hash, encodings)
+        return encodings[content_type]
+
+    def _store(self, block_hash, encodings):
+        self._encodings.pop(block_hash, None)
+        if len(self._encodings) >= self.capacity:
+            self._encodings.popitem(last=False)
+        self._encodings[block_hash] = encodings
+
+    def __contains__(self, block_hash):
+        with self._lock:
+            return block_hash in self._encodings
+
+    def __len__(self):
+        return len(self._encodings)
+
+
+if __name__ == "__main__":
+    pass
@@ -9,6 +9,10 @@ class InvalidHash(BlockchainException):
     pass
 
 
+class InvalidBlockHeader(BlockchainException):
+    pass
+
+
 class ChainContinuityError(BlockchainException):
     pass
 
@@ -27,3 +31,7 @@ class InvalidTransactionHash(Exception):
 
 class InvalidCoinbaseTransaction(BlockchainException):
     pass
+
+
+class InvalidEncoding(Exception):
+    pass
@@ -0,0 +1,112 @@
+import threading
+from array import array
+
+from config import *
+
+
+class HeaderChain(object):
+    """
+    Dense copy of the chain's block headers, one entry per height, kept in fixed width arrays: hash and
+    previous hash as 32 raw bytes, timestamp, hash difficulty and nonce.  Continuity checks, difficulty
+    retargeting and fork finding read it instead of the Block objects, so they don't need the block bodies.
+    """
+
+    HASH_SIZE = 32
+    # largest timestamp or nonce the arrays hold
+    MAX_FIELD_VALUE = 2 ** (8 * array('L').itemsize) - 1
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._hashes = bytearray()
+        self._previous_hashes = bytearray()
+        self._timestamps = array('L')
+        self._difficulties = array('B')
+        self._nonces = array('L')
+
+    @classmethod
+    def _pack_hash(cls, block_hash):
+        # the genesis block has no previous hash
+        return block_hash.decode('hex') if block_hash else '\0' * cls.HASH_SIZE
+
+    @classmethod
+    def _unpack_hash(cls, packed_hash):
+        return "" if packed_hash == '\0' * cls.HASH_SIZE else str(packed_hash).encode('hex')
+
+    def _slice(self, hashes, height):
+        if height < 0:
+            height += len(self)
+        if not 0 <= height < len(self):
+            raise IndexError("header height out of range: {}".format(height))
+        return hashes[height * self.HASH_SIZE:(height + 1) * self.HASH_SIZE]
+
+    def append(self, block):
+        self.append_header(
+            block.current_hash,
+            block.previous_hash,
+            block.block_header.timestamp,
+            block.hash_difficulty,
+            block.block_header.nonce
+        )
+
+    def append_header(self, block_hash, previous_hash, timestamp, difficulty, nonce):
+        """
+        :raises OverflowError, TypeError: if a field doesn't fit its array; the chain is left unchanged
+        """
+        # pack every field before extending any array, so a header is appended whole or not at all
+        packed_hash = self._pack_hash(block_hash)
+        packed_previous_hash = self._pack_hash(previous_hash)
+        timestamps = array('L', [timestamp])
+        difficulties = array('B', [difficulty])
+        nonces = array('L', [nonce])
+        with self._lock:
+            self._hashes.extend(packed_hash)
+            self._previous_hashes.extend(packed_previous_hash)
+            self._timestamps.extend(timestamps)
+            self._difficulties.extend(difficulties)
+            self._nonces.extend(nonces)
+
+    def truncate(self, height):
+        """
+        Drops the headers from height on, e.g. back to the fork point of a reorg
+        """
+        with self._lock:
+            del self._hashes[height * self.HASH_SIZE:]
+            del self._previous_hashes[height * self.HASH_SIZE:]
+            del self._timestamps[height:]
+            del self._difficulties[height:]
+            del self._nonces[height:]
+
+    def get_hash(self, height):
+        return self._unpack_hash(self._slice(self._hashes, height))
+
+    def get_previous_hash(self, height):
+        return self._unpack_hash(self._slice(self._previous_hashes, height))
+
+    def get_timestamp(self, height):
+        return self._timestamps[height]
+
+    def get_difficulty(self, height):
+        return self._difficulties[height]
+
+    def get_nonce(self, height):
+        return self._nonces[height]
+
+    def get_height(self, block_hash):
+        """
+        :return: height of the block with the hash, or None if it is not in the chain
+        :rtype: int
+        """
+        packed_hash = self._pack_hash(block_hash)
+        position = self._hashes.find(packed_hash)
+        while position != -1:
+            if position % self.HASH_SIZE == 0:
+                return position / self.HASH_SIZE
+            position = self._hashes.find(packed_hash, position + 1)
+        return None
+
+    def __len__(self):
+        return len(self._timestamps)
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,47 @@
+import threading
+from collections import OrderedDict
+
+from config import *
+
+
+class RecentlySeen(object):
+    """
+    Bounded set of recently seen block and transaction hashes.  Once full, the oldest hashes are forgotten first.
+    """
+
+    def __init__(self, capacity=config['network']['inventory_size']):
+        self.capacity = capacity
+        self._lock = threading.Lock()
+        self._hashes = OrderedDict()
+
+    def add(self, item_hash):
+        """
+        :return: True if the hash had not been seen before
+        :rtype: bool
+        """
+        with self._lock:
+            if item_hash in self._hashes:
+                return False
+            self._hashes[item_hash] = True
+            if len(self._hashes) > self.capacity:
+                self._hashes.popitem(last=False)
+            return True
+
+    def discard(self, item_hash):
+        with self._lock:
+            self._hashes.pop(item_hash, None)
+
+    def unseen(self, item_hashes):
+        with self._lock:
+            return [item_hash for item_hash in item_hashes if item_hash not in self._hashes]
+
+    def __contains__(self, item_hash):
+        with self._lock:
+            return item_hash in self._hashes
+
+    def __len__(self):
+        return len(self._hashes)
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,37 @@
+import threading
+
+from config import *
+
+
+class PriorityGate(object):
+    """
+    Holds back low priority work while high priority work is pending.  High priority work is bracketed
+    with enter() and leave(); low priority workers call wait() before picking up their next job.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._pending = 0
+
+    def enter(self):
+        with self._condition:
+            self._pending += 1
+
+    def leave(self):
+        with self._condition:
+            self._pending -= 1
+            if self._pending == 0:
+                self._condition.notify_all()
+
+    def wait(self):
+        with self._condition:
+            while self._pending > 0:
+                self._condition.wait()
+
+    def is_open(self):
+        with self._condition:
+            return self._pending == 0
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,311 @@
+import json
+import mmap
+import struct
+import zlib
+from multiprocessing import Lock
+
+from block import Block
+from config import *
+from transaction import *
+
+
+class SharedMempool(object):
+    """
+    Unconfirmed transactions kept in an anonymous shared memory map, so every process forked from the one that
+    created the pool (API, sync, mining workers) reads and writes the same transactions without pickling them
+    through a Manager proxy.
+
+    The map holds a header, an index of per slot columns (state, tx_hash, fee, sequence number, payload length,
+    heap position), a binary heap of used slots and fixed size payload slots holding the transactions as json.
+    Slots are addressed by a crc32 of the transaction hash with linear probing; once removals have left more
+    than REHASH_FRACTION of the slots as tombstones, the used slots are rehashed so probes stay short.  The heap
+    is ordered highest fee first, oldest first among equal fees, so the next transaction is popped in log time.
+    """
+
+    CAPACITY = config['network']['mempool_capacity']
+    SLOT_SIZE = config['network']['mempool_slot_size']
+    REHASH_FRACTION = 0.25
+
+    EMPTY = 0
+    USED = 1
+    DELETED = 2
+
+    HEADER = struct.Struct('<QQQ')  # count, next sequence number, deleted slots
+    STATE = struct.Struct('<B')
+    TX_HASH = struct.Struct('<32s')  # raw sha256 digest
+    FEE = struct.Struct('<d')
+    SEQUENCE = struct.Struct('<Q')
+    LENGTH = struct.Struct('<I')
+    POSITION = struct.Struct('<I')
+
+    def __init__(self, capacity=CAPACITY, slot_size=SLOT_SIZE):
+        self.capacity = capacity
+        self.slot_size = slot_size
+        self._lock = Lock()
+        self._states = self.HEADER.size
+        self._tx_hashes = self._states + capacity * self.STATE.size
+        self._fees = self._tx_hashes + capacity * self.TX_HASH.size
+        self._sequences = self._fees + capacity * self.FEE.size
+        self._lengths = self._sequences + capacity * self.SEQUENCE.size
+        self._positions = self._lengths + capacity * self.LENGTH.size
+        self._heap = self._positions + capacity * self.POSITION.size
+        self._payloads = self._heap + capacity * self.POSITION.size
+        # a new anonymous map is zero filled: every slot EMPTY and the header all zeros
+        self._map = mmap.mmap(-1, self._payloads + capacity * slot_size)
+
+    def _read_header(self):
+        return self.HEADER.unpack_from(self._map, 0)
+
+    def _read_transaction(self, slot):
+        length, = self.LENGTH.unpack_from(self._map, self._lengths + slot * self.LENGTH.size)
+        start = self._payloads + slot * self.slot_size
+        return Transaction.from_dict(json.loads(self._map[start:start + length]))
+
+    def _find(self, digest):
+        """
+        :return: the slot holding the raw transaction hash, and the first reusable slot on its probe sequence
+        :rtype: tuple
+        """
+        home = zlib.crc32(digest) % self.capacity
+        reusable = None
+        for i in xrange(self.capacity):
+            slot = (home + i) % self.capacity
+            state = ord(self._map[self._states + slot])
+            if state == self.EMPTY:
+                return None, slot if reusable is None else reusable
+            if state == self.DELETED:
+                if reusable is None:
+                    reusable = slot
+            elif self._map[self._tx_hashes + slot * self.TX_HASH.size:
+                           self._tx_hashes + (slot + 1) * self.TX_HASH.size] == digest:
+                return slot, reusable
+        return None, reusable
+
+    def _used_slots(self):
+        return [slot for slot, state in enumerate(self._map[self._states:self._tx_hashes])
+                if ord(state) == self.USED]
+
+    def _ordered_slots(self):
+        """
+        :return: used slots, highest fee first and oldest first among equal fees
+        :rtype: list
+        """
+        return sorted(self._used_slots(), key=self._priority)
+
+    def _priority(self, slot):
+        fee, = self.FEE.unpack_from(self._map, self._fees + slot * self.FEE.size)
+        sequence, = self.SEQUENCE.unpack_from(self._map, self._sequences + slot * self.SEQUENCE.size)
+        return -fee, sequence
+
+    def _heap_slot(self, position):
+        return self.POSITION.unpack_from(self._map, self._heap + position * self.POSITION.size)[0]
+
+    def _place(self, position, slot):
+        self.POSITION.pack_into(self._map, self._heap + position * self.POSITION.size, slot)
+        self.POSITION.pack_into(self._map, self._positions + slot * self.POSITION.size, position)
+
+    def _sift_up(self, position):
+        slot = self._heap_slot(position)
+        priority = self._priority(slot)
+        while position > 0:
+            parent = (position - 1) // 2
+            parent_slot = self._heap_slot(parent)
+            if self._priority(parent_slot) <= priority:
+                break
+            self._place(position, parent_slot)
+            position = parent
+        self._place(position, slot)
+
+    def _sift_down(self, position, count):
+        slot = self._heap_slot(position)
+        priority = self._priority(slot)
+        while True:
+            child = 2 * position + 1
+            if child >= count:
+                break
+            child_slot = self._heap_slot(child)
+            child_priority = self._priority(child_slot)
+            if child + 1 < count:
+                right_slot = self._heap_slot(child + 1)
+                right_priority = self._priority(right_slot)
+                if right_priority < child_priority:
+                    child, child_slot, child_priority = child + 1, right_slot, right_priority
+            if priority <= child_priority:
+                break
+            self._place(position, child_slot)
+            position = child
+        self._place(position, slot)
+
+    def _clear_slot(self, slot):
+        count, next_sequence, deleted = self._read_header()
+        count -= 1
+        # move the last heap entry into the freed position and restore the heap order around it
+        position, = self.POSITION.unpack_from(self._map, self._positions + slot * self.POSITION.size)
+        if position != count:
+            self._place(position, self._heap_slot(count))
+            self._sift_down(position, count)
+            self._sift_up(position)
+        self._map[self._states + slot] = chr(self.DELETED)
+        deleted += 1
+        self.HEADER.pack_into(self._map, 0, count, next_sequence, deleted)
+        if count == 0:
+            # nothing left to probe past, so drop the tombstones
+            self._map[self._states:self._tx_hashes] = chr(self.EMPTY) * self.capacity
+            self.HEADER.pack_into(self._map, 0, 0, next_sequence, 0)
+        elif deleted > self.capacity * self.REHASH_FRACTION:
+            self._rehash()
+
+    def _rehash(self):
+        """
+        Moves the used slots to their probe positions in a map without tombstones
+        """
+        count, next_sequence, deleted = self._read_header()
+        entries = []
+        for slot in self._ordered_slots():
+            length, = self.LENGTH.unpack_from(self._map, self._lengths + slot * self.LENGTH.size)
+            start = self._payloads + slot * self.slot_size
+            entries.append((self.TX_HASH.unpack_from(self._map, self._tx_hashes + slot * self.TX_HASH.size)[0],
+                            self._priority(slot), self._map[start:start + length]))
+        self._map[self._states:self._tx_hashes] = chr(self.EMPTY) * self.capacity
+        for position, (digest, (fee, sequence), payload) in enumerate(entries):
+            slot = self._find(digest)[1]
+            self._write_slot(slot, digest, -fee, sequence, payload)
+            # entries are in priority order, which is already a valid heap
+            self._place(position, slot)
+        self.HEADER.pack_into(self._map, 0, count, next_sequence, 0)
+
+    def _write_slot(self, slot, digest, fee, sequence, payload):
+        self.TX_HASH.pack_into(self._map, self._tx_hashes + slot * self.TX_HASH.size, digest)
+        self.FEE.pack_into(self._map, self._fees + slot * self.FEE.size, fee)
+        self.SEQUENCE.pack_into(self._map, self._sequences + slot * self.SEQUENCE.size, sequence)
+        self.LENGTH.pack_into(self._map, self._lengths + slot * self.LENGTH.size, len(payload))
+        start = self._payloads + slot * self.slot_size
+        self._map[start:start + len(payload)] = payload
+        self._map[self._states + slot] = chr(self.USED)
+
+    def push(self, transaction):
+        """
+        :return: False if the transaction is unsigned or already in the pool, its fee is negative, or the
+            pool is full
+        :rtype: bool
+        """
+        digest = transaction.raw_tx_hash
+        if digest is None:
+            return False
+        if not transaction.fee >= 0:
+            logger.warn('Transaction fee is negative: {}'.format(transaction.tx_hash))
+            return False
+        payload = transaction.to_json()
+        if len(payload) > self.slot_size:
+            logger.warn('Transaction too large for the mempool: {}'.format(transaction.tx_hash))
+            return False
+        with self._lock:
+            count, next_sequence, deleted = self._read_header()
+            slot, reusable = self._find(digest)
+            if slot is not None or reusable is None or count >= self.capacity:
+                return False
+            if ord(self._map[self._states + reusable]) == self.DELETED:
+                deleted -= 1
+            self._write_slot(reusable, digest, transaction.fee, next_sequence, payload)
+            self._place(count, reusable)
+            self._sift_up(count)
+            self.HEADER.pack_into(self._map, 0, count + 1, next_sequence + 1, deleted)
+            return True
+
+    def pop(self):
+        """
+        :return: the highest fee transaction, or None if the pool is empty
+        :rtype: Transaction
+        """
+        with self._lock:
+            count, next_sequence, deleted = self._read_header()
+            if count == 0:
+                return None
+            slot = self._heap_slot(0)
+            transaction = self._read_transaction(slot)
+            self._clear_slot(slot)
+            return transaction
+
+    def remove(self, tx_hash):
+        """
+        :param tx_hash: hex transaction hash
+        :return: True if the transaction was in the pool
+        :rtype: bool
+        """
+        digest = self._digest(tx_hash)
+        if digest is None:
+            return False
+        with self._lock:
+            slot, reusable = self._find(digest)
+            if slot is None:
+                return False
+            self._clear_slot(slot)
+            return True
+
+    @classmethod
+    def _digest(cls, tx_hash):
+        """
+        :return: the raw digest of a hex transaction hash, or None if it isn't one
+        :rtype: str
+        """
+        try:
+            digest = tx_hash.decode('hex')
+        except (AttributeError, TypeError, UnicodeError):
+            return None
+        return digest if len(digest) == cls.TX_HASH.size else None
+
+    def get_all(self):
+        """
+        :return: all transactions, highest fee first
+        :rtype: list
+        """
+        with self._lock:
+            return [self._read_transaction(slot) for slot in self._ordered_slots()]
+
+    def get_by_short_ids(self, block_hash, short_ids):
+        """
+        Finds the transactions a compact block refers to.  Short ids are computed from the tx_hash column, so
+        only the matching transactions are decoded.
+
+        :param block_hash: hash of the compact block, which salts its short ids
+        :type block_hash: str
+        :param short_ids: short ids to look for
+        :type short_ids: list
+        :return: the matching transactions, keyed by short id
+        :rtype: dict
+        """
+        wanted = set(short_ids)
+        matches = {}
+        with self._lock:
+            tx_hashes = self._map[self._tx_hashes:self._fees]
+            for slot in self._used_slots():
+                digest = tx_hashes[slot * self.TX_HASH.size:(slot + 1) * self.TX_HASH.size]
+                short_id = Block.short_transaction_id(block_hash, digest.encode('hex'))
+                if short_id in wanted:
+                    matches[short_id] = self._read_transaction(slot)
+        return matches
+
+    def __contains__(self, transaction):
+        """
+        :param transaction: a Transaction, or a hex transaction hash
+        """
+        if isinstance(transaction, Transaction):
+            digest = transaction.raw_tx_hash
+        else:
+            digest = self._digest(transaction)
+        if digest is None:
+            return False
+        with self._lock:
+            slot, reusable = self._find(digest)
+            return slot is not None
+
+    def __len__(self):
+        count, next_sequence, deleted = self._read_header()
+        return count
+
+    def __iter__(self):
+        return iter(self.get_all())
+
+
+if __name__ == "__main__":
+    pass
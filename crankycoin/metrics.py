@@ -0,0 +1,41 @@
+import threading
+
+from config import *
+
+
+class Metrics(object):
+    """
+    Thread safe counters and gauges reported by a node's /metrics route
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._gauges = {}
+
+    def increment(self, name, amount=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + amount
+
+    def set_gauge(self, name, value):
+        with self._lock:
+            self._gauges[name] = value
+
+    def get_counter(self, name):
+        with self._lock:
+            return self._counters.get(name, 0)
+
+    def get_gauge(self, name):
+        with self._lock:
+            return self._gauges.get(name)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "counters": dict(self._counters),
+                "gauges": dict(self._gauges)
+            }
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,119 @@
+import time
+from multiprocessing import Pipe, Process
+
+from block import *
+
+
+POLL_INTERVAL = 100
+
+
+def mine_work_units(work_connection, result_connection):
+    """
+    Mining worker loop.  Receives (job_id, block_header, difficulty, start_nonce, stop_nonce) work units
+    and answers (job_id, nonce) with a nonce satisfying the difficulty, or (job_id, None) once the range is
+    exhausted.  A work unit arriving while another is in progress abandons the current one without an answer.
+    Receiving None stops the worker.
+    """
+    work_unit = work_connection.recv()
+    while work_unit is not None:
+        job_id, block_header, difficulty, start_nonce, stop_nonce = work_unit
+        solution = None
+        abandoned = False
+        for nonce in xrange(start_nonce, stop_nonce):
+            if nonce % POLL_INTERVAL == 0 and work_connection.poll():
+                abandoned = True
+                break
+            block_header.nonce = nonce
+            if meets_difficulty(calculate_hash(block_header.to_hashable()), difficulty):
+                solution = nonce
+                break
+        if not abandoned:
+            result_connection.send((job_id, solution))
+        work_unit = work_connection.recv()
+    result_connection.close()
+
+
+class Miner(object):
+    """
+    Farms nonce ranges for a block header out to mining worker processes over pipes.  The worker processes
+    hold no chain state; the node that owns the blockchain decides what to mine and when work is stale.
+
+    Pipes are simplex since gevent (pulled in by grequests) makes the sockets behind duplex pipes non-blocking.
+    """
+
+    WORKERS = config['network']['mining_workers']
+    WORK_UNIT_SIZE = config['network']['mining_work_unit_size']
+    POLL_TIMEOUT = 0.05
+
+    def __init__(self, workers=WORKERS):
+        self.job_id = 0
+        self.work_connections = []
+        self.result_connections = []
+        self.processes = []
+        for i in range(workers):
+            work_receiver, work_sender = Pipe(duplex=False)
+            result_receiver, result_sender = Pipe(duplex=False)
+            process = Process(target=mine_work_units, args=(work_receiver, result_sender))
+            process.daemon = True
+            process.start()
+            self.work_connections.append(work_sender)
+            self.result_connections.append(result_receiver)
+            self.processes.append(process)
+
+    def solve(self, block_header, difficulty, is_stale):
+        """
+        :param is_stale: called between polls.  Returning True abandons the work.
+        :type is_stale: function
+        :return: nonce satisfying the difficulty, or None if the work went stale
+        :rtype: int
+        """
+        self.job_id += 1
+        next_nonce = 0
+        for work_connection in self.work_connections:
+            work_connection.send((self.job_id, block_header, difficulty, next_nonce, next_nonce + self.WORK_UNIT_SIZE))
+            next_nonce += self.WORK_UNIT_SIZE
+
+        while not is_stale():
+            idle = True
+            for work_connection, result_connection in zip(self.work_connections, self.result_connections):
+                if not result_connection.poll():
+                    continue
+                idle = False
+                job_id, nonce = result_connection.recv()
+                if job_id != self.job_id:
+                    # answer to an abandoned job.  the worker is already busy with the current one
+                    continue
+                if nonce is not None:
+                    self.abandon()
+                    return nonce
+                work_connection.send((self.job_id, block_header, difficulty, next_nonce, next_nonce + self.WORK_UNIT_SIZE))
+                next_nonce += self.WORK_UNIT_SIZE
+            if idle:
+                time.sleep(self.POLL_TIMEOUT)
+        self.abandon()
+        return None
+
+    def abandon(self):
+        """
+        Stops the workers' current work units by handing them an empty one
+        """
+        self.job_id += 1
+        for work_connection in self.work_connections:
+            work_connection.send((self.job_id, None, 0, 0, 0))
+
+    def shutdown(self, force=False):
+        for work_connection in self.work_connections:
+            try:
+                work_connection.send(None)
+            except IOError:
+                # worker already gone
+                pass
+        for process in self.processes:
+            if force is True:
+                process.terminate()
+            else:
+                process.join(1)
+
+
+if __name__ == "__main__":
+    pass
@@ -1,32 +1,207 @@
 import grequests
+import itertools
+import os
+import random
 import requests
+import threading
+import time
+from functools import wraps
 from klein import Klein
-from multiprocessing import Process
-from Queue import Empty, Full
+from Queue import Empty, Full, Queue
+from twisted.internet import reactor
+from twisted.internet.defer import Deferred
+from twisted.internet.threads import deferToThreadPool
+from twisted.python.failure import Failure
+from twisted.python.threadpool import ThreadPool
+from twisted.web.server import Site
 
 from blockchain import *
+from blockfile import BlockFile
+from codec import BinaryCodec, EncodedBlockCache
+from inventory import RecentlySeen
+from lanes import PriorityGate
+from metrics import Metrics
+from miner import Miner
+from peers import PeerHealth
+from streaming import ChunkProducer, JsonArrayParser, ResponseCompression
 from transaction import *
+from wire import PeerWire, WireRequestFailed
+
+
+class ResponseRecorder(object):
+    """
+    Stands in for a request while its handler runs off the reactor thread.  The response code and headers
+    the handler sets are recorded, then applied to the request on the reactor thread by apply(); everything
+    else is read from the request.
+    """
+
+    def __init__(self, request):
+        self.request = request
+        self.code = None
+        self.headers = []
+
+    def __getattr__(self, name):
+        return getattr(self.request, name)
+
+    def setResponseCode(self, code):
+        self.code = code
+
+    def setHeader(self, name, value):
+        self.headers.append((name, value))
+
+    def apply(self, result):
+        """
+        Deferred callback: sets the recorded response code and headers on the request and passes the result on
+        """
+        if self.code is not None:
+            self.request.setResponseCode(self.code)
+        for name, value in self.headers:
+            self.request.setHeader(name, value)
+        return result
+
+
+def offload(handler):
+    """
+    Runs a route handler on the node's validation thread pool and returns a Deferred, so the
+    reactor thread stays free to answer cheap requests while blocks and transactions are validated.
+    """
+    @wraps(handler)
+    def wrapper(self, request, *args, **kwargs):
+        recorder = ResponseRecorder(request)
+        d = deferToThreadPool(reactor, self.validation_pool, handler, self, recorder, *args, **kwargs)
+        return d.addBoth(recorder.apply)
+    return wrapper
+
+
+def enqueue_transactions(handler):
+    """
+    Queues a route handler for the node's transaction workers and returns a Deferred.  Answers 503 straight
+    away when the transaction queue is full, so a transaction flood is shed instead of delaying blocks.
+    """
+    @wraps(handler)
+    def wrapper(self, request, *args, **kwargs):
+        d = Deferred()
+        recorder = ResponseRecorder(request)
+        try:
+            self.transaction_queue.put_nowait((d, handler, (self, recorder) + args, kwargs))
+        except Full:
+            request.setResponseCode(503)  # service unavailable
+            return json.dumps({'message': 'Transaction queue full'})
+        return d.addBoth(recorder.apply)
+    return wrapper
 
 
 class NodeMixin(object):
 
     FULL_NODE_PORT = config['network']['full_node_port']
     NODES_URL = config['network']['nodes_url']
+    INVENTORY_URL = config['network']['inventory_url']
     TRANSACTIONS_URL = config['network']['transactions_url']
+    TRANSACTIONS_BATCH_URL = config['network']['transactions_batch_url']
     BLOCK_URL = config['network']['block_url']
     BLOCKS_RANGE_URL = config['network']['blocks_range_url']
     BLOCKS_URL = config['network']['blocks_url']
+    COMPACT_BLOCKS_URL = config['network']['compact_blocks_url']
+    TIP_URL = config['network']['tip_url']
     TRANSACTION_HISTORY_URL = config['network']['transaction_history_url']
     BALANCE_URL = config['network']['balance_url']
+    PEER_DISCOVERY_INTERVAL = config['network']['peer_discovery_interval']
+    PEER_TABLE_TTL = config['network']['peer_table_ttl']
+    REQUEST_TIMEOUT = config['network']['request_timeout']
+    MAX_TRANSACTIONS_PER_REQUEST = config['network']['max_transactions_per_request']
+    MAX_BLOCKS_PER_RESPONSE = config['network']['max_blocks_per_response']
+    MAX_BLOCK_SIZE = config['network']['max_block_size']
+    STREAM_CHUNK_SIZE = config['network']['stream_chunk_size']
+    VALIDATION_THREADS = config['network']['validation_threads']
+    BLOCK_QUEUE_SIZE = config['network']['block_queue_size']
+    TRANSACTION_QUEUE_SIZE = config['network']['transaction_queue_size']
+    TRANSACTION_WORKERS = config['network']['transaction_workers']
+    SYNC_INTERVAL = config['network']['sync_interval']
+    SYNC_JITTER = config['network']['sync_jitter']
+    SYNC_LAG_THRESHOLD = config['network']['sync_lag_threshold']
+    SYNC_BACKOFF_MAX = config['network']['sync_backoff_max']
+    BLOCK_SAVE_INTERVAL = config['network']['block_save_interval']
+    WIRE_ENABLED = config['network']['wire_enabled']
     DNS_SEEDS = config['network']['dns_seeds']
     SEED_NODES = config['network']['seed_nodes']
+    # peers that don't speak the binary format answer with json
+    BLOCK_ACCEPT = {'Accept': '{}, application/json;q=0.5'.format(BinaryCodec.CONTENT_TYPE)}
+    HOST_HEADER = 'X-Crankycoin-Host'
+    # set on a page of GET /blocks when more blocks follow it
+    NEXT_START_HEADER = 'X-Crankycoin-Next-Start'
 
     full_nodes = set(SEED_NODES)
+    full_nodes_refreshed_at = 0
+    # held while full_nodes is read or changed, since the API, discovery, sync and broadcast threads all use it
+    full_nodes_lock = threading.Lock()
+    peer_discovery_thread = None
+    _peer_health = None
+
+    @property
+    def peer_health(self):
+        if self._peer_health is None:
+            self._peer_health = PeerHealth()
+        return self._peer_health
+
+    def get_healthy_nodes(self):
+        """
+        :return: known peers that are not backed off, fastest first
+        :rtype: list
+        """
+        return self.peer_health.rank(self.get_full_nodes())
+
+    def get_full_nodes(self):
+        """
+        :return: a snapshot of the known peers, safe to iterate while other threads add and evict peers
+        :rtype: list
+        """
+        with self.full_nodes_lock:
+            return list(self.full_nodes)
+
+    def _request(self, method, node, url, **kwargs):
+        """
+        Issues an HTTP request to a peer with a timeout, recording its latency or failure.
+        Request exceptions are re-raised after the failure has been recorded.
+        """
+        start = time.time()
+        try:
+            response = method(url, timeout=self.REQUEST_TIMEOUT, **kwargs)
+        except requests.exceptions.RequestException:
+            self.record_peer_failure(node)
+            raise
+        self.peer_health.record_success(node, time.time() - start)
+        return response
+
+    def record_peer_failure(self, node):
+        """
+        Records a failed request or a bad answer from a peer, evicting it once it has failed too often
+        """
+        if self.peer_health.record_failure(node):
+            self.remove_node(node)
+
+    @staticmethod
+    def _is_binary(response):
+        return response.headers.get('Content-Type') == BinaryCodec.CONTENT_TYPE
+
+    @staticmethod
+    def _json_blocks(response):
+        """
+        Peers that predate single layer block routes send each block as a json string of json, so those
+        blocks are decoded twice
+        """
+        payload = response.json()
+        if isinstance(payload, list):
+            return [FullNode._json_block(block) for block in payload]
+        return FullNode._json_block(payload)
+
+    @staticmethod
+    def _json_block(payload):
+        return json.loads(payload) if isinstance(payload, basestring) else payload
 
     def request_nodes(self, node, port):
         url = self.NODES_URL.format(node, port)
         try:
-            response = requests.get(url)
+            response = self._request(requests.get, node, url)
             if response.status_code == 200:
                 all_nodes = response.json()
                 return all_nodes
@@ -35,188 +210,543 @@ class NodeMixin(object):
         return None
 
     def request_nodes_from_all(self):
-        full_nodes = self.full_nodes.copy()
-        bad_nodes = set()
+        with self.full_nodes_lock:
+            known_nodes = self.full_nodes.copy()
+        full_nodes = known_nodes.copy()
 
-        for node in full_nodes:
+        for node in self.get_healthy_nodes():
             all_nodes = self.request_nodes(node, self.FULL_NODE_PORT)
             if all_nodes is not None:
                 full_nodes = full_nodes.union(all_nodes["full_nodes"])
-            else:
-                bad_nodes.add(node)
-        self.full_nodes = full_nodes
-
-        for node in bad_nodes:
-            self.remove_node(node)
+        with self.full_nodes_lock:
+            # don't resurrect peers that were evicted while we were asking around, or drop ones that were added
+            evicted_nodes = known_nodes.difference(self.full_nodes)
+            self.full_nodes = self.full_nodes.union(full_nodes.difference(evicted_nodes))
+        self.full_nodes_refreshed_at = time.time()
         return
 
+    def refresh_nodes(self):
+        """
+        Re-discovers peers only once the cached peer table is older than PEER_TABLE_TTL.
+        Nodes running the peer discovery scheduler keep the table fresh, so this is
+        normally a no-op on the broadcast path.
+        """
+        if time.time() - self.full_nodes_refreshed_at >= self.PEER_TABLE_TTL:
+            self.request_nodes_from_all()
+
+    def start_peer_discovery(self):
+        if self.peer_discovery_thread is not None and self.peer_discovery_thread.is_alive():
+            return
+        self.peer_discovery_thread = threading.Thread(target=self._discover_peers)
+        self.peer_discovery_thread.daemon = True
+        self.peer_discovery_thread.start()
+
+    def _discover_peers(self):
+        while True:
+            time.sleep(self.PEER_DISCOVERY_INTERVAL)
+            try:
+                self.request_nodes_from_all()
+            except Exception as e:
+                logger.warning("Peer discovery failed: %s", e)
+
     def remove_node(self, node):
-        # nodeset.discard(node)
-        pass
+        logger.info("Evicting unresponsive node %s", node)
+        with self.full_nodes_lock:
+            self.full_nodes.discard(node)
+        self.peer_health.forget(node)
 
     def broadcast_transaction(self, transaction):
-        self.request_nodes_from_all()
-        bad_nodes = set()
+        self.refresh_nodes()
         data = {
             "transaction": transaction.to_json()
         }
 
-        for node in self.full_nodes:
+        for node in self.get_healthy_nodes():
             url = self.TRANSACTIONS_URL.format(node, self.FULL_NODE_PORT)
             try:
-                response = requests.post(url, json=data)
+                response = self._request(requests.post, node, url, json=data)
             except requests.exceptions.RequestException as re:
-                bad_nodes.add(node)
-        for node in bad_nodes:
-            self.remove_node(node)
-        bad_nodes.clear()
+                pass
         return
         # TODO: convert to grequests and return list of responses
 
+    def broadcast_transactions(self, transactions):
+        """
+        Submits transactions to every node in batches of at most MAX_TRANSACTIONS_PER_REQUEST
+
+        :return: whether each transaction was accepted by at least one node
+        :rtype: list of bool
+        """
+        self.refresh_nodes()
+        accepted = [False] * len(transactions)
+
+        for start in range(0, len(transactions), self.MAX_TRANSACTIONS_PER_REQUEST):
+            data = {
+                "transactions": [t.to_json() for t in transactions[start:start + self.MAX_TRANSACTIONS_PER_REQUEST]]
+            }
+            for node in self.get_healthy_nodes():
+                url = self.TRANSACTIONS_BATCH_URL.format(node, self.FULL_NODE_PORT)
+                try:
+                    response = self._request(requests.post, node, url, json=data)
+                    if response.status_code == 200:
+                        for i, result in enumerate(response.json()["results"]):
+                            accepted[start + i] = accepted[start + i] or result["success"]
+                except requests.exceptions.RequestException as re:
+                    pass
+        return accepted
+
 
 class FullNode(NodeMixin):
     NODE_TYPE = "full"
     blockchain = None
     app = Klein()
+    _inventory = None
+    _validation_pool = None
+    _block_queue = None
+    _block_gate = None
+    _transaction_queue = None
+    _sync_lock = None
+    _metrics = None
+    _block_cache = None
+    _compression = None
+    block_file = None
+    peer_wire = None
+    block_processing_thread = None
+    transaction_processing_threads = None
+    sync_thread = None
+    block_path = None
+    block_save_thread = None
+    _save_lock = None
 
     def __init__(self, host, reward_address, **kwargs):
         self.host = host
         self.request_nodes_from_all()
         self.reward_address = reward_address
         self.broadcast_node(host)
-        self.full_nodes.add(host)
+        with self.full_nodes_lock:
+            self.full_nodes.add(host)
 
-        block_path = kwargs.get("block_path")
-        if block_path is None:
-            self.blockchain = Blockchain()
+        # created before the sync, mining and block processing threads that share it start
+        self._sync_lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        # the chain is saved back to block_path periodically and on shutdown
+        self.block_path = kwargs.get("block_path")
+        if self.block_path is None or not os.path.exists(self.block_path):
+            self.blockchain = Blockchain(metrics=self.metrics)
         else:
-            self.load_blockchain(block_path)
+            self.load_blockchain(self.block_path)
 
         mining = kwargs.get("mining")
         if mining is True:
             self.NODE_TYPE = "miner"
-            self.mining_process = Process(target=self.mine)
-            self.mining_process.start()
+            self.miner = Miner()
+            self.mining_thread = threading.Thread(target=self.mine)
+            self.mining_thread.daemon = True
+            self.mining_thread.start()
             logger.debug("mining node started on %s with reward address of %s...", host, reward_address)
+        self.start_block_processing()
+        self.start_transaction_processing()
         logger.debug("full node server starting on %s with reward address of %s...", host, reward_address)
-        self.node_process = Process(target=self.app.run, args=(host, self.FULL_NODE_PORT))
-        self.node_process.start()
+        # the reactor, miner and sync all share this process' blockchain
+        reactor.listenTCP(self.FULL_NODE_PORT, Site(self.app.resource()), interface=host)
+        if self.WIRE_ENABLED:
+            # full nodes gossip over persistent framed connections; the HTTP API stays for clients
+            self.peer_wire = PeerWire(
+                host,
+                self._wire_handlers(),
+                headers={PeerWire.BLOCK: {'Content-Type': BinaryCodec.CONTENT_TYPE}},
+                host_header=self.HOST_HEADER
+            )
+            self.peer_wire.listen(host)
+        self.node_thread = threading.Thread(target=reactor.run, kwargs={"installSignalHandlers": False})
+        self.node_thread.daemon = True
+        self.node_thread.start()
         logger.debug("full node server started on %s with reward address of %s...", host, reward_address)
+        self.start_peer_discovery()
+        self.start_sync_scheduler()
+        self.start_block_saving()
 
     def shutdown(self, force=False):
-        self.blockchain.unconfirmed_transactions.close()
-        if force is True:
-            self.blockchain.unconfirmed_transactions.cancel_join_thread()
-            if self.NODE_TYPE == "miner":
-                self.mining_process.terminate()
-            self.node_process.terminate()
+        if self.NODE_TYPE == "miner":
+            self.miner.shutdown(force)
+        self._save_blocks()
+        reactor.callFromThread(reactor.stop)
+        if force is not True:
+            self.node_thread.join(1)
+
+    def _wire_handlers(self):
+        """
+        :return: the route handler that answers each wire message kind
+        :rtype: dict
+        """
+        return {
+            PeerWire.INVENTORY: self.post_inventory,
+            PeerWire.TRANSACTION: self.post_transactions,
+            PeerWire.TRANSACTIONS: self.post_transactions_batch,
+            PeerWire.BLOCK: self.post_block,
+            PeerWire.COMPACT_BLOCK: self.post_compact_block,
+            PeerWire.TIP: self.get_tip
+        }
+
+    def _peer_request(self, node, kind, url, data=None):
+        """
+        Sends a gossip message to a peer over its wire connection, or as an HTTP request to url if the
+        peer can't be reached on the wire.  Messages with data are posted as json; the others are GETs.
+
+        :raises requests.exceptions.RequestException: if the request fails, over the wire or HTTP
+        :return: a response with status_code and json()
+        """
+        if self.peer_wire is not None:
+            start = time.time()
+            try:
+                response = self.peer_wire.request(node, kind, json.dumps(data) if data is not None else "")
+            except WireRequestFailed as e:
+                # the peer may already have handled the message, so it is not sent again over HTTP
+                self.record_peer_failure(node)
+                raise requests.exceptions.RequestException(str(e))
+            if response is not None:
+                self.peer_health.record_success(node, time.time() - start)
+                return response
+        if data is None:
+            return self._request(requests.get, node, url)
+        return self._request(requests.post, node, url, json=data)
+
+    @property
+    def inventory(self):
+        """
+        Hashes of blocks and transactions this node has already received, mined or announced
+        """
+        if self._inventory is None:
+            self._inventory = RecentlySeen()
+        return self._inventory
+
+    @property
+    def validation_pool(self):
+        """
+        Thread pool for CPU heavy validation and the outbound requests it triggers.
+        Created inside the process that runs the reactor.
+        """
+        if self._validation_pool is None:
+            self._validation_pool = ThreadPool(minthreads=1, maxthreads=self.VALIDATION_THREADS, name="validation")
+            self._validation_pool.start()
+            reactor.addSystemEventTrigger('before', 'shutdown', self._validation_pool.stop)
+        return self._validation_pool
+
+    @property
+    def metrics(self):
+        if self._metrics is None:
+            self._metrics = Metrics()
+        return self._metrics
+
+    @property
+    def block_cache(self):
+        """
+        Serialized copies of connected blocks, served by the single block route
+        """
+        if self._block_cache is None:
+            self._block_cache = EncodedBlockCache()
+        return self._block_cache
+
+    @property
+    def compression(self):
+        """
+        Negotiated compression for the block range and transaction history routes
+        """
+        if self._compression is None:
+            self._compression = ResponseCompression(metrics=self.metrics)
+        return self._compression
+
+    @property
+    def block_queue(self):
+        """
+        Received blocks that passed the cheap checks and wait for the block processing thread
+        """
+        if self._block_queue is None:
+            self._block_queue = Queue(self.BLOCK_QUEUE_SIZE)
+        return self._block_queue
+
+    @property
+    def block_gate(self):
+        """
+        Open while no received block is queued or being processed.  Transaction workers wait on it,
+        so blocks are always handled first.
+        """
+        if self._block_gate is None:
+            self._block_gate = PriorityGate()
+        return self._block_gate
+
+    @property
+    def transaction_queue(self):
+        """
+        Transaction route handlers waiting for the transaction workers
+        """
+        if self._transaction_queue is None:
+            self._transaction_queue = Queue(self.TRANSACTION_QUEUE_SIZE)
+        return self._transaction_queue
+
+    @property
+    def sync_lock(self):
+        """
+        Held while blocks are fetched from a peer and added to the chain
+        """
+        if self._sync_lock is None:
+            self._sync_lock = threading.Lock()
+        return self._sync_lock
+
+    def start_block_processing(self):
+        if self.block_processing_thread is not None and self.block_processing_thread.is_alive():
+            return
+        # create the queue and gate before the worker and request threads race to create them
+        if self._block_queue is None:
+            self._block_queue = Queue(self.BLOCK_QUEUE_SIZE)
+        if self._block_gate is None:
+            self._block_gate = PriorityGate()
+        self.block_processing_thread = threading.Thread(target=self._process_blocks)
+        self.block_processing_thread.daemon = True
+        self.block_processing_thread.start()
+
+    def _process_blocks(self):
+        while True:
+            block, remote_host, encodings = self.block_queue.get()
+            try:
+                if not self.process_block(block, remote_host, encodings):
+                    # the hash only covers the header, so a rejected body must not shadow the genuine block
+                    self.inventory.discard(block.current_hash)
+            except Exception as e:
+                # forget the block so it is accepted again when re-announced
+                self.inventory.discard(block.current_hash)
+                logger.warning("Processing block %s from %s failed: %s", block.index, remote_host, e)
+            finally:
+                self.block_gate.leave()
+
+    def start_transaction_processing(self):
+        if self.transaction_processing_threads is not None:
+            return
+        # create the queue and gate before the workers race to create them
+        if self._transaction_queue is None:
+            self._transaction_queue = Queue(self.TRANSACTION_QUEUE_SIZE)
+        if self._block_gate is None:
+            self._block_gate = PriorityGate()
+        self.transaction_processing_threads = []
+        for i in range(self.TRANSACTION_WORKERS):
+            thread = threading.Thread(target=self._process_transactions)
+            thread.daemon = True
+            thread.start()
+            self.transaction_processing_threads.append(thread)
+
+    def _process_transactions(self):
+        while True:
+            self._run_transaction_job(self.transaction_queue.get())
+
+    def _run_transaction_job(self, job):
+        d, handler, args, kwargs = job
+        self.block_gate.wait()
+        try:
+            result = handler(*args, **kwargs)
+        except Exception:
+            reactor.callFromThread(d.errback, Failure())
         else:
-            self.blockchain.unconfirmed_transactions.join_thread()
-            if self.NODE_TYPE == "miner":
-                self.mining_process.join(1)
-            self.node_process.join(1)
+            reactor.callFromThread(d.callback, result)
+
+    def announce_inventory(self, node, blocks=None, transactions=None):
+        """
+        Announces block and transaction hashes to a peer.  The peer answers with the hashes
+        it does not know yet, which are the only objects that should be pushed to it.
+
+        :return: wanted block and transaction hashes, or None if the peer could not be reached
+        :rtype: dict
+        """
+        url = self.INVENTORY_URL.format(node, self.FULL_NODE_PORT)
+        data = {
+            "host": self.host,
+            "blocks": blocks or [],
+            "transactions": transactions or []
+        }
+        try:
+            response = self._peer_request(node, PeerWire.INVENTORY, url, data)
+            if response.status_code == 200:
+                return response.json()
+        except requests.exceptions.RequestException as re:
+            pass
+        return None
+
+    def broadcast_transaction(self, transaction):
+        self.refresh_nodes()
+        self.inventory.add(transaction.tx_hash)
+        data = {
+            "transaction": transaction.to_json()
+        }
+
+        for node in self.get_healthy_nodes():
+            if node == self.host:
+                continue
+            wanted = self.announce_inventory(node, transactions=[transaction.tx_hash])
+            if wanted is None or transaction.tx_hash not in wanted["transactions"]:
+                continue
+            url = self.TRANSACTIONS_URL.format(node, self.FULL_NODE_PORT)
+            try:
+                self._peer_request(node, PeerWire.TRANSACTION, url, data)
+            except requests.exceptions.RequestException as re:
+                pass
+        return
+
+    def broadcast_transactions(self, transactions):
+        self.refresh_nodes()
+        for transaction in transactions:
+            self.inventory.add(transaction.tx_hash)
+        transactions_by_hash = {transaction.tx_hash: transaction for transaction in transactions}
+
+        for node in self.get_healthy_nodes():
+            if node == self.host:
+                continue
+            wanted = self.announce_inventory(node, transactions=transactions_by_hash.keys())
+            if wanted is None:
+                continue
+            wanted_transactions = [transactions_by_hash[tx_hash] for tx_hash in wanted["transactions"]
+                                   if tx_hash in transactions_by_hash]
+            for start in range(0, len(wanted_transactions), self.MAX_TRANSACTIONS_PER_REQUEST):
+                data = {
+                    "transactions": [t.to_json() for t in wanted_transactions[start:start + self.MAX_TRANSACTIONS_PER_REQUEST]]
+                }
+                url = self.TRANSACTIONS_BATCH_URL.format(node, self.FULL_NODE_PORT)
+                try:
+                    self._peer_request(node, PeerWire.TRANSACTIONS, url, data)
+                except requests.exceptions.RequestException as re:
+                    pass
+        return
+
+    @staticmethod
+    def _check_block_hash(block, current_hash):
+        """
+        :raises InvalidHash: if the block doesn't hash to the hash its sender claims
+        :rtype: Block
+        """
+        if block.current_hash != current_hash:
+            raise InvalidHash(block.index, "Block Hash Mismatch: {} {}".format(current_hash, block.current_hash))
+        return block
+
+    def _decode_block(self, block_dict):
+        """
+        Decodes a block fetched from a peer as json.  Its transactions are decoded when validation first reads them.
+
+        :raises InvalidHash: if the block doesn't hash to the hash the peer claims
+        :rtype: Block
+        """
+        return self._check_block_hash(Block.from_dict(block_dict, defer_transactions=True), block_dict['current_hash'])
 
     def request_block(self, node, port, index="latest"):
         url = self.BLOCK_URL.format(node, port, index)
         try:
-            response = requests.get(url)
+            response = self._request(requests.get, node, url, headers=self.BLOCK_ACCEPT)
+            if response.status_code == 200 and self._is_binary(response):
+                return self._check_block_hash(*BinaryCodec.decode_block(response.content))
             if response.status_code == 200:
-                block_dict = json.loads(response.json())
-                block = Block(
-                    block_dict['index'],
-                    [Transaction(
-                        transaction['source'],
-                        transaction['destination'],
-                        transaction['amount'],
-                        transaction['fee'],
-                        transaction['signature'])
-                        for transaction in block_dict['transactions']
-                     ],
-                    block_dict['previous_hash'],
-                    block_dict['timestamp'],
-                    block_dict['nonce']
-                )
-                if block.current_hash != block_dict['current_hash']:
-                    raise InvalidHash(block.index, "Block Hash Mismatch: {} {}".format(block_dict['current_hash'], block.current_hash))
-                return block
-        except requests.exceptions.RequestException as re:
+                return self._decode_block(self._json_blocks(response))
+        except (requests.exceptions.RequestException, InvalidEncoding) as re:
             pass
         return None
 
     def request_block_from_all(self, index="latest"):
         blocks = []
 
-        full_nodes = self.full_nodes.copy()
-        bad_nodes = set()
-
-        for node in full_nodes:
+        for node in self.get_healthy_nodes():
             block = self.request_block(node, self.FULL_NODE_PORT, index)
             if block is not None:
                 blocks.append(block)
-            else:
-                bad_nodes.add(node)
-
-        for node in bad_nodes:
-            self.remove_node(node)
         return blocks
 
-    def request_blocks_range(self, node, port, start_index, stop_index):
+    def _decode_blocks_response(self, response):
+        """
+        :raises InvalidEncoding: if a binary response is malformed
+        :raises InvalidHash: if a block doesn't hash to the hash the peer claims
+        :rtype: list
+        """
+        if self._is_binary(response):
+            return [self._check_block_hash(block, current_hash)
+                    for block, current_hash in BinaryCodec.decode_blocks(response.content)]
+        return [self._decode_block(block_dict) for block_dict in self._json_blocks(response)]
+
+    def iter_blocks_range(self, node, port, start_index, stop_index):
+        """
+        Streams a range of blocks from a peer, yielding each block as soon as its bytes have arrived, so the
+        caller can validate a block while the ones after it are still downloading.  Peers answer at most
+        MAX_BLOCKS_PER_RESPONSE blocks per request, so longer ranges are fetched a page at a time.
+
+        :raises ChainContinuityError: if the range could not be fetched or decoded
+        :raises InvalidHash: if a block doesn't hash to the hash the peer claims
+        :rtype: generator
+        """
+        start = start_index
+        while start <= stop_index:
+            page = self._iter_blocks_page(node, port, start, min(stop_index, start + self.MAX_BLOCKS_PER_RESPONSE - 1))
+            fetched = 0
+            try:
+                for block in page:
+                    fetched += 1
+                    yield block
+            finally:
+                page.close()
+            if fetched == 0:
+                raise ChainContinuityError(start, "{} sent no blocks from {}".format(node, start))
+            start += fetched
+
+    def _iter_blocks_page(self, node, port, start_index, stop_index):
         url = self.BLOCKS_RANGE_URL.format(node, port, start_index, stop_index)
-        blocks = []
+        response = None
         try:
-            response = requests.get(url)
-            if response.status_code == 200:
-                blocks_dict = json.loads(response.json())
-                for block_dict in blocks_dict:
-                    block = Block(
-                        block_dict['index'],
-                        [Transaction(
-                            transaction['source'],
-                            transaction['destination'],
-                            transaction['amount'],
-                            transaction['fee'],
-                            transaction['signature'])
-                         for transaction in block_dict['transactions']
-                         ],
-                        block_dict['previous_hash'],
-                        block_dict['timestamp'],
-                        block_dict['nonce']
-                    )
-                    if block.current_hash != block_dict['current_hash']:
-                        raise InvalidHash(block.index, "Block Hash Mismatch: {}".format(block_dict['current_hash']))
-                    blocks.append(block)
-                return blocks
-        except requests.exceptions.RequestException as re:
+            response = self._request(requests.get, node, url, headers=self.BLOCK_ACCEPT, stream=True)
+            if response.status_code != 200:
+                raise ChainContinuityError(start_index, "{} answered {}".format(node, response.status_code))
+            chunks = response.iter_content(self.STREAM_CHUNK_SIZE)
+            if self._is_binary(response):
+                for block, current_hash in BinaryCodec.iter_decode_blocks(chunks):
+                    yield self._check_block_hash(block, current_hash)
+            else:
+                parser = JsonArrayParser()
+                for chunk in chunks:
+                    for element in parser.feed(chunk):
+                        yield self._decode_block(self._json_block(json.loads(element)))
+                parser.close()
+        except (requests.exceptions.RequestException, InvalidEncoding, ValueError, KeyError) as e:
+            raise ChainContinuityError(start_index, "Could not fetch blocks from {}: {}".format(node, e))
+        finally:
+            if response is not None:
+                response.close()
+
+    def request_blocks_range(self, node, port, start_index, stop_index):
+        try:
+            return list(self.iter_blocks_range(node, port, start_index, stop_index))
+        except ChainContinuityError:
             pass
         return None
 
     def request_blockchain(self, node, port):
+        """
+        Fetches the peer's whole chain a page at a time, following the next start each page announces.  Stops
+        at an empty page, and gives up on a peer whose next start doesn't move forward.
+        """
         url = self.BLOCKS_URL.format(node, port)
         blocks = []
+        start = 0
         try:
-            response = requests.get(url)
-            if response.status_code == 200:
-                blocks_dict = json.loads(response.json())
-                for block_dict in blocks_dict:
-                    block = Block(
-                        block_dict['index'],
-                        [Transaction(
-                            transaction['source'],
-                            transaction['destination'],
-                            transaction['amount'],
-                            transaction['fee'],
-                            transaction['signature'])
-                         for transaction in block_dict['transactions']
-                         ],
-                        block_dict['previous_hash'],
-                        block_dict['timestamp'],
-                        block_dict['nonce']
-                    )
-                    if block.current_hash != block_dict['current_hash']:
-                        raise InvalidHash(block.index, "Block Hash Mismatch: {}".format(block_dict['current_hash']))
-                    blocks.append(block)
-                return blocks
-        except requests.exceptions.RequestException as re:
+            while start is not None:
+                response = self._request(requests.get, node, url, headers=self.BLOCK_ACCEPT,
+                                         params={'start': start, 'limit': self.MAX_BLOCKS_PER_RESPONSE})
+                if response.status_code != 200:
+                    return None
+                page = self._decode_blocks_response(response)
+                if not page:
+                    break
+                blocks.extend(page)
+                next_start = response.headers.get(self.NEXT_START_HEADER)
+                if next_start is None:
+                    break
+                if int(next_start) <= start:
+                    logger.warning("Peer %s announced next start %s after start %s", node, next_start, start)
+                    return None
+                start = int(next_start)
+            return blocks
+        except (requests.exceptions.RequestException, InvalidEncoding, ValueError) as re:
             pass
         return None
 
@@ -224,23 +754,33 @@ class FullNode(NodeMixin):
         logger.debug("mining node starting on %s with reward address of %s...", self.host, self.reward_address)
         while True:
             latest_block = self.blockchain.get_latest_block()
-            latest_hash = latest_block.current_hash
-            latest_index = latest_block.index
 
-            block = self.blockchain.mine_block(self.reward_address)
+            block = self.blockchain.create_candidate_block(self.reward_address)
             if not block:
+                time.sleep(1)
+                continue
+            nonce = self.miner.solve(
+                block.block_header,
+                self.blockchain.calculate_hash_difficulty(),
+                lambda: self.blockchain.get_latest_block() is not latest_block
+            )
+            if nonce is None:
+                # Next block in sequence was accepted from another node.  Stop mining current block.
+                self.blockchain.recycle_transactions(block)
                 continue
+            block.block_header.nonce = nonce
             statuses = self.broadcast_block(block)
             if statuses['expirations'] > statuses['confirmations'] or \
                     statuses['invalidations'] > statuses['confirmations']:
                 self.synchronize()
-                new_latest_block = self.blockchain.get_latest_block()
-                if latest_hash != new_latest_block.current_hash or \
-                        latest_index != new_latest_block.index:
+                if self.blockchain.get_latest_block() is not latest_block:
                     # latest_block changed after sync.. don't add the block.
                     self.blockchain.recycle_transactions(block)
                     continue
-            self.blockchain.add_block(block)
+            if self.blockchain.add_block(block):
+                self.block_cache.put(block)
+            else:
+                self.blockchain.recycle_transactions(block)
 
     def broadcast_block(self, block):
         #TODO convert to grequests and concurrently gather a list of responses
@@ -250,19 +790,33 @@ class FullNode(NodeMixin):
             "expirations": 0
         }
 
-        self.request_nodes_from_all()
-        bad_nodes = set()
+        self.refresh_nodes()
+        block_hash = block.current_hash
+        self.inventory.add(block_hash)
         data = {
-            "block": block.to_json(),
+            "block": block.to_compact_json(),
             "host": self.host
         }
 
-        for node in self.full_nodes:
+        for node in self.get_healthy_nodes():
             if node == self.host:
                 continue
-            url = self.BLOCKS_URL.format(node, self.FULL_NODE_PORT)
+            wanted = self.announce_inventory(node, blocks=[block_hash])
+            if wanted is None:
+                continue
+            if block_hash not in wanted["blocks"]:
+                # peer has seen the hash, which says nothing about whether it accepted the block
+                continue
+            url = self.COMPACT_BLOCKS_URL.format(node, self.FULL_NODE_PORT)
             try:
-                response = requests.post(url, json=data)
+                response = self._peer_request(node, PeerWire.COMPACT_BLOCK, url, data)
+                if response.status_code == 200:
+                    # peer could not rebuild the block from its mempool.  resend with the missing transactions
+                    missing_data = {
+                        "block": block.to_compact_json(response.json()["missing"]),
+                        "host": self.host
+                    }
+                    response = self._peer_request(node, PeerWire.COMPACT_BLOCK, url, missing_data)
                 if response.status_code == 202:
                     # confirmed and accepted by node
                     statuses["confirmations"] += 1
@@ -273,46 +827,204 @@ class FullNode(NodeMixin):
                     # expired and rejected by node
                     statuses["expirations"] += 1
             except requests.exceptions.RequestException as re:
-                bad_nodes.add(node)
-        for node in bad_nodes:
-            self.remove_node(node)
-        bad_nodes.clear()
+                pass
         return statuses
 
     def add_node(self, host):
         if host == self.host:
             return
 
-        if host not in self.full_nodes:
-            self.broadcast_node(host)
+        with self.full_nodes_lock:
+            if host in self.full_nodes:
+                return
+        self.broadcast_node(host)
+        with self.full_nodes_lock:
             self.full_nodes.add(host)
 
     def broadcast_node(self, host):
-        self.request_nodes_from_all()
-        bad_nodes = set()
+        self.refresh_nodes()
         data = {
             "host": host
         }
 
-        for node in self.full_nodes:
+        for node in self.get_healthy_nodes():
             if node == self.host:
                 continue
             url = self.NODES_URL.format(node, self.FULL_NODE_PORT)
             try:
-                requests.post(url, json=data)
+                self._request(requests.post, node, url, json=data)
             except requests.exceptions.RequestException as re:
-                bad_nodes.add(node)
-        for node in bad_nodes:
-            self.remove_node(node)
-        bad_nodes.clear()
+                pass
         return
 
     def load_blockchain(self, block_path):
-        # TODO load blockchain from path
-        pass
+        """
+        Loads blocks stored by save_blockchain, checking each block's hash as it is decoded.  The file stays
+        mapped, so stored blocks are served from its bytes.
+
+        :raises BlockchainException: if a stored block's hash doesn't match or the block is not valid
+        """
+        block_file = BlockFile(block_path)
+        blocks = []
+        for block, current_hash in block_file.blocks():
+            if block.current_hash != current_hash:
+                block_file.close()
+                raise InvalidHash(block.index, "Block Hash Mismatch: {}".format(current_hash))
+            blocks.append(block)
+        blockchain = Blockchain(blocks, metrics=self.metrics)
+        if blockchain.get_size() != len(blocks):
+            block_file.close()
+            index = blockchain.get_size()
+            raise BlockchainException(index, "Stored block {} was rejected".format(index))
+        self.blockchain = blockchain
+        self._replace_block_file(block_file)
+
+    def save_blockchain(self, block_path):
+        with self._save_lock:
+            # the periodic and shutdown saves write the same temporary file
+            BlockFile.write(block_path, self.blockchain.get_all_blocks())
+            self._replace_block_file(BlockFile(block_path))
+
+    def start_block_saving(self):
+        if self.block_path is None or (self.block_save_thread is not None and self.block_save_thread.is_alive()):
+            return
+        self.block_save_thread = threading.Thread(target=self._schedule_block_saving)
+        self.block_save_thread.daemon = True
+        self.block_save_thread.start()
+
+    def _schedule_block_saving(self):
+        while True:
+            time.sleep(self.BLOCK_SAVE_INTERVAL)
+            self._save_blocks()
+
+    def _save_blocks(self):
+        """
+        Saves the chain to block_path, if the node has one.  Failures are logged, so neither the scheduler
+        nor shutdown stops on them.
+        """
+        if self.block_path is None:
+            return
+        try:
+            self.save_blockchain(self.block_path)
+        except Exception as e:
+            logger.warning("Saving blocks to %s failed: %s", self.block_path, e)
+
+    def _replace_block_file(self, block_file):
+        # the old file isn't closed: requests may still be slicing its map.  write() renamed the new file
+        # over it, and the map is released once the last of them drops its reference.
+        self.block_file = block_file
+
+    def _stored_blocks(self, blocks):
+        """
+        :return: a block list message sliced from the block file, or None if the blocks are not all stored
+            there, e.g. blocks connected since the last save or replaced by a reorg
+        :rtype: str
+        """
+        block_file = self.block_file
+        if block_file is None or not blocks:
+            return None
+        start_index, stop_index = blocks[0].index, blocks[-1].index
+        if stop_index >= len(block_file) or stop_index - start_index + 1 != len(blocks):
+            return None
+        for block in blocks:
+            if block_file.get_hash(block.index) != block.current_hash:
+                return None
+        return block_file.get_blocks_message(start_index, stop_index)
+
+    def request_tips(self):
+        """
+        :return: latest block index and hash of each reachable peer, keyed by peer
+        :rtype: dict
+        """
+        tips = {}
+        self.refresh_nodes()
+        for node in self.get_healthy_nodes():
+            if node == self.host:
+                continue
+            url = self.TIP_URL.format(node, self.FULL_NODE_PORT)
+            try:
+                response = self._peer_request(node, PeerWire.TIP, url)
+                if response.status_code == 200:
+                    tips[node] = response.json()
+            except requests.exceptions.RequestException as re:
+                pass
+        return tips
+
+    def get_tip_lag(self, tips):
+        """
+        Number of blocks the best known peer tip is ahead of ours.  Recorded as the tip_lag gauge.
+        """
+        my_latest_index = self.blockchain.get_height()
+        lag = max([tip["index"] - my_latest_index for tip in tips.values()] + [0])
+        self.metrics.set_gauge("tip_lag", lag)
+        return lag
 
-    def synchronize(self):
+    def _sync_from(self, remote_host, index):
+        """
+        Fetches the blocks between our tip and the remote block at index and adds them,
+        switching to the remote chain if it forked from ours.  Synced blocks aren't encoded for the block
+        cache; the ones peers ask for are cached when first served.  Runs under sync_lock, so the sync thread, the
+        miner and the block processing thread never fetch and add blocks at the same time.
+
+        :return: True if the local chain now extends to index
+        :rtype: bool
+        """
+        with self.sync_lock:
+            my_latest_block = self.blockchain.get_latest_block()
+            if my_latest_block.index >= index:
+                # another sync reached index while this one waited for the lock
+                return True
+            remote_blocks = self.iter_blocks_range(
+                remote_host,
+                self.FULL_NODE_PORT,
+                my_latest_block.index + 1,
+                index
+            )
+            try:
+                first_block = next(remote_blocks, None)
+                if first_block is None:
+                    raise ChainContinuityError(index, "Could not fetch blocks from {}".format(remote_host))
+
+                if first_block.previous_hash == my_latest_block.current_hash:
+                    # first block in diff blocks fit local chain, so each block is added as it arrives
+                    for block in itertools.chain([first_block], remote_blocks):
+                        if not self.blockchain.add_block(block):
+                            logger.warning("Block %s from %s rejected", block.index, remote_host)
+                            return False
+                    return True
+
+                remote_diff_blocks = [first_block]
+                remote_diff_blocks.extend(remote_blocks)
+            finally:
+                remote_blocks.close()
+
+            # first block in diff blocks does not fit local chain
+            for i in range(my_latest_block.index, 1, -1):
+                # step backwards and look for the first remote block that fits the local chain
+                block = self.request_block(remote_host, self.FULL_NODE_PORT, str(i))
+                if block is None:
+                    raise ChainContinuityError(i, "Could not fetch block from {}".format(remote_host))
+                remote_diff_blocks[0:0] = [block]
+                if block.previous_hash == self.blockchain.get_block_hash(i-1):
+                    # found the fork
+                    if not self.blockchain.alter_chain(remote_diff_blocks):
+                        logger.warning("Blocks %s to %s from %s rejected", i, index, remote_host)
+                        return False
+                    return True
+            logger.warning("Blocks from %s do not fit the local chain", remote_host)
+            return False
+
+    def synchronize(self, tips=None):
+        """
+        Catches up with the longest chain among the peers' tips.  A peer that can't be synced from, e.g. one
+        serving blocks that don't match their hashes, has a failure recorded and the next peer is tried.
+
+        :return: True if the local chain was extended to a peer's tip
+        :rtype: bool
+        """
         my_latest_block = self.blockchain.get_latest_block()
+        if tips is None:
+            tips = self.request_tips()
         """
         latest_blocks = {
             index1 : {
@@ -325,66 +1037,54 @@ class FullNode(NodeMixin):
         }
         """
         latest_blocks = {}
+        for node, tip in tips.items():
+            if tip["index"] <= my_latest_block.index:
+                continue
+            latest_blocks.setdefault(tip["index"], {}).setdefault(tip["current_hash"], []).append(node)
 
-        self.request_nodes_from_all()
-        bad_nodes = set()
-        for node in self.full_nodes:
-            url = self.BLOCK_URL.format(node, self.FULL_NODE_PORT, "latest")
-            try:
-                response = requests.get(url)
-                if response.status_code == 200:
-                    remote_latest_block = json.loads(response.json())
-                    if remote_latest_block["index"] <= my_latest_block.index:
-                        continue
-                    if latest_blocks.get(remote_latest_block["index"], None) is None:
-                        latest_blocks[remote_latest_block["index"]] = {
-                            remote_latest_block["current_hash"]: [node]
-                        }
-                        continue
-                    if latest_blocks[remote_latest_block["index"]].get(remote_latest_block["current_hash"], None) is None:
-                        latest_blocks[remote_latest_block["index"]][remote_latest_block["current_hash"]] = [node]
-                        continue
-                    latest_blocks[remote_latest_block["index"]][remote_latest_block["current_hash"]].append(node)
-            except requests.exceptions.RequestException as re:
-                bad_nodes.add(node)
-        if len(latest_blocks) > 0:
-            for latest_block in sorted(latest_blocks.items(), reverse=True):
-                index = latest_block[0]
-                current_hashes = latest_block[1]
-                success = True
-                for current_hash in current_hashes:
-                    remote_host = current_hash[1][0]
-
-                    remote_diff_blocks = self.request_blocks_range(
-                        remote_host,
-                        self.FULL_NODE_PORT,
-                        my_latest_block.index + 1,
-                        index
-                    )
-                    if remote_diff_blocks[0].previous_hash == my_latest_block.current_hash:
-                        # first block in diff blocks fit local chain
-                        for block in remote_diff_blocks:
-                            result = self.blockchain.add_block(block)
-                            if not result:
-                                success = False
-                                break
-                    else:
-                        # first block in diff blocks does not fit local chain
-                        for i in range(my_latest_block.index, 1, -1):
-                            # step backwards and look for the first remote block that fits the local chain
-                            block = self.request_block(remote_host, self.FULL_NODE_PORT, str(i))
-                            remote_diff_blocks[0:0] = [block]
-                            if block.previous_hash == self.blockchain.get_block_by_index(i-1):
-                                # found the fork
-                                result = self.blockchain.alter_chain(remote_diff_blocks)
-                                success = result
-                                break
-                        success = False
-                    if success:
-                        break
-                if success:
-                    break
-        return
+        for index, current_hashes in sorted(latest_blocks.items(), reverse=True):
+            for current_hash, nodes in current_hashes.items():
+                for node in nodes:
+                    try:
+                        if self._sync_from(node, index):
+                            return True
+                    except (BlockchainException, InvalidEncoding, KeyError, ValueError) as e:
+                        logger.warning("Synchronizing with %s failed: %s", node, e)
+                        self.record_peer_failure(node)
+        return False
+
+    def start_sync_scheduler(self):
+        if self.sync_thread is not None and self.sync_thread.is_alive():
+            return
+        self.sync_thread = threading.Thread(target=self._schedule_sync)
+        self.sync_thread.daemon = True
+        self.sync_thread.start()
+
+    def _schedule_sync(self):
+        interval = self.SYNC_INTERVAL
+        while True:
+            time.sleep(interval * random.uniform(1 - self.SYNC_JITTER, 1 + self.SYNC_JITTER))
+            interval = self.SYNC_INTERVAL if self.check_sync() else min(interval * 2, self.SYNC_BACKOFF_MAX)
+
+    def check_sync(self):
+        """
+        Polls the peers' tips and synchronizes once we lag more than SYNC_LAG_THRESHOLD blocks behind
+
+        :return: False if we are still lagging, so the scheduler backs off before the next attempt
+        :rtype: bool
+        """
+        try:
+            tips = self.request_tips()
+            if self.get_tip_lag(tips) <= self.SYNC_LAG_THRESHOLD:
+                return True
+            self.metrics.increment("sync_attempts")
+            if self.synchronize(tips):
+                self.get_tip_lag(tips)
+                return True
+        except Exception as e:
+            logger.warning("Scheduled sync failed: %s", e)
+        self.metrics.increment("sync_failures")
+        return False
 
     def __remove_unconfirmed_transactions(self, transactions):
         for transaction in transactions:
@@ -399,137 +1099,402 @@ class FullNode(NodeMixin):
     @app.route('/nodes', methods=['GET'])
     def get_nodes(self, request):
         nodes = {
-            "full_nodes": list(self.full_nodes)
+            "full_nodes": self.get_full_nodes()
         }
         return json.dumps(nodes)
 
+    @app.route('/inventory', methods=['POST'])
+    def post_inventory(self, request):
+        body = json.loads(request.content.read())
+        wanted = {
+            "blocks": self.inventory.unseen(body.get('blocks', [])),
+            "transactions": self.inventory.unseen(body.get('transactions', []))
+        }
+        return json.dumps(wanted)
+
     @app.route('/status', methods=['GET'])
     def get_status(self, request):
         return json.dumps(config['network'])
 
     @app.route('/transactions', methods=['POST'])
+    @enqueue_transactions
     def post_transactions(self, request):
-        body = json.loads(request.content.read())
-        transaction = Transaction(
-            body['transaction']['source'],
-            body['transaction']['destination'],
-            body['transaction']['amount'],
-            body['transaction']['fee'],
-            body['transaction']['signature'])
-        if transaction.tx_hash != body['transaction']['tx_hash']:
-            logger.warn("Invalid transaction hash: {} should be {}".format(body['transaction']['tx_hash'], transaction.tx_hash))
+        try:
+            # the transaction is sent as its own json string, as broadcast_transaction encodes it
+            remote_transaction = json.loads(json.loads(request.content.read())['transaction'])
+            transaction = Transaction.from_dict(remote_transaction)
+            remote_tx_hash = remote_transaction['tx_hash']
+        except (KeyError, TypeError, ValueError) as e:
+            request.setResponseCode(400)  # bad request
+            return json.dumps({'message': 'Malformed transaction: {}'.format(e)})
+        if transaction.tx_hash != remote_tx_hash:
+            logger.warn("Invalid transaction hash: {} should be {}".format(remote_tx_hash, transaction.tx_hash))
             request.setResponseCode(406)
             return json.dumps({'message': 'Invalid transaction hash'})
-        return json.dumps({'success': self.blockchain.push_unconfirmed_transaction(transaction)})
+        if not self.inventory.add(transaction.tx_hash):
+            return json.dumps({'success': False, 'message': 'Transaction already received'})
+        status = self.blockchain.push_unconfirmed_transaction(transaction)
+        if status:
+            reactor.callInThread(self.broadcast_transaction, transaction)
+        else:
+            self.inventory.discard(transaction.tx_hash)
+        return json.dumps({'success': status})
+
+    @app.route('/transactions/batch', methods=['POST'])
+    @enqueue_transactions
+    def post_transactions_batch(self, request):
+        body = json.loads(request.content.read())
+        if len(body['transactions']) > self.MAX_TRANSACTIONS_PER_REQUEST:
+            request.setResponseCode(413)  # request entity too large
+            return json.dumps({'message': 'Too many transactions.  Limit is {}'.format(self.MAX_TRANSACTIONS_PER_REQUEST)})
+        results = [None] * len(body['transactions'])
+        positions = []
+        transactions = []
+        for position, transaction_json in enumerate(body['transactions']):
+            remote_transaction = json.loads(transaction_json)
+            try:
+                transaction = Transaction.from_dict(remote_transaction)
+            except ValueError as e:
+                results[position] = {'tx_hash': remote_transaction['tx_hash'], 'success': False, 'message': str(e)}
+                continue
+            if transaction.tx_hash != remote_transaction['tx_hash']:
+                results[position] = {'tx_hash': remote_transaction['tx_hash'], 'success': False,
+                                     'message': 'Invalid transaction hash'}
+            elif not self.inventory.add(transaction.tx_hash):
+                results[position] = {'tx_hash': transaction.tx_hash, 'success': False,
+                                     'message': 'Transaction already received'}
+            else:
+                positions.append(position)
+                transactions.append(transaction)
+
+        accepted = []
+        rejections = self.blockchain.push_unconfirmed_transactions(transactions)
+        for position, transaction, rejection in zip(positions, transactions, rejections):
+            results[position] = {'tx_hash': transaction.tx_hash, 'success': rejection is None,
+                                 'message': rejection or 'accepted'}
+            if rejection is None:
+                accepted.append(transaction)
+            else:
+                self.inventory.discard(transaction.tx_hash)
+        if len(accepted) > 0:
+            reactor.callInThread(self.broadcast_transactions, accepted)
+        return json.dumps({'results': results})
 
     @app.route('/transactions', methods=['GET'])
     def get_transactions(self, request):
         return json.dumps(self.blockchain.get_all_unconfirmed_transactions())
 
     @app.route('/address/<address>/balance', methods=['GET'])
+    @offload
     def get_balance(self, request, address):
         return json.dumps(self.blockchain.get_balance(address))
 
     @app.route('/address/<address>/transactions', methods=['GET'])
     def get_transaction_history(self, request, address):
-        return json.dumps(self.blockchain.get_transaction_history(address))
+        """
+        The history is gathered and compressed on the validation thread pool; the encoding is negotiated and
+        set on the reactor thread
+        """
+        encoding = self.compression.negotiate(request)
+        d = deferToThreadPool(reactor, self.validation_pool, self._transaction_history, address, encoding)
+        return d.addCallback(self.compression.apply, request)
 
-    @app.route('/blocks', methods=['POST'])
-    def post_block(self, request):
-        body = json.loads(request.content.read())
-        remote_block = json.loads(body['block'])
-        remote_host = body['host']
-        transactions = [Transaction(
-            transaction['source'],
-            transaction['destination'],
-            transaction['amount'],
-            transaction['fee'],
-            transaction['signature'])
-            for transaction in remote_block['transactions']
-        ]
+    def _transaction_history(self, address, encoding):
+        history = self.blockchain.get_transaction_history(address)
+        return self.compression.compress(json.dumps([transaction.to_dict() for transaction in history]), encoding)
+
+    def _reconstruct_compact_block(self, compact_block):
+        """
+        Rebuilds a block from its compact form using transactions from the local mempool
+
+        :return: the block, or None and the positions of transactions that must be sent in full
+        :rtype: tuple
+        """
+        block_header = compact_block['block_header']
+        block_hash = compact_block['current_hash']
+        short_ids = compact_block['short_ids']
+        prefilled = compact_block['prefilled']
+        mempool = self.blockchain.get_unconfirmed_transactions_by_short_ids(block_hash, short_ids)
+        transactions = []
+        missing = []
+        for position, short_id in enumerate(short_ids):
+            transaction = prefilled.get(str(position))
+            if transaction is not None:
+                transactions.append(Transaction.from_dict(transaction))
+            elif short_id in mempool:
+                transactions.append(mempool[short_id])
+            else:
+                missing.append(position)
+        if len(missing) > 0:
+            return None, missing
         block = Block(
-            remote_block['index'],
-            [Transaction(
-                transaction['source'],
-                transaction['destination'],
-                transaction['amount'],
-                transaction['fee'],
-                transaction['signature'])
-             for transaction in remote_block['transactions']
-             ],
-            remote_block['previous_hash'],
-            remote_block['timestamp'],
-            remote_block['nonce']
+            compact_block['index'],
+            transactions,
+            block_header['previous_hash'],
+            block_header['timestamp'],
+            block_header['nonce']
         )
-        if block.current_hash != remote_block['current_hash']:
+        if block.block_header.merkle_root != block_header['merkle_root']:
+            # a short id collided with an unrelated mempool transaction
+            return None, [position for position in range(len(short_ids)) if str(position) not in prefilled]
+        return block, []
+
+    def _receive_block(self, request, block, remote_host, block_hash, encodings=None):
+        """
+        Runs the cheap checks on a received block and queues it for the block processing thread, so the
+        sender does not wait on gap-filling and validation.  Continuity with our tip and the transaction count
+        are checked first; the block is hashed once, after them, and the cached hash is reused by validation.
+
+        :param block_hash: hash claimed by the sender
+        :type block_hash: str
+        :param encodings: the block as it arrived, keyed by content type.  They are queued with the block and
+            cached once it has been added, so the block is served as received rather than encoded again.
+        :type encodings: dict
+        """
+        height = self.blockchain.get_height()
+        if block.index <= height:
+            # new block index is less than ours
+            request.setResponseCode(409)  # conflict
+            return json.dumps({'message': 'Block index too low.  Fetch latest chain.'})
+        if block_hash in self.inventory:
+            request.setResponseCode(409)  # conflict
+            return json.dumps({'message': 'Block already received'})
+        if block.index == height + 1 and block.previous_hash != self.blockchain.get_block_hash(height):
+            self.metrics.increment("block_rejections.continuity")
+            request.setResponseCode(409)  # conflict
+            return json.dumps({'message': 'Block does not extend our tip.  Fetch latest chain.'})
+        if len(block.transactions) > Blockchain.MAX_TRANSACTIONS_PER_BLOCK + 1:
+            self.metrics.increment("block_rejections.structure")
+            request.setResponseCode(406)  # not acceptable
+            return json.dumps({'message': 'block rejected due to too many transactions'})
+        if block.current_hash != block_hash:
+            self.metrics.increment("block_rejections.hash_mismatch")
             request.setResponseCode(406)  # not acceptable
             return json.dumps({'message': 'block rejected due to invalid hash'})
+        if not self.inventory.add(block_hash):
+            request.setResponseCode(409)  # conflict
+            return json.dumps({'message': 'Block already received'})
+        self.block_gate.enter()
+        try:
+            self.block_queue.put_nowait((block, remote_host, encodings))
+        except Full:
+            self.block_gate.leave()
+            self.inventory.discard(block.current_hash)
+            request.setResponseCode(503)  # service unavailable
+            return json.dumps({'message': 'Block queue full'})
+        request.setResponseCode(202)  # accepted
+        return json.dumps({'message': 'accepted'})
+
+    def process_block(self, block, remote_host, encodings=None):
+        """
+        Adds a received block to the chain, first fetching any blocks between our tip and it from the sender.
+        Once the block has been added it is relayed from the reactor's thread pool, so the next queued block
+        doesn't wait on peers.
+
+        :param encodings: the block as it arrived, keyed by content type, cached once the block is added
+        :type encodings: dict
+
+        :return: True if the block was added
+        :rtype: bool
+        """
+        transactions = block.transactions
         my_latest_block = self.blockchain.get_latest_block()
 
         if block.index > my_latest_block.index + 1:
             # new block index is greater than ours
-            remote_diff_blocks = self.request_blocks_range(
-                remote_host,
-                self.FULL_NODE_PORT,
-                my_latest_block.index + 1,
-                remote_block['index']
-            )
-
-            if remote_diff_blocks[0].previous_hash == my_latest_block.current_hash:
-                # first block in diff blocks fit local chain
-                for block in remote_diff_blocks:
-                    result = self.blockchain.add_block(block)
-                    if not result:
-                        request.setResponseCode(406)  # not acceptable
-                        return json.dumps({'message': 'block {} rejected'.format(block.index)})
-                self.__remove_unconfirmed_transactions(transactions)
-                request.setResponseCode(202)  # accepted
-                return json.dumps({'message': 'accepted'})
-            else:
-                # first block in diff blocks does not fit local chain
-                for i in range(my_latest_block.index, 1, -1):
-                    # step backwards and look for the first remote block that fits the local chain
-                    block = self.request_block(remote_host, self.FULL_NODE_PORT, str(i))
-                    remote_diff_blocks[0:0] = [block]
-                    if block.previous_hash == self.blockchain.get_block_by_index(i-1):
-                        # found the fork
-                        result = self.blockchain.alter_chain(remote_diff_blocks)
-                        if not result:
-                            request.setResponseCode(406)  # not acceptable
-                            return json.dumps({'message': 'blocks rejected'})
-                        self.__remove_unconfirmed_transactions(transactions)
-                        request.setResponseCode(202)  # accepted
-                        return json.dumps({'message': 'accepted'})
-                request.setResponseCode(406)  # not acceptable
-                return json.dumps({'message': 'blocks rejected'})
+            if not self._sync_from(remote_host, block.index) or \
+                    self.blockchain.get_block_hash(block.index) != block.current_hash:
+                return False
+            if encodings:
+                self.block_cache.put(block, encodings)
 
         elif block.index <= my_latest_block.index:
-            # new block index is less than ours
-            request.setResponseCode(409)  # conflict
-            return json.dumps({'message': 'Block index too low.  Fetch latest chain.'})
+            # another block at this height was added while this one was queued
+            return False
 
         # correct block index. verify txs, hash
-        result = self.blockchain.add_block(block)
-        if not result:
-            request.setResponseCode(406)  # not acceptable
-            return json.dumps({'message': 'block {} rejected'.format(block.index)})
+        elif not self.blockchain.add_block(block):
+            logger.warning("Block %s from %s rejected", block.index, remote_host)
+            return False
+
+        else:
+            self.block_cache.put(block, encodings)
+
         self.__remove_unconfirmed_transactions(transactions)
-        request.setResponseCode(202)  # accepted
-        return json.dumps({'message': 'accepted'})
+        reactor.callInThread(self.broadcast_block, block)
+        return True
+
+    @app.route('/blocks', methods=['POST'])
+    @offload
+    def post_block(self, request):
+        data = request.content.read()
+        if len(data) > self.MAX_BLOCK_SIZE:
+            self.metrics.increment("block_rejections.size")
+            request.setResponseCode(413)  # request entity too large
+            return json.dumps({'message': 'Block too large'})
+        if request.getHeader('Content-Type') == BinaryCodec.CONTENT_TYPE:
+            try:
+                block, current_hash = BinaryCodec.decode_block(data)
+            except InvalidEncoding as e:
+                request.setResponseCode(400)  # bad request
+                return json.dumps({'message': str(e)})
+            return self._receive_block(request, block, request.getHeader(self.HOST_HEADER), current_hash,
+                                       {BinaryCodec.CONTENT_TYPE: data})
+        body = json.loads(data)
+        remote_block = json.loads(body['block'])
+        remote_host = body['host']
+        block = Block.from_dict(remote_block, defer_transactions=True)
+        return self._receive_block(request, block, remote_host, remote_block['current_hash'])
+
+    @app.route('/blocks/compact', methods=['POST'])
+    @offload
+    def post_compact_block(self, request):
+        body = json.loads(request.content.read())
+        compact_block = json.loads(body['block'])
+        remote_host = body['host']
+        if compact_block['current_hash'] in self.inventory:
+            request.setResponseCode(409)  # conflict
+            return json.dumps({'message': 'Block already received'})
+        block, missing = self._reconstruct_compact_block(compact_block)
+        if block is None:
+            return json.dumps({'missing': missing})
+        return self._receive_block(request, block, remote_host, compact_block['current_hash'])
+
+    @app.route('/tip', methods=['GET'])
+    def get_tip(self, request):
+        height = self.blockchain.get_height()
+        return json.dumps({"index": height, "current_hash": self.blockchain.get_block_hash(height)})
+
+    @app.route('/metrics', methods=['GET'])
+    def get_metrics(self, request):
+        return json.dumps(self.metrics.snapshot())
 
     @app.route('/blocks', methods=['GET'])
     def get_blocks(self, request):
-        return json.dumps([block.to_json() for block in self.blockchain.get_all_blocks()])
+        """
+        One page of the chain, from start for at most limit blocks.  Pages are capped at
+        MAX_BLOCKS_PER_RESPONSE; when more blocks follow, the next start is sent in NEXT_START_HEADER.
+        """
+        try:
+            start = int(request.args.get('start', [0])[0])
+            limit = int(request.args.get('limit', [self.MAX_BLOCKS_PER_RESPONSE])[0])
+        except ValueError:
+            request.setResponseCode(400)  # bad request
+            return json.dumps({'message': 'start and limit must be integers'})
+        start = max(start, 0)
+        stop = start + max(0, min(limit, self.MAX_BLOCKS_PER_RESPONSE))
+        if stop <= self.blockchain.get_height():
+            request.setHeader(self.NEXT_START_HEADER, str(stop))
+        return self._send_blocks(request, self.blockchain.get_blocks_range(start, stop - 1))
 
     @app.route('/blocks/<start_block_id>/<end_block_id>', methods=['GET'])
     def get_blocks_range(self, request, start_block_id, end_block_id):
-        return json.dumps([block.to_json() for block in self.blockchain.get_blocks_range(start_block_id, end_block_id)])
+        """
+        The blocks from start to end inclusive, capped at MAX_BLOCKS_PER_RESPONSE like a page of GET /blocks.
+        When the cap cuts the range short, the next start is sent in NEXT_START_HEADER.
+        """
+        try:
+            start = max(int(start_block_id), 0)
+            end = int(end_block_id)
+        except ValueError:
+            request.setResponseCode(400)  # bad request
+            return json.dumps({'message': 'block ids must be integers'})
+        stop = min(end, start + self.MAX_BLOCKS_PER_RESPONSE - 1)
+        if stop < end and stop < self.blockchain.get_height():
+            request.setHeader(self.NEXT_START_HEADER, str(stop + 1))
+        return self._send_blocks(request, self.blockchain.get_blocks_range(start, stop))
+
+    def _send_blocks(self, request, blocks):
+        """
+        Streams json a block at a time through a producer, so the response starts straight away and only
+        one block is encoded at a time.  Binary pages are sliced from the block file when it holds them, and
+        otherwise encoded whole.  Either is compressed if the client accepts it.  Encoding and compressing run
+        on the validation thread pool; headers are only set here and in callbacks, on the reactor thread.
+        """
+        encoding = self.compression.negotiate(request)
+        if self._accepts_binary(request):
+            stored = self._stored_blocks(blocks)
+            if stored is not None and encoding is None:
+                return stored
+            d = deferToThreadPool(reactor, self.validation_pool, self._binary_blocks, blocks, stored, encoding)
+            return d.addCallback(self.compression.apply, request)
+        request.setHeader('Content-Type', 'application/json')
+        d = deferToThreadPool(reactor, self.validation_pool, self.compression.stream,
+                              self._blocks_json_chunks(blocks), encoding)
+        d.addCallback(self.compression.apply, request)
+        return d.addCallback(lambda chunks: ChunkProducer(request, chunks, self.validation_pool).start())
+
+    def _binary_blocks(self, blocks, stored, encoding):
+        body = stored if stored is not None else BinaryCodec.encode_blocks(blocks)
+        return self.compression.compress(body, encoding)
 
     @app.route('/block/<block_id>', methods=['GET'])
     def get_block(self, request, block_id):
         if block_id == "latest":
-            return json.dumps(self.blockchain.get_latest_block().to_json())
-        return json.dumps(self.blockchain.get_block_by_index(block_id).to_json())
+            block = self.blockchain.get_latest_block()
+        else:
+            try:
+                index = int(block_id)
+            except ValueError:
+                request.setResponseCode(400)  # bad request
+                return json.dumps({'message': 'block_id must be an integer or latest'})
+            # a negative index would count back from the tip
+            block = self.blockchain.get_block_by_index(index) if index >= 0 else None
+        if block is None:
+            request.setResponseCode(404)  # not found
+            return json.dumps({'message': 'Block not found'})
+        if self._accepts_binary(request):
+            content_type = BinaryCodec.CONTENT_TYPE
+            etag = '"{}.bin"'.format(block.current_hash)
+        else:
+            content_type = EncodedBlockCache.JSON
+            etag = '"{}"'.format(block.current_hash)
+            request.setHeader('Content-Type', content_type)
+        request.setHeader('Vary', 'Accept')
+        request.setHeader('ETag', etag)
+        if self._not_modified(request, etag):
+            request.setResponseCode(304)  # not modified
+            return ""
+        if content_type == BinaryCodec.CONTENT_TYPE and block.current_hash not in self.block_cache:
+            block_file = self.block_file
+            if block_file is not None and block.index < len(block_file) and \
+                    block_file.get_hash(block.index) == block.current_hash:
+                return block_file.get_block_message(block.index)
+        return self.block_cache.get(block, content_type)
+
+    @staticmethod
+    def _not_modified(request, etag):
+        """
+        :return: True if the request's If-None-Match already names the etag, e.g. a peer polling an unchanged tip
+        :rtype: bool
+        """
+        if_none_match = request.getHeader('If-None-Match')
+        if not if_none_match:
+            return False
+        tags = [tag.strip() for tag in if_none_match.split(',')]
+        return '*' in tags or etag in tags or 'W/' + etag in tags
+
+    @staticmethod
+    def _blocks_json_chunks(blocks):
+        # each block's json is already a json value, so the list is written around them rather than encoded again
+        yield "["
+        for i, block in enumerate(blocks):
+            yield block.to_json() if i == 0 else ", " + block.to_json()
+        yield "]"
+
+    @classmethod
+    def _blocks_json(cls, blocks):
+        return "".join(cls._blocks_json_chunks(blocks))
+
+    @staticmethod
+    def _accepts_binary(request):
+        """
+        Peers ask for the binary format in their Accept header; anyone else gets json
+        """
+        if BinaryCodec.CONTENT_TYPE in (request.getHeader('Accept') or ''):
+            request.setHeader('Content-Type', BinaryCodec.CONTENT_TYPE)
+            return True
+        return False
 
 
 if __name__ == "__main__":
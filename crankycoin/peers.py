@@ -0,0 +1,106 @@
+import threading
+import time
+
+from config import *
+
+
+class PeerHealth(object):
+    """
+    Tracks request latency and consecutive failures per peer.
+
+    A peer whose consecutive failures reach FAILURE_THRESHOLD has its circuit opened and is skipped
+    until its backoff expires.  The backoff doubles on every further failure (up to BACKOFF_MAX).  Once
+    the backoff expires a single trial request is let through: the first availability check claims it and
+    holds the circuit open for another backoff while the trial runs.  Success closes the circuit again.  Peers that
+    reach EVICTION_THRESHOLD consecutive failures should be evicted from the peer table.
+    """
+
+    BACKOFF_BASE = config['network']['peer_backoff_base']
+    BACKOFF_MAX = config['network']['peer_backoff_max']
+    FAILURE_THRESHOLD = config['network']['peer_failure_threshold']
+    EVICTION_THRESHOLD = config['network']['peer_eviction_threshold']
+    LATENCY_SMOOTHING = 0.3
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._peers = {}
+
+    def _get_peer(self, peer):
+        if peer not in self._peers:
+            self._peers[peer] = {
+                "latency": None,
+                "failures": 0,
+                "retry_at": 0,
+                "backoff": 0
+            }
+        return self._peers[peer]
+
+    def record_success(self, peer, latency):
+        with self._lock:
+            stats = self._get_peer(peer)
+            if stats["latency"] is None:
+                stats["latency"] = latency
+            else:
+                stats["latency"] += self.LATENCY_SMOOTHING * (latency - stats["latency"])
+            stats["failures"] = 0
+            stats["retry_at"] = 0
+            stats["backoff"] = 0
+
+    def record_failure(self, peer, now=None):
+        """
+        :return: True if the peer has failed often enough to be evicted
+        :rtype: bool
+        """
+        if now is None:
+            now = time.time()
+        with self._lock:
+            stats = self._get_peer(peer)
+            stats["failures"] += 1
+            if stats["failures"] >= self.FAILURE_THRESHOLD:
+                backoff = self.BACKOFF_BASE * pow(2, stats["failures"] - self.FAILURE_THRESHOLD)
+                stats["backoff"] = min(backoff, self.BACKOFF_MAX)
+                stats["retry_at"] = now + stats["backoff"]
+            return stats["failures"] >= self.EVICTION_THRESHOLD
+
+    def is_available(self, peer, now=None):
+        """
+        :return: True if the circuit is closed, or if its backoff has expired and this call claims the trial request
+        :rtype: bool
+        """
+        if now is None:
+            now = time.time()
+        with self._lock:
+            stats = self._peers.get(peer)
+            if stats is None or stats["retry_at"] == 0:
+                return True
+            if stats["retry_at"] > now:
+                return False
+            # half open: let this request through and keep the others out until it reports back
+            stats["retry_at"] = now + stats["backoff"]
+            return True
+
+    def get_latency(self, peer):
+        with self._lock:
+            stats = self._peers.get(peer)
+            return None if stats is None else stats["latency"]
+
+    def get_failures(self, peer):
+        with self._lock:
+            stats = self._peers.get(peer)
+            return 0 if stats is None else stats["failures"]
+
+    def rank(self, peers, now=None):
+        """
+        :return: available peers, fastest first.  Peers without a latency sample come first so they get measured.
+        :rtype: list
+        """
+        available = [peer for peer in peers if self.is_available(peer, now)]
+        return sorted(available, key=lambda peer: self.get_latency(peer) or 0)
+
+    def forget(self, peer):
+        with self._lock:
+            self._peers.pop(peer, None)
+
+
+if __name__ == "__main__":
+    pass
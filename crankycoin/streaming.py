@@ -0,0 +1,281 @@
+import itertools
+import re
+import zlib
+
+from twisted.internet import reactor
+from twisted.internet.defer import Deferred, maybeDeferred
+from twisted.internet.interfaces import IPullProducer
+from twisted.internet.threads import deferToThreadPool
+from zope.interface import implementer
+
+from config import *
+
+
+@implementer(IPullProducer)
+class ChunkProducer(object):
+    """
+    Writes an iterable of chunks to a request, one chunk each time the transport asks for more.  Chunks are
+    produced lazily, so a response streams with chunked encoding in constant memory and its first bytes go
+    out before the rest are encoded.  Given a thread pool, chunks are produced on it, so encoding and
+    compressing them stays off the reactor thread; they are always written on it.  Must be started on the
+    reactor thread.
+    """
+
+    def __init__(self, request, chunks, pool=None):
+        self.request = request
+        self._chunks = iter(chunks)
+        self._pool = pool
+        self._producing = False
+        self._stopped = False
+        self._done = Deferred()
+
+    def start(self):
+        """
+        :return: Deferred firing once the last chunk has been written, for the route handler to return.  Klein
+            finishes the request when it fires.
+        :rtype: Deferred
+        """
+        self.request.registerProducer(self, False)
+        return self._done
+
+    def resumeProducing(self):
+        # the transport asks again while a chunk is still being produced on the pool
+        if self._stopped or self._producing:
+            return
+        self._producing = True
+        if self._pool is None:
+            d = maybeDeferred(next, self._chunks)
+        else:
+            d = deferToThreadPool(reactor, self._pool, next, self._chunks)
+        d.addCallbacks(self._write, self._end)
+
+    def _write(self, chunk):
+        self._producing = False
+        if not self._stopped:
+            self.request.write(chunk)
+
+    def _end(self, failure):
+        self._producing = False
+        if self._stopped:
+            return
+        self._stopped = True
+        self.request.unregisterProducer()
+        if not failure.check(StopIteration):
+            logger.error("Failed to produce response chunk: %s", failure.getTraceback())
+            self.request.loseConnection()
+        self._done.callback(None)
+
+    def stopProducing(self):
+        # the client went away
+        if not self._stopped:
+            self._stopped = True
+            self._done.callback(None)
+
+
+class JsonArrayParser(object):
+    """
+    Splits a JSON array arriving in chunks into its top level elements.  Each feed() returns the text of the
+    elements completed by that chunk, so a caller can decode and use them before the rest of the array has
+    arrived; only the element being read is buffered.
+    """
+
+    TOKENS = re.compile(r'[\[\]{}"\\]')
+
+    def __init__(self):
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._closed = False
+        self._element = []
+
+    def feed(self, data):
+        """
+        :raises ValueError: if the data is not part of a JSON array
+        :return: text of the elements completed by the data
+        :rtype: list of str
+        """
+        elements = []
+        start = 0
+        position = 1 if self._escaped and data else 0
+        self._escaped = self._escaped and not data
+        while True:
+            match = self.TOKENS.search(data, position)
+            if match is None:
+                break
+            position = match.end()
+            token = match.group()
+            if self._closed:
+                raise ValueError("Data after the end of the array")
+            if self._in_string:
+                if token == '\\':
+                    # skip the escaped character, which may be in the next chunk
+                    position += 1
+                    self._escaped = position > len(data)
+                elif token == '"':
+                    self._in_string = False
+                    if self._depth == 1:
+                        elements.append(self._complete(data[start:position]))
+                continue
+            if self._depth == 0 and token != '[':
+                raise ValueError("Expected a JSON array")
+            if token == '\\':
+                raise ValueError("Backslash outside a string")
+            if token == '"':
+                self._in_string = True
+                if self._depth == 1:
+                    start = match.start()
+            elif token in '[{':
+                if self._depth == 1:
+                    start = match.start()
+                self._depth += 1
+            else:
+                self._depth -= 1
+                if self._depth == 1:
+                    elements.append(self._complete(data[start:position]))
+                elif self._depth == 0:
+                    self._closed = True
+        if self._depth > 1 or (self._in_string and self._depth == 1):
+            self._element.append(data[start:])
+        return elements
+
+    def _complete(self, tail):
+        self._element.append(tail)
+        element = "".join(self._element)
+        self._element = []
+        return element
+
+    def close(self):
+        """
+        :raises ValueError: if the array was not complete
+        """
+        if not self._closed:
+            raise ValueError("Incomplete JSON array")
+
+
+class ResponseCompression(object):
+    """
+    Negotiated gzip or deflate for response bodies of at least threshold bytes.  Smaller bodies go out as
+    they are, since compressing them saves next to nothing.  Bytes before and after compression are counted
+    in the metrics, as response_bytes.uncompressed and response_bytes.compressed.
+
+    negotiate and apply touch the request, so they run on the reactor thread; compress and stream only see
+    the encoding negotiate chose, so the compressing can run on a thread pool.
+    """
+
+    THRESHOLD = config['network']['compression_threshold']
+    LEVEL = config['network']['compression_level']
+    # zlib window bits: gzip framing for gzip, zlib framing for http's deflate
+    WBITS = {'gzip': 16 + zlib.MAX_WBITS, 'deflate': zlib.MAX_WBITS}
+
+    def __init__(self, threshold=THRESHOLD, level=LEVEL, metrics=None):
+        self.threshold = threshold
+        self.level = level
+        self.metrics = metrics
+
+    def negotiate(self, request):
+        """
+        :return: the encoding the request's Accept-Encoding prefers, or None
+        :rtype: str
+        """
+        request.setHeader('Vary', 'Accept-Encoding')
+        preferences = {}
+        for accepted in (request.getHeader('Accept-Encoding') or '').split(','):
+            parts = accepted.split(';')
+            coding = parts[0].strip().lower()
+            quality = 1.0
+            for parameter in parts[1:]:
+                name, _, value = parameter.partition('=')
+                if name.strip() == 'q':
+                    try:
+                        quality = float(value)
+                    except ValueError:
+                        quality = 0.0
+            preferences[coding] = quality
+        best = None
+        for coding in ('gzip', 'deflate'):
+            quality = preferences.get(coding, preferences.get('*', 0.0))
+            if quality > 0 and (best is None or quality > preferences.get(best, preferences.get('*', 0.0))):
+                best = coding
+        return best
+
+    def _compressor(self, encoding):
+        return zlib.compressobj(self.level, zlib.DEFLATED, self.WBITS[encoding])
+
+    def _count(self, uncompressed, compressed):
+        if self.metrics is not None:
+            self.metrics.increment("response_bytes.uncompressed", uncompressed)
+            self.metrics.increment("response_bytes.compressed", compressed)
+
+    def compress(self, body, encoding):
+        """
+        :param encoding: the result of negotiate
+        :return: the body, compressed if it is big enough, and the Content-Encoding to send it with, or None
+        :rtype: tuple
+        """
+        if encoding is None or len(body) < self.threshold:
+            return body, None
+        compressor = self._compressor(encoding)
+        compressed = compressor.compress(body) + compressor.flush()
+        self._count(len(body), len(compressed))
+        return compressed, encoding
+
+    def respond(self, request, body):
+        """
+        :return: the body, compressed if the request accepts it and it is big enough
+        :rtype: str
+        """
+        return self.apply(self.compress(body, self.negotiate(request)), request)
+
+    def stream(self, chunks, encoding):
+        """
+        Starts compressing chunks for a ChunkProducer.  Chunks are held back until threshold bytes have been
+        produced, so a small response still goes out uncompressed; the held chunks are produced here.
+
+        :param encoding: the result of negotiate
+        :return: the chunks, compressed lazily if they reach the threshold, and the Content-Encoding to send
+            them with, or None
+        :rtype: tuple
+        """
+        chunks = iter(chunks)
+        if encoding is None:
+            return chunks, None
+        held = []
+        held_size = 0
+        for chunk in chunks:
+            held.append(chunk)
+            held_size += len(chunk)
+            if held_size >= self.threshold:
+                break
+        if held_size < self.threshold:
+            return iter(["".join(held)]), None
+        return self._compressed_chunks(itertools.chain(held, chunks), encoding), encoding
+
+    @staticmethod
+    def apply(compressed, request):
+        """
+        Deferred callback: sets the Content-Encoding of a compress or stream result on the request and passes
+        its body or chunks on
+        """
+        body, encoding = compressed
+        if encoding is not None:
+            request.setHeader('Content-Encoding', encoding)
+        return body
+
+    def _compressed_chunks(self, chunks, encoding):
+        compressor = self._compressor(encoding)
+        uncompressed = 0
+        compressed = 0
+        for chunk in chunks:
+            uncompressed += len(chunk)
+            data = compressor.compress(chunk)
+            if data:
+                compressed += len(data)
+                yield data
+        data = compressor.flush()
+        compressed += len(data)
+        self._count(uncompressed, compressed)
+        yield data
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,53 @@
+import json
+import unittest
+from mock import patch, Mock, MagicMock, call
+from crankycoin.block import *
+
+
+class TestBlock(unittest.TestCase):
+
+    def setUp(self):
+        self.transaction = Transaction("from", "to", 1, 0.1, "signature", 1498923800)
+        self.reward_transaction = Transaction("0", "to", 50, 0, "0", 1498923800)
+
+    def test_from_dict_thenRoundTripsJson(self):
+        block = Block(12, [self.transaction, self.reward_transaction], "previous_hash", 1498923900, 5)
+
+        subject = Block.from_dict(json.loads(block.to_json()))
+
+        self.assertEqual(subject, block)
+        self.assertEqual(subject.current_hash, block.current_hash)
+
+    def test_from_dict_whenTransactionsDeferred_thenDecodesThemOnFirstRead(self):
+        block = Block(12, [self.transaction, self.reward_transaction], "previous_hash", 1498923900, 5)
+        block_dict = json.loads(block.to_json())
+
+        with patch.object(Transaction, 'from_dict', wraps=Transaction.from_dict) as patched_from_dict:
+            subject = Block.from_dict(block_dict, defer_transactions=True)
+
+            self.assertEqual(patched_from_dict.call_count, 0)
+            self.assertEqual(subject.current_hash, block.current_hash)
+            self.assertEqual(subject.transactions, [self.transaction, self.reward_transaction])
+            self.assertEqual(patched_from_dict.call_count, 2)
+            self.assertEqual(subject, block)
+
+    def test_current_hash_whenReadTwice_thenHashesOnce(self):
+        with patch.object(Block, '_calculate_block_hash', return_value="0000_block_hash") as patched_calculate_block_hash:
+            subject = Block(12, [self.transaction, self.reward_transaction], "previous_hash", 1498923900, 5)
+
+            self.assertEqual(subject.current_hash, "0000_block_hash")
+            self.assertEqual(subject.current_hash, "0000_block_hash")
+            patched_calculate_block_hash.assert_called_once_with()
+
+    def test_calculate_merkle_root_thenHashesHexDigests(self):
+        transaction_two = Transaction("from", "to", 2, 0.1, "signature_two", 1498923800)
+        subject = Block(12, [self.transaction, transaction_two, self.reward_transaction], "previous_hash", 1498923900, 5)
+        left = hashlib.sha256(self.transaction.tx_hash + transaction_two.tx_hash).hexdigest()
+        right = hashlib.sha256(self.reward_transaction.tx_hash).hexdigest()
+
+        self.assertEqual(subject.calculate_merkle_root(), hashlib.sha256(left + right).hexdigest())
+        self.assertEqual(subject.block_header.merkle_root, hashlib.sha256(left + right).hexdigest())
+
+
+if __name__ == '__main__':
+    unittest.main()
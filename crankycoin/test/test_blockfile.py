@@ -0,0 +1,63 @@
+import os
+import shutil
+import tempfile
+import unittest
+from mock import patch, Mock, MagicMock, call
+from crankycoin.blockfile import *
+
+
+class TestBlockFile(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "blocks.dat")
+        reward_transaction = Transaction("0", "reward_address", 50, 0, "0", 1508823225)
+        hashes = ["0000" + c * 60 for c in "abcd"]
+        with patch.object(Block, '_calculate_block_hash', side_effect=hashes) as patched_calculate_block_hash:
+            self.blocks = [Block(i, [reward_transaction], "", 1508823300 + i, i) for i in range(4)]
+            for block in self.blocks:
+                block.current_hash
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_blocks_thenDecodesStoredBlocksAndHashes(self):
+        BlockFile.write(self.path, self.blocks)
+        subject = BlockFile(self.path)
+
+        resp = subject.blocks()
+
+        self.assertEqual([block for block, current_hash in resp], self.blocks)
+        self.assertEqual([current_hash for block, current_hash in resp], [b.current_hash for b in self.blocks])
+        self.assertEqual(len(subject), 4)
+        self.assertEqual(subject.get_hash(2), self.blocks[2].current_hash)
+        subject.close()
+
+    def test_get_block_message_thenMatchesEncodedBlock(self):
+        BlockFile.write(self.path, self.blocks)
+        subject = BlockFile(self.path)
+
+        self.assertEqual(subject.get_block_message(2), BinaryCodec.encode_block(self.blocks[2]))
+        self.assertEqual(subject.get_blocks_message(1, 3), BinaryCodec.encode_blocks(self.blocks[1:4]))
+        subject.close()
+
+    def test_write_whenFileIsMapped_thenOldMapStaysReadable(self):
+        BlockFile.write(self.path, self.blocks)
+        subject = BlockFile(self.path)
+
+        BlockFile.write(self.path, self.blocks[:1])
+
+        self.assertEqual(subject.get_block_message(3), BinaryCodec.encode_block(self.blocks[3]))
+        self.assertEqual(len(BlockFile(self.path)), 1)
+        subject.close()
+
+    def test_init_whenFileIsTruncated_thenRaisesInvalidEncoding(self):
+        with open(self.path, 'wb') as block_file:
+            block_file.write(BinaryCodec.encode_blocks(self.blocks)[:-1])
+
+        with self.assertRaises(InvalidEncoding):
+            BlockFile(self.path)
+
+
+if __name__ == '__main__':
+    unittest.main()
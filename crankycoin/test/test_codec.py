@@ -0,0 +1,138 @@
+import json
+import unittest
+from mock import patch, Mock, MagicMock, call
+from crankycoin.codec import *
+
+
+class TestBinaryCodec(unittest.TestCase):
+
+    def setUp(self):
+        self.transaction = Transaction(
+            "03dd1e57d05d9cab1d8d9b727568ad951ac2d9ecd082bc36f69e021b8427812924",
+            "0282a5ed22bcde32e8e2b4c4ed0af5e68d6e6e7db8dd2c1be1e3d0a3b6fd4c6b6a",
+            12.5,
+            0.1,
+            "3045022100b1f0" + "ab" * 30,
+            1508823223
+        )
+        self.reward_transaction = Transaction("0", "reward_address", 50, 0, "0", 1508823225)
+
+    def test_decode_transaction_thenRoundTripsTypesAndStrings(self):
+        data = BinaryCodec.encode_transaction(self.reward_transaction)
+
+        transaction, offset = BinaryCodec.decode_transaction(data)
+
+        self.assertEqual(transaction, self.reward_transaction)
+        self.assertEqual(transaction.tx_hash, self.reward_transaction.tx_hash)
+        self.assertIsInstance(transaction.amount, int)
+        self.assertEqual(offset, len(data))
+
+    def test_encode_transaction_thenHexStringsTravelAsRawBytes(self):
+        data = BinaryCodec.encode_transaction(self.transaction)
+
+        self.assertLess(len(data), len(self.transaction.to_json()) / 2)
+        self.assertEqual(BinaryCodec.decode_transaction(data)[0], self.transaction)
+
+    def test_decode_block_thenReturnsBlockAndClaimedHash(self):
+        with patch.object(Block, '_calculate_block_hash', return_value="0000" + "ab" * 30) as patched_calculate_block_hash:
+            block = Block(35, [self.transaction, self.reward_transaction], "0000" + "cd" * 30, 1508823300, 123)
+
+            decoded_block, current_hash = BinaryCodec.decode_block(BinaryCodec.encode_block(block))
+
+            self.assertEqual(decoded_block, block)
+            self.assertEqual(current_hash, "0000" + "ab" * 30)
+
+    def test_decode_blocks_thenReturnsBlocksInOrder(self):
+        with patch.object(Block, '_calculate_block_hash', return_value="0000" + "ab" * 30) as patched_calculate_block_hash:
+            blocks = [Block(i, [self.reward_transaction], "", 1508823300 + i, i) for i in range(3)]
+
+            resp = BinaryCodec.decode_blocks(BinaryCodec.encode_blocks(blocks))
+
+            self.assertEqual([block for block, current_hash in resp], blocks)
+
+    def test_decode_block_whenVersionUnsupported_thenRaisesInvalidEncoding(self):
+        with patch.object(Block, '_calculate_block_hash', return_value="0000" + "ab" * 30) as patched_calculate_block_hash:
+            data = BinaryCodec.encode_block(Block(1, [self.reward_transaction], "", 1508823300, 0))
+            data = data[:4] + chr(BinaryCodec.VERSION + 1) + data[5:]
+
+            with self.assertRaises(InvalidEncoding):
+                BinaryCodec.decode_block(data)
+
+    def test_decode_block_whenTruncated_thenRaisesInvalidEncoding(self):
+        with patch.object(Block, '_calculate_block_hash', return_value="0000" + "ab" * 30) as patched_calculate_block_hash:
+            data = BinaryCodec.encode_block(Block(1, [self.reward_transaction], "", 1508823300, 0))
+
+            with self.assertRaises(InvalidEncoding):
+                BinaryCodec.decode_block(data[:-1])
+            with self.assertRaises(InvalidEncoding):
+                BinaryCodec.decode_blocks(data)
+
+    def test_iter_decode_blocks_whenChunksSplitAnywhere_thenYieldsBlocksInOrder(self):
+        with patch.object(Block, '_calculate_block_hash', return_value="0000" + "ab" * 30) as patched_calculate_block_hash:
+            blocks = [Block(i, [self.reward_transaction], "", 1508823300 + i, i) for i in range(3)]
+            data = BinaryCodec.encode_blocks(blocks)
+
+            resp = BinaryCodec.iter_decode_blocks(data[i:i + 7] for i in range(0, len(data), 7))
+
+            self.assertEqual([block for block, current_hash in resp], blocks)
+
+    def test_iter_decode_blocks_whenTruncatedOrTrailing_thenRaisesInvalidEncoding(self):
+        with patch.object(Block, '_calculate_block_hash', return_value="0000" + "ab" * 30) as patched_calculate_block_hash:
+            data = BinaryCodec.encode_blocks([Block(1, [self.reward_transaction], "", 1508823300, 0)])
+
+            with self.assertRaises(InvalidEncoding):
+                list(BinaryCodec.iter_decode_blocks([data[:-1]]))
+            with self.assertRaises(InvalidEncoding):
+                list(BinaryCodec.iter_decode_blocks([data, "x"]))
+
+    def test_decode_block_whenTransactionLengthPrefixIsWrong_thenRaisesInvalidEncoding(self):
+        with patch.object(Block, '_calculate_block_hash', return_value="0000" + "ab" * 30) as patched_calculate_block_hash:
+            payload = BinaryCodec.encode_block_payload(Block(1, [self.reward_transaction], "", 1508823300, 0))
+            transaction_data = BinaryCodec.encode_transaction(self.reward_transaction)
+            sized = BinaryCodec.LENGTH.pack(len(transaction_data)) + transaction_data
+            padded = BinaryCodec.LENGTH.pack(len(transaction_data) + 1) + transaction_data + "x"
+
+            with self.assertRaises(InvalidEncoding):
+                BinaryCodec.decode_block(BinaryCodec._envelope(BinaryCodec.BLOCK, payload.replace(sized, padded)))
+
+    def test_decode_block_whenPayloadHasTrailingBytes_thenRaisesInvalidEncoding(self):
+        with patch.object(Block, '_calculate_block_hash', return_value="0000" + "ab" * 30) as patched_calculate_block_hash:
+            payload = BinaryCodec.encode_block_payload(Block(1, [self.reward_transaction], "", 1508823300, 0))
+
+            with self.assertRaises(InvalidEncoding):
+                BinaryCodec.decode_block(BinaryCodec._envelope(BinaryCodec.BLOCK, payload + "x"))
+
+    def test_decode_blocks_whenBlockLengthPrefixIsWrong_thenRaisesInvalidEncoding(self):
+        with patch.object(Block, '_calculate_block_hash', return_value="0000" + "ab" * 30) as patched_calculate_block_hash:
+            payload = BinaryCodec.encode_block_payload(Block(1, [self.reward_transaction], "", 1508823300, 0))
+            data = BinaryCodec._envelope(BinaryCodec.BLOCKS, BinaryCodec.LENGTH.pack(1) +
+                                         BinaryCodec.LENGTH.pack(len(payload) + 1) + payload + "x")
+
+            with self.assertRaises(InvalidEncoding):
+                BinaryCodec.decode_blocks(data)
+            with self.assertRaises(InvalidEncoding):
+                list(BinaryCodec.iter_decode_blocks([data]))
+
+
+class TestEncodedBlockCache(unittest.TestCase):
+
+    def test_get_whenFull_thenEvictsLeastRecentlyUsedBlock(self):
+        reward_transaction = Transaction("0", "reward_address", 50, 0, "0", 1508823225)
+        hashes = ["0000" + c * 60 for c in "abc"]
+        with patch.object(Block, '_calculate_block_hash', side_effect=hashes) as patched_calculate_block_hash:
+            blocks = [Block(i, [reward_transaction], "", 1508823300 + i, i) for i in range(3)]
+            subject = EncodedBlockCache(capacity=2)
+
+            subject.put(blocks[0])
+            subject.put(blocks[1])
+            resp = subject.get(blocks[0], BinaryCodec.CONTENT_TYPE)
+            subject.put(blocks[2])
+
+            self.assertEqual(resp, BinaryCodec.encode_block(blocks[0]))
+            self.assertIn(hashes[0], subject)
+            self.assertNotIn(hashes[1], subject)
+            self.assertIn(hashes[2], subject)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+import unittest
+from mock import patch, Mock, MagicMock, call
+from crankycoin.headers import *
+
+
+class TestHeaderChain(unittest.TestCase):
+
+    def setUp(self):
+        self.hash_zero = "0000" + "00" * 29 + "a0"
+        self.hash_one = "0000" + "00" * 29 + "a1"
+        self.hash_two = "0000" + "00" * 29 + "a2"
+
+    def test_append_header_thenHeaderIsReadableByHeight(self):
+        subject = HeaderChain()
+
+        subject.append_header(self.hash_zero, "", 1498923800, 4, 10)
+        subject.append_header(self.hash_one, self.hash_zero, 1498923860, 5, 11)
+
+        self.assertEqual(len(subject), 2)
+        self.assertEqual(subject.get_hash(1), self.hash_one)
+        self.assertEqual(subject.get_hash(-1), self.hash_one)
+        self.assertEqual(subject.get_previous_hash(1), self.hash_zero)
+        self.assertEqual(subject.get_timestamp(1), 1498923860)
+        self.assertEqual(subject.get_difficulty(1), 5)
+        self.assertEqual(subject.get_nonce(1), 11)
+
+    def test_append_header_whenFieldDoesNotFit_thenLeavesChainUnchanged(self):
+        subject = HeaderChain()
+        subject.append_header(self.hash_zero, "", 1498923800, 4, 10)
+
+        self.assertRaises(OverflowError, subject.append_header, self.hash_one, self.hash_zero, 1498923860, 5, -1)
+        self.assertRaises(TypeError, subject.append_header, self.hash_one, self.hash_zero, 1498923860.5, 5, 11)
+
+        self.assertEqual(len(subject), 1)
+        self.assertEqual(len(subject._hashes), HeaderChain.HASH_SIZE)
+        self.assertEqual(len(subject._previous_hashes), HeaderChain.HASH_SIZE)
+        self.assertEqual(len(subject._difficulties), 1)
+        self.assertEqual(len(subject._nonces), 1)
+
+    def test_get_previous_hash_whenGenesisHeader_thenReturnsEmptyHash(self):
+        subject = HeaderChain()
+
+        subject.append_header(self.hash_zero, "", 1498923800, 4, 10)
+
+        self.assertEqual(subject.get_previous_hash(0), "")
+
+    def test_get_hash_whenHeightOutOfRange_thenRaisesIndexError(self):
+        subject = HeaderChain()
+        subject.append_header(self.hash_zero, "", 1498923800, 4, 10)
+
+        with self.assertRaises(IndexError):
+            subject.get_hash(1)
+
+    def test_append_whenBlock_thenAppendsItsHeader(self):
+        mock_block = Mock()
+        mock_block.current_hash = self.hash_zero
+        mock_block.previous_hash = ""
+        mock_block.hash_difficulty = 4
+        mock_block.block_header.timestamp = 1498923800
+        mock_block.block_header.nonce = 10
+        subject = HeaderChain()
+
+        subject.append(mock_block)
+
+        self.assertEqual(subject.get_hash(0), self.hash_zero)
+        self.assertEqual(subject.get_nonce(0), 10)
+
+    def test_truncate_thenDropsHeadersFromHeight(self):
+        subject = HeaderChain()
+        subject.append_header(self.hash_zero, "", 1498923800, 4, 10)
+        subject.append_header(self.hash_one, self.hash_zero, 1498923860, 4, 11)
+        subject.append_header(self.hash_two, self.hash_one, 1498923920, 4, 12)
+
+        subject.truncate(1)
+
+        self.assertEqual(len(subject), 1)
+        self.assertIsNone(subject.get_height(self.hash_one))
+        self.assertEqual(subject.get_hash(-1), self.hash_zero)
+
+    def test_get_height_thenReturnsHeightOfHashOrNone(self):
+        subject = HeaderChain()
+        subject.append_header(self.hash_zero, "", 1498923800, 4, 10)
+        subject.append_header(self.hash_one, self.hash_zero, 1498923860, 4, 11)
+
+        self.assertEqual(subject.get_height(self.hash_one), 1)
+        self.assertEqual(subject.get_height(self.hash_zero), 0)
+        self.assertIsNone(subject.get_height(self.hash_two))
+
+
+if __name__ == '__main__':
+    unittest.main()
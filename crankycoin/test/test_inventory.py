@@ -0,0 +1,36 @@
+import unittest
+from mock import patch, Mock, MagicMock, call
+from crankycoin.inventory import *
+
+
+class TestRecentlySeen(unittest.TestCase):
+
+    def test_add_whenHashIsNew_thenReturnsTrue(self):
+        subject = RecentlySeen(3)
+
+        self.assertTrue(subject.add("hash_one"))
+        self.assertIn("hash_one", subject)
+
+    def test_add_whenHashAlreadySeen_thenReturnsFalse(self):
+        subject = RecentlySeen(3)
+        subject.add("hash_one")
+
+        self.assertFalse(subject.add("hash_one"))
+
+    def test_add_whenCapacityExceeded_thenForgetsOldestHash(self):
+        subject = RecentlySeen(2)
+
+        subject.add("hash_one")
+        subject.add("hash_two")
+        subject.add("hash_three")
+
+        self.assertNotIn("hash_one", subject)
+        self.assertIn("hash_two", subject)
+        self.assertIn("hash_three", subject)
+        self.assertEqual(len(subject), 2)
+
+    def test_unseen_thenReturnsHashesNotSeenInOrder(self):
+        subject = RecentlySeen(3)
+        subject.add("hash_two")
+
+        self.assertEqual(subject.unseen(["hash_one", "hash_two", "hash_three"]), ["hash_one", "hash_three"])
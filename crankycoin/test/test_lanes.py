@@ -0,0 +1,38 @@
+import threading
+import unittest
+from mock import patch, Mock, MagicMock, call
+from crankycoin.lanes import *
+
+
+class TestPriorityGate(unittest.TestCase):
+
+    def test_is_open_whenNoWorkPending_thenReturnsTrue(self):
+        subject = PriorityGate()
+
+        self.assertTrue(subject.is_open())
+
+    def test_is_open_whenWorkPending_thenReturnsFalseUntilAllWorkLeaves(self):
+        subject = PriorityGate()
+        subject.enter()
+        subject.enter()
+
+        subject.leave()
+        self.assertFalse(subject.is_open())
+        subject.leave()
+        self.assertTrue(subject.is_open())
+
+    def test_wait_whenWorkPending_thenBlocksUntilWorkLeaves(self):
+        subject = PriorityGate()
+        subject.enter()
+        waiter = threading.Thread(target=subject.wait)
+        waiter.start()
+
+        waiter.join(0.1)
+        self.assertTrue(waiter.is_alive())
+        subject.leave()
+        waiter.join(1)
+        self.assertFalse(waiter.is_alive())
+
+
+if __name__ == '__main__':
+    unittest.main()
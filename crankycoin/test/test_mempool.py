@@ -0,0 +1,148 @@
+import os
+import unittest
+from mock import patch, Mock, MagicMock, call
+from crankycoin.mempool import *
+
+
+class TestSharedMempool(unittest.TestCase):
+
+    def setUp(self):
+        self.transaction_one = Transaction("from", "to", 1, 0.1, "signature_one", 1498923800)
+        self.transaction_two = Transaction("from", "to", 2, 0.3, "signature_two", 1498923800)
+        self.transaction_three = Transaction("from", "to", 3, 0.1, "signature_three", 1498923800)
+
+    def test_push_whenTransactionIsNew_thenReturnsTrue(self):
+        subject = SharedMempool(capacity=3)
+
+        self.assertTrue(subject.push(self.transaction_one))
+        self.assertIn(self.transaction_one, subject)
+        self.assertIn(self.transaction_one.tx_hash, subject)
+        self.assertEqual(len(subject), 1)
+
+    def test_push_whenTransactionAlreadyInPool_thenReturnsFalse(self):
+        subject = SharedMempool(capacity=3)
+        subject.push(self.transaction_one)
+
+        self.assertFalse(subject.push(self.transaction_one))
+        self.assertEqual(len(subject), 1)
+
+    def test_push_whenPoolIsFull_thenReturnsFalse(self):
+        subject = SharedMempool(capacity=2)
+        subject.push(self.transaction_one)
+        subject.push(self.transaction_two)
+
+        self.assertFalse(subject.push(self.transaction_three))
+        self.assertNotIn(self.transaction_three, subject)
+
+    def test_push_whenTransactionLargerThanSlot_thenReturnsFalse(self):
+        subject = SharedMempool(capacity=2, slot_size=128)
+
+        self.assertFalse(subject.push(self.transaction_one))
+
+    def test_pop_thenReturnsHighestFeeThenOldestTransaction(self):
+        subject = SharedMempool(capacity=3)
+        subject.push(self.transaction_one)
+        subject.push(self.transaction_two)
+        subject.push(self.transaction_three)
+
+        self.assertEqual(subject.pop(), self.transaction_two)
+        self.assertEqual(subject.pop(), self.transaction_one)
+        self.assertEqual(subject.pop(), self.transaction_three)
+        self.assertIsNone(subject.pop())
+        self.assertEqual(len(subject), 0)
+
+    def test_remove_thenTransactionIsNoLongerFoundAndSlotIsReused(self):
+        subject = SharedMempool(capacity=2)
+        subject.push(self.transaction_one)
+        subject.push(self.transaction_two)
+
+        self.assertTrue(subject.remove(self.transaction_one.tx_hash))
+        self.assertFalse(subject.remove(self.transaction_one.tx_hash))
+        self.assertNotIn(self.transaction_one, subject)
+        self.assertIn(self.transaction_two, subject)
+        self.assertTrue(subject.push(self.transaction_three))
+        self.assertEqual(subject.get_all(), [self.transaction_two, self.transaction_three])
+
+    def test_push_whenFeeIsNegative_thenReturnsFalse(self):
+        subject = SharedMempool(capacity=2)
+        transaction = Transaction("from", "to", 1, -1, "signature_negative", 1498923800)
+
+        self.assertFalse(subject.push(transaction))
+        self.assertEqual(len(subject), 0)
+
+    def test_push_whenFeeIsZero_thenTransactionIsPopped(self):
+        subject = SharedMempool(capacity=2)
+        transaction = Transaction("from", "to", 1, 0, "signature_free", 1498923800)
+        subject.push(transaction)
+
+        self.assertEqual(subject.pop(), transaction)
+        self.assertIsNone(subject.pop())
+
+    def test_pop_whenManyTransactions_thenReturnsThemByFeeThenAge(self):
+        subject = SharedMempool(capacity=64)
+        transactions = [Transaction("from", "to", i, (i * 7) % 5, "signature_{}".format(i), 1498923800)
+                        for i in range(40)]
+        for transaction in transactions:
+            subject.push(transaction)
+        for transaction in transactions[::3]:
+            subject.remove(transaction.tx_hash)
+        remaining = [transaction for i, transaction in enumerate(transactions) if i % 3 != 0]
+
+        popped = [subject.pop() for i in range(len(remaining))]
+
+        self.assertEqual(popped, sorted(remaining, key=lambda transaction: -transaction.fee))
+        self.assertIsNone(subject.pop())
+
+    def test_remove_whenTombstonesPassThreshold_thenRehashesAndKeepsTransactions(self):
+        subject = SharedMempool(capacity=8)
+        transactions = [Transaction("from", "to", i, i, "signature_{}".format(i), 1498923800) for i in range(6)]
+        for transaction in transactions:
+            subject.push(transaction)
+
+        for transaction in transactions[:3]:
+            subject.remove(transaction.tx_hash)
+
+        count, next_sequence, deleted = subject._read_header()
+        self.assertEqual(count, 3)
+        self.assertEqual(deleted, 0)
+        for transaction in transactions[3:]:
+            self.assertIn(transaction, subject)
+        self.assertEqual(subject.get_all(), transactions[:2:-1])
+        self.assertEqual(subject.pop(), transactions[5])
+
+    def test_get_by_short_ids_thenDecodesOnlyMatchingTransactions(self):
+        subject = SharedMempool(capacity=3)
+        subject.push(self.transaction_one)
+        subject.push(self.transaction_two)
+        subject.push(self.transaction_three)
+        short_id_one = Block.short_transaction_id("block_hash", self.transaction_one.tx_hash)
+        short_id_three = Block.short_transaction_id("block_hash", self.transaction_three.tx_hash)
+
+        with patch.object(Transaction, 'from_dict', wraps=Transaction.from_dict) as patched_from_dict:
+            resp = subject.get_by_short_ids("block_hash", [short_id_one, short_id_three, "unknown"])
+
+        self.assertEqual(resp, {short_id_one: self.transaction_one, short_id_three: self.transaction_three})
+        self.assertEqual(patched_from_dict.call_count, 2)
+
+    def test_contains_whenHashIsNotHex_thenReturnsFalse(self):
+        subject = SharedMempool(capacity=2)
+        subject.push(self.transaction_one)
+
+        self.assertNotIn("not a hash", subject)
+        self.assertFalse(subject.remove("not a hash"))
+        self.assertEqual(len(subject), 1)
+
+    def test_push_whenCalledFromForkedProcess_thenTransactionIsVisibleToParent(self):
+        subject = SharedMempool(capacity=3)
+
+        pid = os.fork()
+        if pid == 0:
+            subject.push(self.transaction_one)
+            os._exit(0)
+        os.waitpid(pid, 0)
+
+        self.assertEqual(subject.get_all(), [self.transaction_one])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,29 @@
+import unittest
+from mock import patch, Mock, MagicMock, call
+from crankycoin.metrics import *
+
+
+class TestMetrics(unittest.TestCase):
+
+    def test_increment_thenAddsToCounter(self):
+        subject = Metrics()
+
+        subject.increment("sync_attempts")
+        subject.increment("sync_attempts", 2)
+
+        self.assertEqual(subject.get_counter("sync_attempts"), 3)
+        self.assertEqual(subject.get_counter("sync_failures"), 0)
+
+    def test_snapshot_thenReturnsCopyOfCountersAndGauges(self):
+        subject = Metrics()
+        subject.increment("sync_attempts")
+        subject.set_gauge("tip_lag", 4)
+
+        snapshot = subject.snapshot()
+        subject.set_gauge("tip_lag", 0)
+
+        self.assertEqual(snapshot, {"counters": {"sync_attempts": 1}, "gauges": {"tip_lag": 4}})
+
+
+if __name__ == '__main__':
+    unittest.main()
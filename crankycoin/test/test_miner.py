@@ -0,0 +1,62 @@
+import unittest
+from mock import patch, Mock, MagicMock, call
+from crankycoin.miner import *
+
+
+class TestMiner(unittest.TestCase):
+
+    def test_mine_work_units_whenNonceInRangeSatisfiesDifficulty_thenAnswersWithNonce(self):
+        block_header = BlockHeader("previous_hash", "merkle_root", 1508823223)
+        connection = Mock()
+        connection.recv.side_effect = [(1, block_header, 1, 0, 100), None]
+        connection.poll.return_value = False
+
+        with patch("crankycoin.miner.calculate_hash", side_effect=["a_hash", "b_hash", "0_hash"]) as patched_calculate_hash:
+            mine_work_units(connection, connection)
+
+            connection.send.assert_called_once_with((1, 2))
+
+    def test_mine_work_units_whenRangeExhausted_thenAnswersWithNone(self):
+        block_header = BlockHeader("previous_hash", "merkle_root", 1508823223)
+        connection = Mock()
+        connection.recv.side_effect = [(1, block_header, 1, 0, 3), None]
+        connection.poll.return_value = False
+
+        with patch("crankycoin.miner.calculate_hash", return_value="a_hash") as patched_calculate_hash:
+            mine_work_units(connection, connection)
+
+            connection.send.assert_called_once_with((1, None))
+            self.assertEqual(patched_calculate_hash.call_count, 3)
+
+    def test_mine_work_units_whenNewWorkArrives_thenAbandonsCurrentWorkWithoutAnswer(self):
+        block_header = BlockHeader("previous_hash", "merkle_root", 1508823223)
+        connection = Mock()
+        connection.recv.side_effect = [(1, block_header, 1, 0, 1000), (2, None, 0, 0, 0), None]
+        connection.poll.side_effect = [False, True]
+
+        with patch("crankycoin.miner.calculate_hash", return_value="a_hash") as patched_calculate_hash:
+            mine_work_units(connection, connection)
+
+            connection.send.assert_called_once_with((2, None))
+            self.assertEqual(patched_calculate_hash.call_count, POLL_INTERVAL)
+
+    def test_solve_thenReturnsNonceFoundByWorkerProcess(self):
+        block_header = BlockHeader("previous_hash", "merkle_root", 1508823223)
+        subject = Miner(workers=1)
+        try:
+            nonce = subject.solve(block_header, 1, lambda: False)
+
+            block_header.nonce = nonce
+            self.assertTrue(meets_difficulty(calculate_hash(block_header.to_hashable()), 1))
+        finally:
+            subject.shutdown(True)
+
+    def test_solve_whenWorkIsStale_thenReturnsNone(self):
+        block_header = BlockHeader("previous_hash", "merkle_root", 1508823223)
+        subject = Miner(workers=1)
+        try:
+            nonce = subject.solve(block_header, 64, lambda: True)
+
+            self.assertIsNone(nonce)
+        finally:
+            subject.shutdown(True)
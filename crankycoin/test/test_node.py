@@ -1,6 +1,19 @@
+import os
+import shutil
+import tempfile
 import unittest
-from mock import patch, Mock, MagicMock, call, PropertyMock
+import zlib
+from mock import patch, Mock, MagicMock, call, PropertyMock, ANY
+from twisted.internet.defer import Deferred, maybeDeferred
+from twisted.web.test.requesthelper import DummyRequest
 from crankycoin.node import *
+from crankycoin.wire import WireRequest, WireResponse
+
+
+def run_transaction_jobs(node, patched_reactor):
+    patched_reactor.callFromThread.side_effect = lambda f, *args: f(*args)
+    while not node.transaction_queue.empty():
+        node._run_transaction_job(node.transaction_queue.get_nowait())
 
 
 class TestNode(unittest.TestCase):
@@ -17,7 +30,7 @@ class TestNode(unittest.TestCase):
 
             self.assertIsNotNone(nodes)
             self.assertEqual(nodes, {"full_nodes": ["127.0.0.2", "127.0.0.1", "127.0.0.3"]})
-            patched_requests.assert_called_once_with('http://127.0.0.2:30013/nodes')
+            patched_requests.assert_called_once_with('http://127.0.0.2:30013/nodes', timeout=5)
 
     def test_request_nodes_whenNon200Status_thenReturnsNone(self):
         mock_response = Mock()
@@ -29,7 +42,7 @@ class TestNode(unittest.TestCase):
             nodes = node.request_nodes("127.0.0.2", "30013")
 
             self.assertIsNone(nodes)
-            patched_requests.assert_called_once_with('http://127.0.0.2:30013/nodes')
+            patched_requests.assert_called_once_with('http://127.0.0.2:30013/nodes', timeout=5)
 
     def test_request_nodes_whenRequestError_thenReturnsNone(self):
         with patch.object(FullNode, '__init__', return_value=None) as patched_init, \
@@ -39,7 +52,7 @@ class TestNode(unittest.TestCase):
             nodes = node.request_nodes("127.0.0.2", "30013")
 
             self.assertIsNone(nodes)
-            patched_requests.assert_called_once_with('http://127.0.0.2:30013/nodes')
+            patched_requests.assert_called_once_with('http://127.0.0.2:30013/nodes', timeout=5)
 
     def test_request_nodes_from_all_SetsFullNodesPropertyOnClass(self):
         nodes_one = {"full_nodes": ["127.0.0.2", "127.0.0.1", "127.0.0.4"]}
@@ -54,49 +67,252 @@ class TestNode(unittest.TestCase):
 
             self.assertEqual(node.full_nodes, {"127.0.0.2", "127.0.0.1", "127.0.0.3", "127.0.0.4", "127.0.0.5", "127.0.1.1", "127.0.1.2"})
 
-    def test_broadcast_transaction_thenBroadcastsToAllNodes(self):
+    def test_refresh_nodes_whenPeerTableIsFresh_thenDoesNotRequestNodes(self):
+        with patch.object(FullNode, '__init__', return_value=None) as patched_init, \
+                patch.object(FullNode, 'request_nodes_from_all') as patched_request_nodes_from_all, \
+                patch("crankycoin.node.time.time", return_value=1508823223) as patched_time_time:
+            node = FullNode("127.0.0.1", "reward_address")
+            node.full_nodes_refreshed_at = 1508823223 - FullNode.PEER_TABLE_TTL + 1
+
+            node.refresh_nodes()
+
+            patched_request_nodes_from_all.assert_not_called()
+
+    def test_refresh_nodes_whenPeerTableIsStale_thenRequestsNodesFromAll(self):
         with patch.object(FullNode, '__init__', return_value=None) as patched_init, \
                 patch.object(FullNode, 'request_nodes_from_all') as patched_request_nodes_from_all, \
-                patch("crankycoin.time.time", return_value="1508823223") as patched_time_time, \
+                patch("crankycoin.node.time.time", return_value=1508823223) as patched_time_time:
+            node = FullNode("127.0.0.1", "reward_address")
+            node.full_nodes_refreshed_at = 1508823223 - FullNode.PEER_TABLE_TTL
+
+            node.refresh_nodes()
+
+            patched_request_nodes_from_all.assert_called_once()
+
+    def test_request_whenRequestException_thenRecordsFailureAndReraises(self):
+        with patch.object(FullNode, '__init__', return_value=None) as patched_init, \
+                patch.object(FullNode, 'remove_node') as patched_remove_node, \
+                patch("crankycoin.requests.get", side_effect=requests.exceptions.RequestException()) as patched_requests:
+            node = FullNode("127.0.0.1", "reward_address")
+
+            with self.assertRaises(requests.exceptions.RequestException):
+                node._request(requests.get, "127.0.0.2", "http://127.0.0.2:30013/nodes")
+
+            self.assertEqual(node.peer_health.get_failures("127.0.0.2"), 1)
+            patched_remove_node.assert_not_called()
+
+    def test_request_whenFailuresReachEvictionThreshold_thenRemovesNode(self):
+        with patch.object(FullNode, '__init__', return_value=None) as patched_init, \
+                patch("crankycoin.requests.get", side_effect=requests.exceptions.RequestException()) as patched_requests:
+            node = FullNode("127.0.0.1", "reward_address")
+            node.full_nodes = {"127.0.0.1", "127.0.0.2"}
+
+            for i in range(PeerHealth.EVICTION_THRESHOLD):
+                with self.assertRaises(requests.exceptions.RequestException):
+                    node._request(requests.get, "127.0.0.2", "http://127.0.0.2:30013/nodes")
+
+            self.assertEqual(node.full_nodes, {"127.0.0.1"})
+
+    def test_get_healthy_nodes_whenNodeIsBackedOff_thenSkipsNodeAndSortsByLatency(self):
+        with patch.object(FullNode, '__init__', return_value=None) as patched_init:
+            node = FullNode("127.0.0.1", "reward_address")
+            node.full_nodes = {"127.0.0.1", "127.0.0.2", "127.0.0.3"}
+            node.peer_health.record_success("127.0.0.1", 0.5)
+            node.peer_health.record_success("127.0.0.2", 0.1)
+            for i in range(PeerHealth.FAILURE_THRESHOLD):
+                node.peer_health.record_failure("127.0.0.3")
+
+            nodes = node.get_healthy_nodes()
+
+            self.assertEqual(nodes, ["127.0.0.2", "127.0.0.1"])
+
+    def test_get_healthy_nodes_whenPeersChangeWhileRanking_thenRanksSnapshot(self):
+        with patch.object(FullNode, '__init__', return_value=None) as patched_init:
+            node = FullNode("127.0.0.1", "reward_address")
+            node.host = "127.0.0.1"
+            node.full_nodes = {"127.0.0.1", "127.0.0.2", "127.0.0.3"}
+
+            def add_node_while_ranking(peer, now=None):
+                node.add_node("127.0.1.{}".format(peer[-1]))
+                return True
+
+            with patch.object(FullNode, 'broadcast_node') as patched_broadcast_node, \
+                    patch.object(PeerHealth, 'is_available', side_effect=add_node_while_ranking):
+                nodes = node.get_healthy_nodes()
+
+            self.assertEqual(sorted(nodes), ["127.0.0.1", "127.0.0.2", "127.0.0.3"])
+            self.assertEqual(len(node.full_nodes), 6)
+
+    def test_broadcast_transaction_whenClient_thenBroadcastsToAllNodes(self):
+        with patch.object(NodeMixin, 'refresh_nodes') as patched_refresh_nodes, \
+                patch("crankycoin.time.time", return_value=1508823223) as patched_time_time, \
                 patch("crankycoin.requests.post") as patched_requests:
 
             transaction = Transaction("source", "destination", 0, 0)
-            node = FullNode("127.0.0.1", "reward_address")
+            node = NodeMixin()
             node.full_nodes = {"127.0.0.1", "127.0.0.2", "127.0.0.3"}
 
             node.broadcast_transaction(transaction)
 
-            patched_request_nodes_from_all.assert_called_once()
+            patched_refresh_nodes.assert_called_once()
             patched_requests.assert_has_calls([
-                call("http://127.0.0.1:30013/transactions", json={'transaction': '{"amount": 0, "destination": "destination", "fee": 0, "signature": null, "source": "source", "timestamp": 1508823223, "tx_hash": null}'}),
-                call("http://127.0.0.2:30013/transactions", json={'transaction': '{"amount": 0, "destination": "destination", "fee": 0, "signature": null, "source": "source", "timestamp": 1508823223, "tx_hash": null}'}),
-                call("http://127.0.0.3:30013/transactions", json={'transaction': '{"amount": 0, "destination": "destination", "fee": 0, "signature": null, "source": "source", "timestamp": 1508823223, "tx_hash": null}'})
+                call("http://127.0.0.1:30013/transactions", timeout=5, json={'transaction': '{"amount": 0, "destination": "destination", "fee": 0, "signature": null, "source": "source", "timestamp": 1508823223, "tx_hash": null}'}),
+                call("http://127.0.0.2:30013/transactions", timeout=5, json={'transaction': '{"amount": 0, "destination": "destination", "fee": 0, "signature": null, "source": "source", "timestamp": 1508823223, "tx_hash": null}'}),
+                call("http://127.0.0.3:30013/transactions", timeout=5, json={'transaction': '{"amount": 0, "destination": "destination", "fee": 0, "signature": null, "source": "source", "timestamp": 1508823223, "tx_hash": null}'})
             ], True)
 
-    def test_broadcast_transaction_whenRequestException_thenFailsGracefully(self):
-        with patch.object(FullNode, '__init__', return_value=None) as patched_init, \
-                patch.object(FullNode, 'request_nodes_from_all') as patched_request_nodes_from_all, \
-                patch("crankycoin.time.time", return_value="1508823223") as patched_time_time, \
+    def test_broadcast_transaction_whenClientAndRequestException_thenFailsGracefully(self):
+        with patch.object(NodeMixin, 'refresh_nodes') as patched_refresh_nodes, \
+                patch("crankycoin.time.time", return_value=1508823223) as patched_time_time, \
                 patch("crankycoin.requests.post", side_effect=requests.exceptions.RequestException()) as patched_requests:
 
             transaction = Transaction("source", "destination", 0, 0)
-            node = FullNode("127.0.0.1", "reward_address")
+            node = NodeMixin()
             node.full_nodes = {"127.0.0.1", "127.0.0.2", "127.0.0.3"}
 
             node.broadcast_transaction(transaction)
 
-            patched_request_nodes_from_all.assert_called_once()
+            patched_refresh_nodes.assert_called_once()
             patched_requests.assert_has_calls([
-                call("http://127.0.0.1:30013/transactions", json={'transaction': '{"amount": 0, "destination": "destination", "fee": 0, "signature": null, "source": "source", "timestamp": 1508823223, "tx_hash": null}'}),
-                call("http://127.0.0.2:30013/transactions", json={'transaction': '{"amount": 0, "destination": "destination", "fee": 0, "signature": null, "source": "source", "timestamp": 1508823223, "tx_hash": null}'}),
-                call("http://127.0.0.3:30013/transactions", json={'transaction': '{"amount": 0, "destination": "destination", "fee": 0, "signature": null, "source": "source", "timestamp": 1508823223, "tx_hash": null}'})
+                call("http://127.0.0.1:30013/transactions", timeout=5, json={'transaction': '{"amount": 0, "destination": "destination", "fee": 0, "signature": null, "source": "source", "timestamp": 1508823223, "tx_hash": null}'}),
+                call("http://127.0.0.2:30013/transactions", timeout=5, json={'transaction': '{"amount": 0, "destination": "destination", "fee": 0, "signature": null, "source": "source", "timestamp": 1508823223, "tx_hash": null}'}),
+                call("http://127.0.0.3:30013/transactions", timeout=5, json={'transaction': '{"amount": 0, "destination": "destination", "fee": 0, "signature": null, "source": "source", "timestamp": 1508823223, "tx_hash": null}'})
             ], True)
 
+    def test_broadcast_transaction_whenFullNode_thenPostsOnlyToNodesThatWantTransaction(self):
+        transaction = Mock(Transaction)
+        transaction.tx_hash = "transaction_hash"
+        transaction.to_json.return_value = "transaction_json"
+        wanted = {"blocks": [], "transactions": ["transaction_hash"]}
+        not_wanted = {"blocks": [], "transactions": []}
+
+        with patch.object(FullNode, '__init__', return_value=None) as patched_init, \
+                patch.object(FullNode, 'refresh_nodes') as patched_refresh_nodes, \
+                patch.object(FullNode, 'get_healthy_nodes', return_value=["127.0.0.1", "127.0.0.2", "127.0.0.3"]), \
+                patch.object(FullNode, 'announce_inventory', side_effect=[wanted, not_wanted]) as patched_announce_inventory, \
+                patch("crankycoin.requests.post") as patched_requests:
+            node = FullNode("127.0.0.1", "reward_address")
+            node.host = "127.0.0.1"
+
+            node.broadcast_transaction(transaction)
+
+            patched_announce_inventory.assert_has_calls([
+                call("127.0.0.2", transactions=["transaction_hash"]),
+                call("127.0.0.3", transactions=["transaction_hash"])
+            ])
+            patched_requests.assert_called_once_with("http://127.0.0.2:30013/transactions", timeout=5,
+                                                     json={"transaction": "transaction_json"})
+            self.assertIn("transaction_hash", node.inventory)
+
+    def test_broadcast_block_whenPeerAlreadyHasBlock_thenDoesNotCountConfirmation(self):
+        block = Mock(Block)
+        block.current_hash = "block_hash"
+        block.to_compact_json.return_value = "compact_block_json"
+        wanted = {"blocks": ["block_hash"], "transactions": []}
+        not_wanted = {"blocks": [], "transactions": []}
+        mock_response = Mock()
+        mock_response.status_code = 202
+
+        with patch.object(FullNode, '__init__', return_value=None) as patched_init, \
+                patch.object(FullNode, 'refresh_nodes') as patched_refresh_nodes, \
+                patch.object(FullNode, 'get_healthy_nodes', return_value=["127.0.0.2", "127.0.0.3"]), \
+                patch.object(FullNode, 'announce_inventory', side_effect=[not_wanted, wanted]), \
+                patch.object(FullNode, '_peer_request', return_value=mock_response) as patched_peer_request:
+            node = FullNode("127.0.0.1", "reward_address")
+            node.host = "127.0.0.1"
+
+            statuses = node.broadcast_block(block)
+
+            self.assertEqual(statuses, {"confirmations": 1, "invalidations": 0, "expirations": 0})
+            patched_peer_request.assert_called_once_with(
+                "127.0.0.3", PeerWire.COMPACT_BLOCK, "http://127.0.0.3:30013/blocks/compact",
+                {"block": "compact_block_json", "host": "127.0.0.1"})
+
+    def test_announce_inventory_whenPeerHasWireConnection_thenSendsOverWire(self):
+        mock_peer_wire = Mock(PeerWire)
+        mock_peer_wire.request.return_value = WireResponse(200, '{"blocks": ["block_hash"], "transactions": []}')
+
+        with patch.object(FullNode, '__init__', return_value=None) as patched_init, \
+                patch("crankycoin.requests.post") as patched_requests:
+            node = FullNode("127.0.0.1", "reward_address")
+            node.host = "127.0.0.1"
+            node.peer_wire = mock_peer_wire
+
+            resp = node.announce_inventory("127.0.0.2", blocks=["block_hash"])
+
+            self.assertEqual(resp, {"blocks": ["block_hash"], "transactions": []})
+            kind, payload = mock_peer_wire.request.call_args[0][1:]
+            self.assertEqual(kind, PeerWire.INVENTORY)
+            self.assertEqual(json.loads(payload), {"host": "127.0.0.1", "blocks": ["block_hash"], "transactions": []})
+            patched_requests.assert_not_called()
+
+    def test_announce_inventory_whenPeerUnreachableOnWire_thenFallsBackToHttp(self):
+        mock_peer_wire = Mock(PeerWire)
+        mock_peer_wire.request.return_value = None
+        mock_response = Mock()
+        mock_response.status_code = 200
+        mock_response.json.return_value = {"blocks": [], "transactions": []}
+
+        with patch.object(FullNode, '__init__', return_value=None) as patched_init, \
+                patch("crankycoin.requests.post", return_value=mock_response) as patched_requests:
+            node = FullNode("127.0.0.1", "reward_address")
+            node.host = "127.0.0.1"
+            node.peer_wire = mock_peer_wire
+
+            resp = node.announce_inventory("127.0.0.2", blocks=["block_hash"])
+
+            self.assertEqual(resp, {"blocks": [], "transactions": []})
+            patched_requests.assert_called_once_with("http://127.0.0.2:30013/inventory", timeout=5,
+                                                     json={"host": "127.0.0.1", "blocks": ["block_hash"], "transactions": []})
+
+    def test_announce_inventory_whenWireRequestSentButUnanswered_thenRecordsFailureWithoutHttpRetry(self):
+        mock_peer_wire = Mock(PeerWire)
+        mock_peer_wire.request.side_effect = WireRequestFailed("timed out")
+
+        with patch.object(FullNode, '__init__', return_value=None) as patched_init, \
+                patch("crankycoin.requests.post") as patched_requests:
+            node = FullNode("127.0.0.1", "reward_address")
+            node.host = "127.0.0.1"
+            node.peer_wire = mock_peer_wire
+
+            resp = node.announce_inventory("127.0.0.2", blocks=["block_hash"])
+
+            self.assertIsNone(resp)
+            self.assertEqual(node.peer_health.get_failures("127.0.0.2"), 1)
+            patched_requests.assert_not_called()
+
+    def test_wire_handlers_thenRouteEachKindToItsHttpHandler(self):
+        with patch.object(FullNode, '__init__', return_value=None) as patched_init:
+            node = FullNode("127.0.0.1", "reward_address")
+            node.inventory.add("seen_block_hash")
+            request = WireRequest(json.dumps({"host": "127.0.0.2", "blocks": ["seen_block_hash", "new_block_hash"]}))
+
+            resp = node._wire_handlers()[PeerWire.INVENTORY](request)
+
+            self.assertEqual(json.loads(resp), {"blocks": ["new_block_hash"], "transactions": []})
+
+    def test_post_inventory_thenReturnsOnlyUnseenHashes(self):
+        mock_request = Mock()
+        mock_request.content.read.return_value = json.dumps({
+            "host": "127.0.0.2",
+            "blocks": ["seen_block_hash", "new_block_hash"],
+            "transactions": ["seen_transaction_hash", "new_transaction_hash"]
+        })
+        with patch.object(FullNode, '__init__', return_value=None) as patched_init:
+            node = FullNode("127.0.0.1", "reward_address")
+            node.inventory.add("seen_block_hash")
+            node.inventory.add("seen_transaction_hash")
+
+            response = json.loads(node.post_inventory(mock_request))
+
+            self.assertEqual(response, {"blocks": ["new_block_hash"], "transactions": ["new_transaction_hash"]})
+
     def test_request_block_whenIndexIsLatest_thenRequestsLatestBlockFromNode(self):
         mock_response = Mock()
         mock_response.status_code = 200
-        mock_response.json.return_value = '{"nonce": 12345, "index": 35, "transactions": [{"amount": 0, "destination": "destination", "fee": 0, "signature": "signature", "source": "source", "timestamp": 1508823223, "tx_hash": null}], "timestamp": 1234567890, "current_hash": "current_hash", "previous_hash": "previous_hash"}'
-        transaction = Transaction("source", "destination", 0, 0, "signature")
+        mock_response.headers = {'Content-Type': 'application/json'}
+        mock_response.json.return_value = '{"index": 35, "transactions": [{"amount": 0, "destination": "destination", "fee": 0, "signature": "signature", "source": "source", "timestamp": 1508823223, "tx_hash": null}], "block_header": {"version": 1, "previous_hash": "previous_hash", "merkle_root": "merkle_root", "timestamp": 1234567890, "nonce": 12345}, "current_hash": "current_hash"}'
+        transaction = Transaction("source", "destination", 0, 0, "signature", 1508823223)
 
         with patch.object(FullNode, '__init__', return_value=None) as patched_init, \
                 patch("crankycoin.node.Block.current_hash", new_callable=PropertyMock) as patched_block_current_hash, \
@@ -113,13 +329,14 @@ class TestNode(unittest.TestCase):
             self.assertEqual(block.current_hash, "current_hash")
             self.assertEqual(block.block_header.timestamp, 1234567890)
             self.assertEqual(block.block_header.nonce, 12345)
-            patched_requests.assert_called_once_with('http://127.0.0.2:30013/block/latest')
+            patched_requests.assert_called_once_with('http://127.0.0.2:30013/block/latest', headers=FullNode.BLOCK_ACCEPT, timeout=5)
 
     def test_request_block_whenIndexIsNumeric_thenRequestsCorrectBlockFromNode(self):
         mock_response = Mock()
         mock_response.status_code = 200
-        mock_response.json.return_value = '{"nonce": 12345, "index": 29, "transactions": [{"amount": 0, "destination": "destination", "fee": 0, "signature": "signature", "source": "source", "timestamp": 1508823223, "tx_hash": null}], "timestamp": 1234567890, "current_hash": "current_hash", "previous_hash": "previous_hash"}'
-        transaction = Transaction("source", "destination", 0, 0, "signature")
+        mock_response.headers = {'Content-Type': 'application/json'}
+        mock_response.json.return_value = '{"index": 29, "transactions": [{"amount": 0, "destination": "destination", "fee": 0, "signature": "signature", "source": "source", "timestamp": 1508823223, "tx_hash": null}], "block_header": {"version": 1, "previous_hash": "previous_hash", "merkle_root": "merkle_root", "timestamp": 1234567890, "nonce": 12345}, "current_hash": "current_hash"}'
+        transaction = Transaction("source", "destination", 0, 0, "signature", 1508823223)
 
         with patch.object(FullNode, '__init__', return_value=None) as patched_init, \
                 patch("crankycoin.node.Block.current_hash", new_callable=PropertyMock) as patched_block_current_hash, \
@@ -136,7 +353,40 @@ class TestNode(unittest.TestCase):
             self.assertEqual(block.current_hash, "current_hash")
             self.assertEqual(block.block_header.timestamp, 1234567890)
             self.assertEqual(block.block_header.nonce, 12345)
-            patched_requests.assert_called_once_with('http://127.0.0.2:30013/block/29')
+            patched_requests.assert_called_once_with('http://127.0.0.2:30013/block/29', headers=FullNode.BLOCK_ACCEPT, timeout=5)
+
+    def test_request_block_whenPeerAnswersBinary_thenDecodesBlock(self):
+        transaction = Transaction("source", "destination", 0, 0, "signature", 1508823223)
+        reward_transaction = Transaction("0", "reward_address", 50, 0, "0", 1508823225)
+        remote_block = Block(29, [transaction, reward_transaction], "previous_hash", 1234567890, 12345)
+        mock_response = Mock()
+        mock_response.status_code = 200
+        mock_response.headers = {'Content-Type': BinaryCodec.CONTENT_TYPE}
+
+        with patch.object(FullNode, '__init__', return_value=None) as patched_init, \
+                patch.object(Block, '_calculate_block_hash', return_value="0000" + "ab" * 30) as patched_calculate_block_hash, \
+                patch("crankycoin.requests.get", return_value=mock_response) as patched_requests:
+            mock_response.content = BinaryCodec.encode_block(remote_block)
+            node = FullNode("127.0.0.1", "reward_address")
+
+            block = node.request_block("127.0.0.2", "30013", 29)
+
+            self.assertEqual(block, remote_block)
+            patched_requests.assert_called_once_with('http://127.0.0.2:30013/block/29', headers=FullNode.BLOCK_ACCEPT, timeout=5)
+
+    def test_request_block_whenBinaryResponseMalformed_thenReturnsNone(self):
+        mock_response = Mock()
+        mock_response.status_code = 200
+        mock_response.headers = {'Content-Type': BinaryCodec.CONTENT_TYPE}
+        mock_response.content = "CRNK"
+
+        with patch.object(FullNode, '__init__', return_value=None) as patched_init, \
+                patch("crankycoin.requests.get", return_value=mock_response) as patched_requests:
+            node = FullNode("127.0.0.1", "reward_address")
+
+            block = node.request_block("127.0.0.2", "30013", 29)
+
+            self.assertIsNone(block)
 
     def test_request_block_whenRequestException_thenReturnsNone(self):
         with patch.object(FullNode, '__init__', return_value=None) as patched_init, \
@@ -146,7 +396,7 @@ class TestNode(unittest.TestCase):
             block = node.request_block("127.0.0.2", "30013", "latest")
 
             self.assertIsNone(block)
-            patched_requests.assert_called_once_with('http://127.0.0.2:30013/block/latest')
+            patched_requests.assert_called_once_with('http://127.0.0.2:30013/block/latest', headers=FullNode.BLOCK_ACCEPT, timeout=5)
 
     def test_request_block_from_all_whenIndexIsLatest_thenReturnsLatestBlockFromAll(self):
         block = Mock(Block)
@@ -164,6 +414,1216 @@ class TestNode(unittest.TestCase):
                 call("127.0.0.3", 30013, "latest")
             ], True)
 
+    def test_reconstruct_compact_block_whenTransactionsInMempool_thenRebuildsBlock(self):
+        transaction_one = Transaction("source", "destination_one", 1, 0, "signature_one", 1508823223)
+        transaction_two = Transaction("source", "destination_two", 2, 0, "signature_two", 1508823224)
+        reward_transaction = Transaction("0", "reward_address", 50, 0, "0", 1508823225)
+        mempool = SharedMempool(capacity=10)
+        for transaction in [transaction_two, transaction_one]:
+            mempool.push(transaction)
+        mock_blockchain = Mock(Blockchain)
+        mock_blockchain.get_unconfirmed_transactions_by_short_ids.side_effect = mempool.get_by_short_ids
+
+        with patch.object(FullNode, '__init__', return_value=None) as patched_init, \
+                patch.object(Block, '_calculate_block_hash', return_value="0000_block_hash") as patched_calculate_block_hash:
+            block = Block(35, [transaction_one, transaction_two, reward_transaction], "previous_hash", 1508823300, 123)
+            node = FullNode("127.0.0.1", "reward_address")
+            node.blockchain = mock_blockchain
+
+            compact_block = json.loads(block.to_compact_json())
+            resp, missing = node._reconstruct_compact_block(compact_block)
+
+            self.assertEqual(missing, [])
+            self.assertEqual(resp.transactions, [transaction_one, transaction_two, reward_transaction])
+            self.assertEqual(resp.block_header, block.block_header)
+            self.assertEqual(compact_block["prefilled"].keys(), ["2"])
+
+    def test_reconstruct_compact_block_whenTransactionsMissingFromMempool_thenReturnsMissingPositions(self):
+        transaction_one = Transaction("source", "destination_one", 1, 0, "signature_one", 1508823223)
+        transaction_two = Transaction("source", "destination_two", 2, 0, "signature_two", 1508823224)
+        reward_transaction = Transaction("0", "reward_address", 50, 0, "0", 1508823225)
+        mempool = SharedMempool(capacity=10)
+        for transaction in [transaction_two]:
+            mempool.push(transaction)
+        mock_blockchain = Mock(Blockchain)
+        mock_blockchain.get_unconfirmed_transactions_by_short_ids.side_effect = mempool.get_by_short_ids
+
+        with patch.object(FullNode, '__init__', return_value=None) as patched_init, \
+                patch.object(Block, '_calculate_block_hash', return_value="0000_block_hash") as patched_calculate_block_hash:
+            block = Block(35, [transaction_one, transaction_two, reward_transaction], "previous_hash", 1508823300, 123)
+            node = FullNode("127.0.0.1", "reward_address")
+            node.blockchain = mock_blockchain
+
+            resp, missing = node._reconstruct_compact_block(json.loads(block.to_compact_json()))
+
+            self.assertIsNone(resp)
+            self.assertEqual(missing, [0])
+
+            resp, missing = node._reconstruct_compact_block(json.loads(block.to_compact_json(missing)))
+
+            self.assertEqual(missing, [])
+            self.assertEqual(resp.transactions, [transaction_one, transaction_two, reward_transaction])
+
+    def test_reconstruct_compact_block_whenShortIdCollides_thenRequestsAllTransactions(self):
+        transaction_one = Transaction("source", "destination_one", 1, 0, "signature_one", 1508823223)
+        colliding_transaction = Transaction("source", "destination_two", 2, 0, "signature_two", 1508823224)
+        reward_transaction = Transaction("0", "reward_address", 50, 0, "0", 1508823225)
+        mempool = SharedMempool(capacity=10)
+        for transaction in [colliding_transaction]:
+            mempool.push(transaction)
+        mock_blockchain = Mock(Blockchain)
+        mock_blockchain.get_unconfirmed_transactions_by_short_ids.side_effect = mempool.get_by_short_ids
+
+        with patch.object(FullNode, '__init__', return_value=None) as patched_init, \
+                patch.object(Block, '_calculate_block_hash', return_value="0000_block_hash") as patched_calculate_block_hash, \
+                patch.object(Block, 'short_transaction_id', return_value="short_id") as patched_short_transaction_id:
+            block = Block(35, [transaction_one, reward_transaction], "previous_hash", 1508823300, 123)
+            node = FullNode("127.0.0.1", "reward_address")
+            node.blockchain = mock_blockchain
+
+            resp, missing = node._reconstruct_compact_block(json.loads(block.to_compact_json()))
+
+            self.assertIsNone(resp)
+            self.assertEqual(missing, [0])
+
+    def test_post_transactions_whenPostedAsBroadcast_thenAcceptsTransaction(self):
+        transaction = Transaction("source", "destination", 1, 0, "signature", 1508823223)
+        mock_peer_wire = Mock(PeerWire)
+        mock_blockchain = Mock(Blockchain)
+        mock_blockchain.push_unconfirmed_transaction.return_value = True
+
+        with patch.object(FullNode, '__init__', return_value=None) as patched_init, \
+                patch.object(FullNode, 'refresh_nodes') as patched_refresh_nodes, \
+                patch.object(FullNode, 'announce_inventory', return_value={"blocks": [], "transactions": [transaction.tx_hash]}), \
+                patch("crankycoin.node.reactor") as patched_reactor:
+            sender = FullNode("127.0.0.1", "reward_address")
+            sender.host = "127.0.0.1"
+            sender.full_nodes = {"127.0.0.2"}
+            sender.peer_wire = mock_peer_wire
+            sender.broadcast_transaction(transaction)
+            node = FullNode("127.0.0.2", "reward_address")
+            node.blockchain = mock_blockchain
+            node._transaction_queue = Queue(1)
+            responses = []
+
+            node.post_transactions(WireRequest(mock_peer_wire.request.call_args[0][2])).addCallback(responses.append)
+            run_transaction_jobs(node, patched_reactor)
+
+            self.assertEqual(json.loads(responses[0]), {"success": True})
+            mock_blockchain.push_unconfirmed_transaction.assert_called_once_with(transaction)
+
+    def test_post_transactions_whenBodyIsMalformed_thenAnswersBadRequest(self):
+        with patch.object(FullNode, '__init__', return_value=None) as patched_init, \
+                patch("crankycoin.node.reactor") as patched_reactor:
+            node = FullNode("127.0.0.1", "reward_address")
+            node.blockchain = Mock(Blockchain)
+            node._transaction_queue = Queue(3)
+            wire_requests = [WireRequest(payload) for payload in
+                        ["not json", json.dumps({"transaction": "{}"}), json.dumps({"transaction": "not json"})]]
+
+            for request in wire_requests:
+                node.post_transactions(request)
+            run_transaction_jobs(node, patched_reactor)
+
+            self.assertEqual([request.code for request in wire_requests], [400, 400, 400])
+            node.blockchain.push_unconfirmed_transaction.assert_not_called()
+
+    def test_post_transactions_batch_thenReportsStatusPerTransaction(self):
+        transaction_one = Transaction("source", "destination_one", 1, 0, "signature_one", 1508823223)
+        transaction_two = Transaction("source", "destination_two", 2, 0, "signature_two", 1508823224)
+        transaction_tampered = json.loads(Transaction("source", "destination_three", 3, 0, "signature_three", 1508823225).to_json())
+        transaction_tampered["amount"] = 300
+        mock_request = Mock()
+        mock_request.content.read.return_value = json.dumps({
+            "transactions": [transaction_one.to_json(), json.dumps(transaction_tampered), transaction_two.to_json()]
+        })
+        mock_blockchain = Mock(Blockchain)
+        mock_blockchain.push_unconfirmed_transactions.return_value = [None, 'Insufficient funds']
+
+        with patch.object(FullNode, '__init__', return_value=None) as patched_init, \
+                patch("crankycoin.node.reactor") as patched_reactor:
+            node = FullNode("127.0.0.1", "reward_address")
+            node.blockchain = mock_blockchain
+            node._transaction_queue = Queue(1)
+            responses = []
+
+            node.post_transactions_batch(mock_request).addCallback(responses.append)
+            run_transaction_jobs(node, patched_reactor)
+
+            self.assertEqual(json.loads(responses[0])["results"], [
+                {"tx_hash": transaction_one.tx_hash, "success": True, "message": "accepted"},
+                {"tx_hash": transaction_tampered["tx_hash"], "success": False, "message": "Invalid transaction hash"},
+                {"tx_hash": transaction_two.tx_hash, "success": False, "message": "Insufficient funds"}
+            ])
+            mock_blockchain.push_unconfirmed_transactions.assert_called_once_with([transaction_one, transaction_two])
+            patched_reactor.callInThread.assert_called_once_with(node.broadcast_transactions, [transaction_one])
+            self.assertIn(transaction_one.tx_hash, node.inventory)
+            self.assertNotIn(transaction_two.tx_hash, node.inventory)
+
+    def test_post_transactions_batch_whenAddressIsNotAscii_thenRejectsTransaction(self):
+        transaction = json.loads(Transaction("source", "destination", 1, 0, "signature", 1508823223).to_json())
+        transaction["source"] = u"sourc\u00e9"
+        mock_request = Mock()
+        mock_request.content.read.return_value = json.dumps({"transactions": [json.dumps(transaction)]})
+        mock_blockchain = Mock(Blockchain)
+        mock_blockchain.push_unconfirmed_transactions.return_value = []
+
+        with patch.object(FullNode, '__init__', return_value=None) as patched_init, \
+                patch("crankycoin.node.reactor") as patched_reactor:
+            node = FullNode("127.0.0.1", "reward_address")
+            node.blockchain = mock_blockchain
+            node._transaction_queue = Queue(1)
+            responses = []
+
+            node.post_transactions_batch(mock_request).addCallback(responses.append)
+            run_transaction_jobs(node, patched_reactor)
+
+            result, = json.loads(responses[0])["results"]
+            self.assertEqual(result["tx_hash"], transaction["tx_hash"])
+            self.assertFalse(result["success"])
+            self.assertIn("not ASCII", result["message"])
+            mock_request.setResponseCode.assert_not_called()
+
+    def test_post_transactions_batch_whenTooManyTransactions_thenRejectsRequest(self):
+        mock_request = Mock()
+        mock_request.content.read.return_value = json.dumps({
+            "transactions": ["{}"] * (FullNode.MAX_TRANSACTIONS_PER_REQUEST + 1)
+        })
+        with patch.object(FullNode, '__init__', return_value=None) as patched_init, \
+                patch("crankycoin.node.reactor") as patched_reactor:
+            node = FullNode("127.0.0.1", "reward_address")
+            node._transaction_queue = Queue(1)
+
+            node.post_transactions_batch(mock_request)
+            run_transaction_jobs(node, patched_reactor)
+
+            mock_request.setResponseCode.assert_called_once_with(413)
+
+    def test_post_transactions_batch_whenTransactionQueueIsFull_thenAnswersServiceUnavailable(self):
+        mock_request = Mock()
+        with patch.object(FullNode, '__init__', return_value=None) as patched_init:
+            node = FullNode("127.0.0.1", "reward_address")
+            node._transaction_queue = Queue(1)
+            node._transaction_queue.put_nowait(Mock())
+
+            resp = node.post_transactions_batch(mock_request)
+
+            self.assertEqual(json.loads(resp), {'message': 'Transaction queue full'})
+            mock_request.setResponseCode.assert_called_once_with(503)
+
+    def test_run_transaction_job_whenBlockIsPending_thenWaitsForBlock(self):
+        handler = Mock(return_value="result")
+        with patch.object(FullNode, '__init__', return_value=None) as patched_init, \
+                patch("crankycoin.node.reactor") as patched_reactor:
+            node = FullNode("127.0.0.1", "reward_address")
+            node._block_gate = PriorityGate()
+            node.block_gate.enter()
+            patched_reactor.callFromThread.side_effect = lambda f, *args: f(*args)
+            responses = []
+            d = Deferred()
+            d.addCallback(responses.append)
+
+            worker = threading.Thread(target=node._run_transaction_job, args=((d, handler, (), {}),))
+            worker.start()
+            worker.join(0.1)
+
+            handler.assert_not_called()
+            node.block_gate.leave()
+            worker.join(1)
+            self.assertEqual(responses, ["result"])
+
+    def test_broadcast_transactions_whenClient_thenReportsTransactionsAcceptedByAnyNode(self):
+        transactions = [Transaction("source", "destination", i, 0, "signature", 1508823223) for i in range(3)]
+        response_one = Mock()
+        response_one.status_code = 200
+        response_one.json.return_value = {"results": [{"success": True}, {"success": False}, {"success": False}]}
+        response_two = Mock()
+        response_two.status_code = 200
+        response_two.json.return_value = {"results": [{"success": False}, {"success": True}, {"success": False}]}
+
+        with patch.object(NodeMixin, 'refresh_nodes') as patched_refresh_nodes, \
+                patch.object(NodeMixin, 'get_healthy_nodes', return_value=["127.0.0.1", "127.0.0.2"]), \
+                patch("crankycoin.requests.post", side_effect=[response_one, response_two]) as patched_requests:
+            node = NodeMixin()
+
+            resp = node.broadcast_transactions(transactions)
+
+            self.assertEqual(resp, [True, True, False])
+            self.assertEqual(patched_requests.call_count, 2)
+
+    def test_offload_thenRunsHandlerOnValidationPool(self):
+        mock_request = Mock()
+        d = Deferred()
+        with patch.object(FullNode, '__init__', return_value=None) as patched_init, \
+                patch("crankycoin.node.deferToThreadPool", return_value=d) as patched_defer_to_thread_pool:
+            node = FullNode("127.0.0.1", "reward_address")
+            node._validation_pool = Mock()
+
+            resp = node.get_balance(mock_request, "address")
+
+            self.assertIs(resp, d)
+            self.assertEqual(patched_defer_to_thread_pool.call_args[0][1], node._validation_pool)
+            self.assertEqual(patched_defer_to_thread_pool.call_args[0][3], node)
+            self.assertIs(patched_defer_to_thread_pool.call_args[0][4].request, mock_request)
+            self.assertEqual(patched_defer_to_thread_pool.call_args[0][5:], ("address",))
+
+    def test_offload_thenSetsResponseCodeOnReactorThread(self):
+        mock_request = Mock()
+        mock_request.getHeader.return_value = BinaryCodec.CONTENT_TYPE
+        mock_request.content.read.return_value = "not a block"
+        d = Deferred()
+        with patch.object(FullNode, '__init__', return_value=None) as patched_init, \
+                patch("crankycoin.node.deferToThreadPool", return_value=d) as patched_defer_to_thread_pool:
+            node = FullNode("127.0.0.1", "reward_address")
+            node._validation_pool = Mock()
+            responses = []
+
+            node.post_block(mock_request).addCallback(responses.append)
+            handler_args = patched_defer_to_thread_pool.call_args[0][2:]
+            result = handler_args[0](*handler_args[1:])
+
+            mock_request.setResponseCode.assert_not_called()
+            d.callback(result)
+            mock_request.setResponseCode.assert_called_once_with(400)
+            self.assertEqual(responses, [result])
+
+    def test_post_block_whenBodyIsBinary_thenReceivesDecodedBlock(self):
+        transaction = Transaction("source", "destination", 0, 0, "signature", 1508823223)
+        reward_transaction = Transaction("0", "reward_address", 50, 0, "0", 1508823225)
+        remote_block = Block(36, [transaction, reward_transaction], "previous_hash", 1234567890, 12345)
+        headers = {'Content-Type': BinaryCodec.CONTENT_TYPE, FullNode.HOST_HEADER: "127.0.0.2"}
+        mock_request = Mock()
+        mock_request.getHeader.side_effect = headers.get
+
+        with patch.object(FullNode, '__init__', return_value=None) as patched_init, \
+                patch.object(Block, '_calculate_block_hash', return_value="0000" + "ab" * 30) as patched_calculate_block_hash, \
+                patch("crankycoin.node.deferToThreadPool", side_effect=lambda r, pool, f, *args: maybeDeferred(f, *args)) as patched_defer_to_thread_pool, \
+                patch.object(FullNode, '_receive_block', return_value="accepted") as patched_receive_block:
+            mock_request.content.read.return_value = BinaryCodec.encode_block(remote_block)
+            node = FullNode("127.0.0.1", "reward_address")
+            node._validation_pool = Mock()
+
+            responses = []
+
+            node.post_block(mock_request).addCallback(responses.append)
+
+            self.assertEqual(responses, ["accepted"])
+            patched_receive_block.assert_called_once_with(ANY, remote_block, "127.0.0.2", "0000" + "ab" * 30,
+                                                          {BinaryCodec.CONTENT_TYPE: BinaryCodec.encode_block(remote_block)})
+
+    def test_post_block_whenBinaryBodyMalformed_thenAnswersBadRequest(self):
+        mock_request = Mock()
+        mock_request.getHeader.return_value = BinaryCodec.CONTENT_TYPE
+        mock_request.content.read.return_value = "not a block"
+
+        with patch.object(FullNode, '__init__', return_value=None) as patched_init, \
+                patch("crankycoin.node.deferToThreadPool", side_effect=lambda r, pool, f, *args: maybeDeferred(f, *args)) as patched_defer_to_thread_pool, \
+                patch.object(FullNode, '_receive_block') as patched_receive_block:
+            node = FullNode("127.0.0.1", "reward_address")
+            node._validation_pool = Mock()
+
+            node.post_block(mock_request)
+
+            mock_request.setResponseCode.assert_called_once_with(400)
+            patched_receive_block.assert_not_called()
+
+    def test_post_block_whenBodyTooLarge_thenAnswersEntityTooLargeBeforeDecoding(self):
+        mock_request = Mock()
+        mock_request.getHeader.return_value = BinaryCodec.CONTENT_TYPE
+        mock_request.content.read.return_value = "x" * 11
+
+        with patch.object(FullNode, '__init__', return_value=None) as patched_init, \
+                patch.object(FullNode, 'MAX_BLOCK_SIZE', 10), \
+                patch("crankycoin.node.deferToThreadPool", side_effect=lambda r, pool, f, *args: maybeDeferred(f, *args)) as patched_defer_to_thread_pool, \
+                patch.object(BinaryCodec, 'decode_block') as patched_decode_block, \
+                patch.object(FullNode, '_receive_block') as patched_receive_block:
+            node = FullNode("127.0.0.1", "reward_address")
+            node._validation_pool = Mock()
+            node._metrics = Metrics()
+
+            node.post_block(mock_request)
+
+            mock_request.setResponseCode.assert_called_once_with(413)
+            patched_decode_block.assert_not_called()
+            patched_receive_block.assert_not_called()
+            self.assertEqual(node.metrics.get_counter("block_rejections.size"), 1)
+
+    def test_get_block_whenPeerAcceptsBinary_thenAnswersBinaryBlock(self):
+        transaction = Transaction("source", "destination", 0, 0, "signature", 1508823223)
+        reward_transaction = Transaction("0", "reward_address", 50, 0, "0", 1508823225)
+        block = Block(29, [transaction, reward_transaction], "previous_hash", 1234567890, 12345)
+        request = DummyRequest([])
+        request.requestHeaders.setRawHeaders('Accept', [FullNode.BLOCK_ACCEPT['Accept']])
+        mock_blockchain = Mock(Blockchain)
+        mock_blockchain.get_block_by_index.return_value = block
+
+        with patch.object(FullNode, '__init__', return_value=None) as patched_init, \
+                patch.object(Block, '_calculate_block_hash', return_value="0000" + "ab" * 30) as patched_calculate_block_hash:
+            node = FullNode("127.0.0.1", "reward_address")
+            node.blockchain = mock_blockchain
+
+            resp = node.get_block(request, 29)
+
+            self.assertEqual(resp, BinaryCodec.encode_block(block))
+            self.assertEqual(request.responseHeaders.getRawHeaders('Content-Type'), [BinaryCodec.CONTENT_TYPE])
+            self.assertEqual(request.responseHeaders.getRawHeaders('ETag'), ['"{}.bin"'.format("0000" + "ab" * 30)])
+
+    def test_get_block_whenNoAcceptHeader_thenAnswersJson(self):
+        transaction = Transaction("source", "destination", 0, 0, "signature", 1508823223)
+        block = Block(29, [transaction], "previous_hash", 1234567890, 12345)
+        request = DummyRequest([])
+        mock_blockchain = Mock(Blockchain)
+        mock_blockchain.get_latest_block.return_value = block
+
+        with patch.object(FullNode, '__init__', return_value=None) as patched_init, \
+                patch.object(Block, '_calculate_block_hash', return_value="0000" + "ab" * 30) as patched_calculate_block_hash:
+            node = FullNode("127.0.0.1", "reward_address")
+            node.blockchain = mock_blockchain
+
+            resp = node.get_block(request, "latest")
+
+            self.assertEqual(Block.from_dict(json.loads(resp)), block)
+            self.assertEqual(request.responseHeaders.getRawHeaders('Content-Type'), ['application/json'])
+            self.assertEqual(request.responseHeaders.getRawHeaders('ETag'), ['"{}"'.format("0000" + "ab" * 30)])
+
+    def test_get_block_whenBlockIdIsHeight_thenAnswersBlockFromChain(self):
+        blockchain = Blockchain()
+
+        with patch.object(FullNode, '__init__', return_value=None) as patched_init:
+            node = FullNode("127.0.0.1", "reward_address")
+            node.blockchain = blockchain
+            responses = {}
+            for block_id in ["0", "1", "-1", "tip"]:
+                request = DummyRequest([])
+                responses[block_id] = (node.get_block(request, block_id), request.responseCode)
+
+            self.assertEqual(Block.from_dict(json.loads(responses["0"][0])), blockchain.get_block_by_index(0))
+            self.assertIsNone(responses["0"][1])
+            self.assertEqual(responses["1"][1], 404)
+            self.assertEqual(responses["-1"][1], 404)
+            self.assertEqual(responses["tip"][1], 400)
+
+    def test_get_block_whenTipUnchangedSinceIfNoneMatch_thenAnswersNotModified(self):
+        block = Block(29, [Transaction("0", "reward_address", 50, 0, "0", 1508823225)], "previous_hash", 1234567890, 12345)
+        request = DummyRequest([])
+        request.requestHeaders.setRawHeaders('If-None-Match', ['"0000_old_hash", "{}"'.format("0000" + "ab" * 30)])
+        mock_blockchain = Mock(Blockchain)
+        mock_blockchain.get_latest_block.return_value = block
+
+        with patch.object(FullNode, '__init__', return_value=None) as patched_init, \
+                patch.object(Block, '_calculate_block_hash', return_value="0000" + "ab" * 30) as patched_calculate_block_hash:
+            node = FullNode("127.0.0.1", "reward_address")
+            node.blockchain = mock_blockchain
+
+            resp = node.get_block(request, "latest")
+
+            self.assertEqual(resp, "")
+            self.assertEqual(request.responseCode, 304)
+
+    def test_get_block_whenBlockConnected_thenServesCachedBytesWithoutEncoding(self):
+        block = Block(29, [Transaction("0", "reward_address", 50, 0, "0", 1508823225)], "previous_hash", 1234567890, 12345)
+        request = DummyRequest([])
+        mock_blockchain = Mock(Blockchain)
+        mock_blockchain.get_latest_block.return_value = block
+
+        with patch.object(FullNode, '__init__', return_value=None) as patched_init, \
+                patch.object(Block, '_calculate_block_hash', return_value="0000" + "ab" * 30) as patched_calculate_block_hash:
+            node = FullNode("127.0.0.1", "reward_address")
+            node.blockchain = mock_blockchain
+            node.block_cache.put(block)
+            expected = block.to_json()
+
+            with patch.object(Block, 'to_json') as patched_to_json:
+                resp = node.get_block(request, "latest")
+
+            self.assertEqual(resp, expected)
+            patched_to_json.assert_not_called()
+
+    def test_get_blocks_range_whenNoAcceptHeader_thenStreamsSingleJsonLayer(self):
+        transaction = Transaction("source", "destination", 0, 0, "signature", 1508823223)
+        reward_transaction = Transaction("0", "reward_address", 50, 0, "0", 1508823225)
+        blocks = [Block(i, [transaction, reward_transaction], "previous_hash", 1234567890, i) for i in range(2)]
+        request = DummyRequest([])
+        mock_blockchain = Mock(Blockchain)
+        mock_blockchain.get_blocks_range.return_value = blocks
+
+        with patch.object(FullNode, '__init__', return_value=None) as patched_init, \
+                patch.object(Block, '_calculate_block_hash', return_value="0000" + "ab" * 30) as patched_calculate_block_hash, \
+                patch("crankycoin.node.deferToThreadPool", side_effect=lambda r, pool, f, *args: maybeDeferred(f, *args)) as patched_defer_to_thread_pool, \
+                patch("crankycoin.streaming.deferToThreadPool", side_effect=lambda r, pool, f, *args: maybeDeferred(f, *args)) as patched_stream_to_thread_pool:
+            node = FullNode("127.0.0.1", "reward_address")
+            node.blockchain = mock_blockchain
+            node._validation_pool = Mock()
+            done = []
+
+            node.get_blocks_range(request, "3", "4").addCallback(done.append)
+
+            resp = json.loads("".join(request.written))
+            self.assertEqual([Block.from_dict(block_dict) for block_dict in resp], blocks)
+            self.assertEqual(len(request.written), 4)
+            self.assertEqual(done, [None])
+            self.assertEqual(patched_stream_to_thread_pool.call_count, 5)
+            mock_blockchain.get_blocks_range.assert_called_once_with(3, 4)
+
+    def test_get_blocks_range_whenRangeExceedsCap_thenCapsItAndSetsNextStart(self):
+        request = DummyRequest([])
+        mock_blockchain = Mock(Blockchain)
+        mock_blockchain.get_height.return_value = 5000
+        mock_blockchain.get_blocks_range.return_value = []
+
+        with patch.object(FullNode, '__init__', return_value=None) as patched_init, \
+                patch("crankycoin.node.deferToThreadPool", side_effect=lambda r, pool, f, *args: maybeDeferred(f, *args)) as patched_defer_to_thread_pool, \
+                patch("crankycoin.streaming.deferToThreadPool", side_effect=lambda r, pool, f, *args: maybeDeferred(f, *args)) as patched_stream_to_thread_pool:
+            node = FullNode("127.0.0.1", "reward_address")
+            node.blockchain = mock_blockchain
+            node._validation_pool = Mock()
+
+            node.get_blocks_range(request, "10", "4000")
+
+            stop = 10 + FullNode.MAX_BLOCKS_PER_RESPONSE - 1
+            mock_blockchain.get_blocks_range.assert_called_once_with(10, stop)
+            self.assertEqual(request.responseHeaders.getRawHeaders(FullNode.NEXT_START_HEADER), [str(stop + 1)])
+
+    def test_get_blocks_range_whenBlockIdIsNotAnInteger_thenAnswersBadRequest(self):
+        request = DummyRequest([])
+
+        with patch.object(FullNode, '__init__', return_value=None) as patched_init:
+            node = FullNode("127.0.0.1", "reward_address")
+            node.blockchain = Mock(Blockchain)
+
+            node.get_blocks_range(request, "1", "latest")
+
+            self.assertEqual(request.responseCode, 400)
+            node.blockchain.get_blocks_range.assert_not_called()
+
+    def test_get_blocks_range_whenBlocksAreInBlockFile_thenAnswersStoredBytes(self):
+        blocks = [Block(i, [Transaction("0", "reward_address", 50, 0, "0", 1508823225)], "", 1234567890, i) for i in range(3)]
+        request = DummyRequest([])
+        request.requestHeaders.setRawHeaders('Accept', [FullNode.BLOCK_ACCEPT['Accept']])
+        mock_blockchain = Mock(Blockchain)
+        mock_blockchain.get_blocks_range.return_value = blocks[1:]
+        mock_block_file = Mock(BlockFile)
+        mock_block_file.__len__ = Mock(return_value=3)
+        mock_block_file.get_hash.return_value = "0000" + "ab" * 30
+        mock_block_file.get_blocks_message.return_value = "stored_blocks"
+
+        with patch.object(FullNode, '__init__', return_value=None) as patched_init, \
+                patch.object(Block, '_calculate_block_hash', return_value="0000" + "ab" * 30) as patched_calculate_block_hash, \
+                patch.object(BinaryCodec, 'encode_blocks') as patched_encode_blocks:
+            node = FullNode("127.0.0.1", "reward_address")
+            node.blockchain = mock_blockchain
+            node.block_file = mock_block_file
+
+            resp = node.get_blocks_range(request, "1", "2")
+
+            self.assertEqual(resp, "stored_blocks")
+            mock_block_file.get_blocks_message.assert_called_once_with(1, 2)
+            patched_encode_blocks.assert_not_called()
+
+    def test_get_blocks_range_whenBlockFileIsStale_thenEncodesBlocks(self):
+        blocks = [Block(i, [Transaction("0", "reward_address", 50, 0, "0", 1508823225)], "", 1234567890, i) for i in range(3)]
+        request = DummyRequest([])
+        request.requestHeaders.setRawHeaders('Accept', [FullNode.BLOCK_ACCEPT['Accept']])
+        mock_blockchain = Mock(Blockchain)
+        mock_blockchain.get_blocks_range.return_value = blocks[1:]
+        mock_block_file = Mock(BlockFile)
+        mock_block_file.__len__ = Mock(return_value=3)
+        mock_block_file.get_hash.return_value = "0000_reorganized_hash"
+
+        with patch.object(FullNode, '__init__', return_value=None) as patched_init, \
+                patch.object(Block, '_calculate_block_hash', return_value="0000" + "ab" * 30) as patched_calculate_block_hash, \
+                patch("crankycoin.node.deferToThreadPool", side_effect=lambda r, pool, f, *args: maybeDeferred(f, *args)) as patched_defer_to_thread_pool:
+            node = FullNode("127.0.0.1", "reward_address")
+            node.blockchain = mock_blockchain
+            node.block_file = mock_block_file
+            node._validation_pool = Mock()
+            resp = []
+
+            node.get_blocks_range(request, "1", "2").addCallback(resp.append)
+
+            self.assertEqual(resp, [BinaryCodec.encode_blocks(blocks[1:])])
+            mock_block_file.get_blocks_message.assert_not_called()
+
+    def test_get_blocks_range_whenClientAcceptsGzip_thenStreamsCompressedJson(self):
+        transaction = Transaction("source", "destination", 0, 0, "signature", 1508823223)
+        blocks = [Block(i, [transaction] * 20, "previous_hash", 1234567890, i) for i in range(2)]
+        request = DummyRequest([])
+        request.requestHeaders.setRawHeaders('Accept-Encoding', ["gzip, deflate"])
+        mock_blockchain = Mock(Blockchain)
+        mock_blockchain.get_blocks_range.return_value = blocks
+
+        with patch.object(FullNode, '__init__', return_value=None) as patched_init, \
+                patch.object(Block, '_calculate_block_hash', return_value="0000" + "ab" * 30) as patched_calculate_block_hash, \
+                patch("crankycoin.node.deferToThreadPool", side_effect=lambda r, pool, f, *args: maybeDeferred(f, *args)) as patched_defer_to_thread_pool, \
+                patch("crankycoin.streaming.deferToThreadPool", side_effect=lambda r, pool, f, *args: maybeDeferred(f, *args)) as patched_stream_to_thread_pool:
+            node = FullNode("127.0.0.1", "reward_address")
+            node.blockchain = mock_blockchain
+            node._validation_pool = Mock()
+
+            node.get_blocks_range(request, "3", "4")
+
+            resp = zlib.decompress("".join(request.written), 16 + zlib.MAX_WBITS)
+            self.assertEqual(resp, FullNode._blocks_json(blocks))
+            self.assertEqual(request.responseHeaders.getRawHeaders('Content-Encoding'), ["gzip"])
+            self.assertLess(node.metrics.get_counter("response_bytes.compressed"), len(resp))
+
+    def test_get_transaction_history_thenCompressesOnPoolAndSetsHeadersOnReactorThread(self):
+        request = DummyRequest([])
+        request.requestHeaders.setRawHeaders('Accept-Encoding', ["gzip"])
+        history = [Transaction("address", "destination", i, 0, "signature", 1508823223) for i in range(50)]
+        mock_blockchain = Mock(Blockchain)
+        mock_blockchain.get_transaction_history.return_value = history
+        pending = Deferred()
+
+        with patch.object(FullNode, '__init__', return_value=None) as patched_init, \
+                patch("crankycoin.node.deferToThreadPool", return_value=pending) as patched_defer_to_thread_pool:
+            node = FullNode("127.0.0.1", "reward_address")
+            node.blockchain = mock_blockchain
+            node._validation_pool = Mock()
+            resp = []
+
+            node.get_transaction_history(request, "address").addCallback(resp.append)
+
+            patched_defer_to_thread_pool.assert_called_once_with(ANY, node.validation_pool,
+                                                                 node._transaction_history, "address", "gzip")
+            self.assertEqual(request.responseHeaders.getRawHeaders('Vary'), ["Accept-Encoding"])
+            self.assertIsNone(request.responseHeaders.getRawHeaders('Content-Encoding'))
+            pending.callback(node._transaction_history("address", "gzip"))
+
+        self.assertEqual([Transaction.from_dict(transaction) for transaction in
+                          json.loads(zlib.decompress(resp[0], 16 + zlib.MAX_WBITS))], history)
+        self.assertEqual(request.responseHeaders.getRawHeaders('Content-Encoding'), ["gzip"])
+
+    def test_get_blocks_whenMoreBlocksFollowPage_thenCapsPageAndSetsNextStart(self):
+        request = DummyRequest([])
+        request.args = {'start': ['10'], 'limit': [str(FullNode.MAX_BLOCKS_PER_RESPONSE + 50)]}
+        mock_blockchain = Mock(Blockchain)
+        mock_blockchain.get_height.return_value = 1000
+        mock_blockchain.get_blocks_range.return_value = []
+
+        with patch.object(FullNode, '__init__', return_value=None) as patched_init, \
+                patch("crankycoin.node.deferToThreadPool", side_effect=lambda r, pool, f, *args: maybeDeferred(f, *args)) as patched_defer_to_thread_pool, \
+                patch("crankycoin.streaming.deferToThreadPool", side_effect=lambda r, pool, f, *args: maybeDeferred(f, *args)) as patched_stream_to_thread_pool:
+            node = FullNode("127.0.0.1", "reward_address")
+            node.blockchain = mock_blockchain
+            node._validation_pool = Mock()
+
+            node.get_blocks(request)
+
+            stop = 10 + FullNode.MAX_BLOCKS_PER_RESPONSE
+            mock_blockchain.get_blocks_range.assert_called_once_with(10, stop - 1)
+            self.assertEqual(request.responseHeaders.getRawHeaders(FullNode.NEXT_START_HEADER), [str(stop)])
+            self.assertEqual("".join(request.written), "[]")
+
+    def test_get_blocks_whenPageReachesTip_thenSetsNoNextStart(self):
+        request = DummyRequest([])
+        request.args = {'start': ['990'], 'limit': ['20']}
+        mock_blockchain = Mock(Blockchain)
+        mock_blockchain.get_height.return_value = 1000
+        mock_blockchain.get_blocks_range.return_value = []
+
+        with patch.object(FullNode, '__init__', return_value=None) as patched_init, \
+                patch("crankycoin.node.deferToThreadPool", side_effect=lambda r, pool, f, *args: maybeDeferred(f, *args)) as patched_defer_to_thread_pool, \
+                patch("crankycoin.streaming.deferToThreadPool", side_effect=lambda r, pool, f, *args: maybeDeferred(f, *args)) as patched_stream_to_thread_pool:
+            node = FullNode("127.0.0.1", "reward_address")
+            node.blockchain = mock_blockchain
+            node._validation_pool = Mock()
+
+            node.get_blocks(request)
+
+            mock_blockchain.get_blocks_range.assert_called_once_with(990, 1009)
+            self.assertIsNone(request.responseHeaders.getRawHeaders(FullNode.NEXT_START_HEADER))
+
+    def test_get_blocks_whenStartIsNotANumber_thenAnswersBadRequest(self):
+        request = DummyRequest([])
+        request.args = {'start': ['first']}
+
+        with patch.object(FullNode, '__init__', return_value=None) as patched_init:
+            node = FullNode("127.0.0.1", "reward_address")
+
+            node.get_blocks(request)
+
+            self.assertEqual(request.responseCode, 400)
+
+    def test_request_blockchain_whenPeerPaginates_thenFollowsNextStart(self):
+        first_page = Mock()
+        first_page.status_code = 200
+        first_page.headers = {'Content-Type': 'application/json', FullNode.NEXT_START_HEADER: '2'}
+        first_page.json.return_value = [{"index": 0}, {"index": 1}]
+        last_page = Mock()
+        last_page.status_code = 200
+        last_page.headers = {'Content-Type': 'application/json'}
+        last_page.json.return_value = [{"index": 2}]
+
+        with patch.object(FullNode, '__init__', return_value=None) as patched_init, \
+                patch.object(FullNode, '_decode_block', side_effect=lambda block_dict: block_dict['index']) as patched_decode_block, \
+                patch("crankycoin.requests.get", side_effect=[first_page, last_page]) as patched_requests:
+            node = FullNode("127.0.0.1", "reward_address")
+
+            blocks = node.request_blockchain("127.0.0.2", "30013")
+
+            self.assertEqual(blocks, [0, 1, 2])
+            patched_requests.assert_has_calls([
+                call('http://127.0.0.2:30013/blocks', headers=FullNode.BLOCK_ACCEPT, timeout=5,
+                     params={'start': 0, 'limit': FullNode.MAX_BLOCKS_PER_RESPONSE}),
+                call('http://127.0.0.2:30013/blocks', headers=FullNode.BLOCK_ACCEPT, timeout=5,
+                     params={'start': 2, 'limit': FullNode.MAX_BLOCKS_PER_RESPONSE})
+            ])
+
+    def test_request_blockchain_whenNextStartDoesNotMoveForward_thenReturnsNone(self):
+        page = Mock()
+        page.status_code = 200
+        page.headers = {'Content-Type': 'application/json', FullNode.NEXT_START_HEADER: '0'}
+        page.json.return_value = [{"index": 0}]
+
+        with patch.object(FullNode, '__init__', return_value=None) as patched_init, \
+                patch.object(FullNode, '_decode_block', side_effect=lambda block_dict: block_dict['index']) as patched_decode_block, \
+                patch("crankycoin.requests.get", return_value=page) as patched_requests:
+            node = FullNode("127.0.0.1", "reward_address")
+
+            blocks = node.request_blockchain("127.0.0.2", "30013")
+
+            self.assertIsNone(blocks)
+            self.assertEqual(patched_requests.call_count, 1)
+
+    def test_request_blockchain_whenPageIsEmpty_thenStops(self):
+        first_page = Mock()
+        first_page.status_code = 200
+        first_page.headers = {'Content-Type': 'application/json', FullNode.NEXT_START_HEADER: '2'}
+        first_page.json.return_value = [{"index": 0}, {"index": 1}]
+        empty_page = Mock()
+        empty_page.status_code = 200
+        empty_page.headers = {'Content-Type': 'application/json', FullNode.NEXT_START_HEADER: '4'}
+        empty_page.json.return_value = []
+
+        with patch.object(FullNode, '__init__', return_value=None) as patched_init, \
+                patch.object(FullNode, '_decode_block', side_effect=lambda block_dict: block_dict['index']) as patched_decode_block, \
+                patch("crankycoin.requests.get", side_effect=[first_page, empty_page]) as patched_requests:
+            node = FullNode("127.0.0.1", "reward_address")
+
+            blocks = node.request_blockchain("127.0.0.2", "30013")
+
+            self.assertEqual(blocks, [0, 1])
+            self.assertEqual(patched_requests.call_count, 2)
+
+    def test_request_blocks_range_whenPeerAnswersSingleOrDoubleJsonLayer_thenDecodesBoth(self):
+        transaction = Transaction("source", "destination", 0, 0, "signature", 1508823223)
+        reward_transaction = Transaction("0", "reward_address", 50, 0, "0", 1508823225)
+        mock_response = Mock()
+        mock_response.status_code = 200
+        mock_response.headers = {'Content-Type': 'application/json'}
+
+        with patch.object(FullNode, '__init__', return_value=None) as patched_init, \
+                patch.object(Block, '_calculate_block_hash', return_value="0000" + "ab" * 30) as patched_calculate_block_hash, \
+                patch("crankycoin.requests.get", return_value=mock_response) as patched_requests:
+            blocks = [Block(i, [transaction, reward_transaction], "previous_hash", 1234567890, i) for i in range(2)]
+            single_layer = FullNode._blocks_json(blocks)
+            node = FullNode("127.0.0.1", "reward_address")
+
+            mock_response.iter_content.side_effect = lambda size: iter(single_layer)
+            self.assertEqual(node.request_blocks_range("127.0.0.2", "30013", 0, 1), blocks)
+            double_layer = json.dumps([block.to_json() for block in blocks])
+            mock_response.iter_content.side_effect = lambda size: iter(double_layer)
+            self.assertEqual(node.request_blocks_range("127.0.0.2", "30013", 0, 1), blocks)
+
+    def test_iter_blocks_range_whenBlockArrives_thenYieldsItBeforeTheRestIsRead(self):
+        transaction = Transaction("source", "destination", 0, 0, "signature", 1508823223)
+        mock_response = Mock()
+        mock_response.status_code = 200
+
+        with patch.object(FullNode, '__init__', return_value=None) as patched_init, \
+                patch.object(Block, '_calculate_block_hash', return_value="0000" + "ab" * 30) as patched_calculate_block_hash, \
+                patch("crankycoin.requests.get", return_value=mock_response) as patched_requests:
+            blocks = [Block(i, [transaction], "previous_hash", 1234567890, i) for i in range(2)]
+            node = FullNode("127.0.0.1", "reward_address")
+            for content_type, payload in ((BinaryCodec.CONTENT_TYPE, BinaryCodec.encode_blocks(blocks)),
+                                          ('application/json', FullNode._blocks_json(blocks))):
+                mock_response.headers = {'Content-Type': content_type}
+                first_length = len(payload) * 2 / 3
+                chunks_read = []
+                def iter_content(size):
+                    for chunk in (payload[:first_length], payload[first_length:]):
+                        chunks_read.append(chunk)
+                        yield chunk
+                mock_response.iter_content.side_effect = iter_content
+
+                blocks_range = node.iter_blocks_range("127.0.0.2", "30013", 0, 1)
+
+                self.assertEqual(next(blocks_range), blocks[0])
+                self.assertEqual(len(chunks_read), 1)
+                self.assertEqual(list(blocks_range), blocks[1:])
+                patched_requests.assert_called_with('http://127.0.0.2:30013/blocks/0/1', headers=FullNode.BLOCK_ACCEPT,
+                                                    timeout=5, stream=True)
+
+    def test_iter_blocks_range_whenRangeExceedsPageCap_thenFetchesCappedPages(self):
+        pages = {(0, 1): ["block_0", "block_1"], (2, 3): ["block_2"], (3, 4): ["block_3", "block_4"]}
+
+        with patch.object(FullNode, '__init__', return_value=None) as patched_init, \
+                patch.object(FullNode, 'MAX_BLOCKS_PER_RESPONSE', 2), \
+                patch.object(FullNode, '_iter_blocks_page', side_effect=lambda node, port, start, stop: (block for block in pages[(start, stop)])) as patched_iter_blocks_page:
+            node = FullNode("127.0.0.1", "reward_address")
+
+            resp = list(node.iter_blocks_range("127.0.0.2", "30013", 0, 4))
+
+            self.assertEqual(resp, ["block_0", "block_1", "block_2", "block_3", "block_4"])
+            # a page cut short is continued from the block after its last one
+            patched_iter_blocks_page.assert_has_calls([call("127.0.0.2", "30013", 0, 1), call("127.0.0.2", "30013", 2, 3),
+                                                       call("127.0.0.2", "30013", 3, 4)])
+
+    def test_iter_blocks_range_whenPageIsEmpty_thenRaisesChainContinuityError(self):
+        with patch.object(FullNode, '__init__', return_value=None) as patched_init, \
+                patch.object(FullNode, '_iter_blocks_page', return_value=(block for block in [])) as patched_iter_blocks_page:
+            node = FullNode("127.0.0.1", "reward_address")
+
+            self.assertRaises(ChainContinuityError, list, node.iter_blocks_range("127.0.0.2", "30013", 0, 4))
+
+    def test_iter_blocks_range_whenResponseIsCutShort_thenRaisesChainContinuityError(self):
+        transaction = Transaction("source", "destination", 0, 0, "signature", 1508823223)
+        mock_response = Mock()
+        mock_response.status_code = 200
+
+        with patch.object(FullNode, '__init__', return_value=None) as patched_init, \
+                patch.object(Block, '_calculate_block_hash', return_value="0000" + "ab" * 30) as patched_calculate_block_hash, \
+                patch("crankycoin.requests.get", return_value=mock_response) as patched_requests:
+            blocks = [Block(i, [transaction], "previous_hash", 1234567890, i) for i in range(2)]
+            node = FullNode("127.0.0.1", "reward_address")
+            for content_type, payload in ((BinaryCodec.CONTENT_TYPE, BinaryCodec.encode_blocks(blocks)),
+                                          ('application/json', FullNode._blocks_json(blocks))):
+                mock_response.headers = {'Content-Type': content_type}
+                mock_response.iter_content.side_effect = lambda size: iter([payload[:-1]])
+
+                blocks_range = node.iter_blocks_range("127.0.0.2", "30013", 0, 1)
+
+                self.assertEqual(next(blocks_range), blocks[0])
+                self.assertRaises(ChainContinuityError, list, blocks_range)
+                self.assertIsNone(node.request_blocks_range("127.0.0.2", "30013", 0, 1))
+
+    def test_receive_block_whenBlockIsNext_thenQueuesBlockAndAnswersAccepted(self):
+        mock_request = Mock()
+        mock_block = Mock(Block)
+        mock_block.index = 36
+        mock_block.previous_hash = "0000_tip_hash"
+        mock_block.transactions = [Mock(Transaction)]
+        mock_block.current_hash = "0000_block_hash"
+        mock_blockchain = Mock(Blockchain)
+        mock_blockchain.get_height.return_value = 35
+        mock_blockchain.get_block_hash.return_value = "0000_tip_hash"
+
+        with patch.object(FullNode, '__init__', return_value=None) as patched_init:
+            node = FullNode("127.0.0.1", "reward_address")
+            node.blockchain = mock_blockchain
+            node._inventory = RecentlySeen(10)
+            node._block_queue = Queue(1)
+
+            resp = node._receive_block(mock_request, mock_block, "127.0.0.2", "0000_block_hash")
+
+            self.assertEqual(json.loads(resp), {'message': 'accepted'})
+            mock_request.setResponseCode.assert_called_once_with(202)
+            self.assertEqual(node.block_queue.get_nowait(), (mock_block, "127.0.0.2", None))
+            mock_blockchain.add_block.assert_not_called()
+
+    def test_receive_block_whenQueuedWithWireBytes_thenQueuesThemWithoutCaching(self):
+        block = Block(36, [Transaction("0", "reward_address", 50, 0, "0", 1508823225)], "", 1234567890, 0)
+        mock_blockchain = Mock(Blockchain)
+        mock_blockchain.get_height.return_value = 35
+        mock_blockchain.get_block_hash.return_value = ""
+
+        with patch.object(FullNode, '__init__', return_value=None) as patched_init, \
+                patch.object(Block, '_calculate_block_hash', return_value="0000" + "ab" * 30) as patched_calculate_block_hash:
+            node = FullNode("127.0.0.1", "reward_address")
+            node.blockchain = mock_blockchain
+            node._inventory = RecentlySeen(10)
+            node._block_queue = Queue(1)
+
+            node._receive_block(Mock(), block, "127.0.0.2", "0000" + "ab" * 30, {BinaryCodec.CONTENT_TYPE: "wire_bytes"})
+
+            self.assertEqual(node.block_queue.get_nowait(), (block, "127.0.0.2", {BinaryCodec.CONTENT_TYPE: "wire_bytes"}))
+            self.assertIsNone(node._block_cache)
+
+    def test_receive_block_whenBlockDoesNotExtendTip_thenAnswersConflictWithoutHashing(self):
+        mock_request = Mock()
+        block = Block(36, [Transaction("0", "reward_address", 50, 0, "0", 1508823225)], "0000_other_hash", 1234567890, 0)
+        mock_blockchain = Mock(Blockchain)
+        mock_blockchain.get_height.return_value = 35
+        mock_blockchain.get_block_hash.return_value = "0000_tip_hash"
+
+        with patch.object(FullNode, '__init__', return_value=None) as patched_init, \
+                patch.object(Block, '_calculate_block_hash') as patched_calculate_block_hash:
+            node = FullNode("127.0.0.1", "reward_address")
+            node.blockchain = mock_blockchain
+            node._inventory = RecentlySeen(10)
+            node._metrics = Metrics()
+            node._block_queue = Queue(1)
+
+            node._receive_block(mock_request, block, "127.0.0.2", "0000_block_hash")
+
+            mock_request.setResponseCode.assert_called_once_with(409)
+            patched_calculate_block_hash.assert_not_called()
+            mock_blockchain.get_block_hash.assert_called_once_with(35)
+            self.assertEqual(node.metrics.get_counter("block_rejections.continuity"), 1)
+            self.assertTrue(node.block_queue.empty())
+
+    def test_receive_block_whenTooManyTransactions_thenAnswersNotAcceptableWithoutHashing(self):
+        mock_request = Mock()
+        transactions = [Transaction("0", "reward_address", 50, 0, "0", 1508823225)] * 3
+        block = Block(36, transactions, "0000_tip_hash", 1234567890, 0)
+        mock_blockchain = Mock(Blockchain)
+        mock_blockchain.get_height.return_value = 35
+        mock_blockchain.get_block_hash.return_value = "0000_tip_hash"
+
+        with patch.object(FullNode, '__init__', return_value=None) as patched_init, \
+                patch.object(Blockchain, 'MAX_TRANSACTIONS_PER_BLOCK', 1), \
+                patch.object(Block, '_calculate_block_hash') as patched_calculate_block_hash:
+            node = FullNode("127.0.0.1", "reward_address")
+            node.blockchain = mock_blockchain
+            node._inventory = RecentlySeen(10)
+            node._metrics = Metrics()
+            node._block_queue = Queue(1)
+
+            node._receive_block(mock_request, block, "127.0.0.2", "0000_block_hash")
+
+            mock_request.setResponseCode.assert_called_once_with(406)
+            patched_calculate_block_hash.assert_not_called()
+            self.assertEqual(node.metrics.get_counter("block_rejections.structure"), 1)
+            self.assertTrue(node.block_queue.empty())
+
+    def test_receive_block_whenBlockQueueIsFull_thenAnswersServiceUnavailable(self):
+        mock_request = Mock()
+        mock_block = Mock(Block)
+        mock_block.index = 36
+        mock_block.previous_hash = "0000_tip_hash"
+        mock_block.transactions = [Mock(Transaction)]
+        mock_block.current_hash = "0000_block_hash"
+        mock_blockchain = Mock(Blockchain)
+        mock_blockchain.get_height.return_value = 35
+        mock_blockchain.get_block_hash.return_value = "0000_tip_hash"
+
+        with patch.object(FullNode, '__init__', return_value=None) as patched_init:
+            node = FullNode("127.0.0.1", "reward_address")
+            node.blockchain = mock_blockchain
+            node._inventory = RecentlySeen(10)
+            node._block_queue = Queue(1)
+            node._block_queue.put_nowait((Mock(Block), "127.0.0.3", None))
+
+            node._receive_block(mock_request, mock_block, "127.0.0.2", "0000_block_hash")
+
+            mock_request.setResponseCode.assert_called_once_with(503)
+            self.assertNotIn("0000_block_hash", node.inventory)
+
+    def test_receive_block_whenBlockIndexTooLow_thenAnswersConflict(self):
+        mock_request = Mock()
+        mock_block = Mock(Block)
+        mock_block.index = 35
+        mock_blockchain = Mock(Blockchain)
+        mock_blockchain.get_height.return_value = 35
+
+        with patch.object(FullNode, '__init__', return_value=None) as patched_init:
+            node = FullNode("127.0.0.1", "reward_address")
+            node.blockchain = mock_blockchain
+            node._block_queue = Queue(1)
+
+            node._receive_block(mock_request, mock_block, "127.0.0.2", "0000_block_hash")
+
+            mock_request.setResponseCode.assert_called_once_with(409)
+            self.assertTrue(node.block_queue.empty())
+
+    def test_receive_block_whenHashDoesNotMatch_thenAnswersNotAcceptable(self):
+        mock_request = Mock()
+        mock_block = Mock(Block)
+        mock_block.index = 36
+        mock_block.previous_hash = "0000_tip_hash"
+        mock_block.transactions = [Mock(Transaction)]
+        mock_block.current_hash = "0000_actual_hash"
+        mock_blockchain = Mock(Blockchain)
+        mock_blockchain.get_height.return_value = 35
+        mock_blockchain.get_block_hash.return_value = "0000_tip_hash"
+
+        with patch.object(FullNode, '__init__', return_value=None) as patched_init:
+            node = FullNode("127.0.0.1", "reward_address")
+            node.blockchain = mock_blockchain
+            node._inventory = RecentlySeen(10)
+            node._metrics = Metrics()
+            node._block_queue = Queue(1)
+
+            node._receive_block(mock_request, mock_block, "127.0.0.2", "0000_block_hash")
+
+            mock_request.setResponseCode.assert_called_once_with(406)
+            self.assertEqual(node.metrics.get_counter("block_rejections.hash_mismatch"), 1)
+            self.assertNotIn("0000_block_hash", node.inventory)
+            self.assertTrue(node.block_queue.empty())
+
+    def test_process_block_whenBlockIsAheadOfTip_thenFetchesMissingBlocksAndRelays(self):
+        mock_latest_block = Mock(Block)
+        mock_latest_block.index = 35
+        mock_latest_block.current_hash = "0000_latest_hash"
+        mock_missing_block = Mock(Block)
+        mock_missing_block.previous_hash = "0000_latest_hash"
+        mock_block = Mock(Block)
+        mock_block.index = 37
+        mock_block.current_hash = "0000_block_hash"
+        mock_block.transactions = []
+        mock_blockchain = Mock(Blockchain)
+        mock_blockchain.get_latest_block.return_value = mock_latest_block
+        mock_blockchain.add_block.return_value = True
+        mock_blockchain.get_block_hash.return_value = "0000_block_hash"
+
+        with patch.object(FullNode, '__init__', return_value=None) as patched_init, \
+                patch.object(FullNode, 'iter_blocks_range', return_value=(block for block in [mock_missing_block, mock_block])) as patched_iter_blocks_range, \
+                patch("crankycoin.node.reactor") as patched_reactor:
+            node = FullNode("127.0.0.1", "reward_address")
+            node.blockchain = mock_blockchain
+            node._block_cache = Mock(EncodedBlockCache)
+
+            resp = node.process_block(mock_block, "127.0.0.2", {BinaryCodec.CONTENT_TYPE: "wire_bytes"})
+
+            self.assertTrue(resp)
+            patched_iter_blocks_range.assert_called_once_with("127.0.0.2", FullNode.FULL_NODE_PORT, 36, 37)
+            mock_blockchain.add_block.assert_has_calls([call(mock_missing_block), call(mock_block)])
+            # gap-filled blocks are cached when first served; the received block keeps the bytes it came as
+            node._block_cache.put.assert_called_once_with(mock_block, {BinaryCodec.CONTENT_TYPE: "wire_bytes"})
+            patched_reactor.callInThread.assert_called_once_with(node.broadcast_block, mock_block)
+
+    def test_process_block_whenBlockRejected_thenDoesNotRelay(self):
+        mock_latest_block = Mock(Block)
+        mock_latest_block.index = 35
+        mock_block = Mock(Block)
+        mock_block.index = 36
+        mock_blockchain = Mock(Blockchain)
+        mock_blockchain.get_latest_block.return_value = mock_latest_block
+        mock_blockchain.add_block.return_value = False
+
+        with patch.object(FullNode, '__init__', return_value=None) as patched_init, \
+                patch("crankycoin.node.reactor") as patched_reactor:
+            node = FullNode("127.0.0.1", "reward_address")
+            node.blockchain = mock_blockchain
+
+            resp = node.process_block(mock_block, "127.0.0.2", {BinaryCodec.CONTENT_TYPE: "wire_bytes"})
+
+            self.assertFalse(resp)
+            mock_blockchain.add_block.assert_called_once_with(mock_block)
+            patched_reactor.callInThread.assert_not_called()
+            self.assertIsNone(node._block_cache)
+
+    def test_process_block_whenBlockAdded_thenCachesReceivedBytes(self):
+        mock_latest_block = Mock(Block)
+        mock_latest_block.index = 35
+        mock_block = Mock(Block)
+        mock_block.index = 36
+        mock_block.transactions = []
+        mock_blockchain = Mock(Blockchain)
+        mock_blockchain.get_latest_block.return_value = mock_latest_block
+        mock_blockchain.add_block.return_value = True
+
+        with patch.object(FullNode, '__init__', return_value=None) as patched_init, \
+                patch("crankycoin.node.reactor") as patched_reactor:
+            node = FullNode("127.0.0.1", "reward_address")
+            node.blockchain = mock_blockchain
+            node._block_cache = Mock(EncodedBlockCache)
+
+            resp = node.process_block(mock_block, "127.0.0.2", {BinaryCodec.CONTENT_TYPE: "wire_bytes"})
+
+            self.assertTrue(resp)
+            node._block_cache.put.assert_called_once_with(mock_block, {BinaryCodec.CONTENT_TYPE: "wire_bytes"})
+
+    def test_start_block_processing_thenCreatesQueueAndGateBeforeStartingWorker(self):
+        with patch.object(FullNode, '__init__', return_value=None) as patched_init, \
+                patch("crankycoin.node.threading.Thread") as patched_thread:
+            node = FullNode("127.0.0.1", "reward_address")
+
+            node.start_block_processing()
+
+            self.assertIsInstance(node._block_queue, Queue)
+            self.assertIsInstance(node._block_gate, PriorityGate)
+            patched_thread.assert_called_once_with(target=node._process_blocks)
+            patched_thread.return_value.start.assert_called_once_with()
+
+    def test_process_blocks_whenBlockAccepted_thenLeavesGateBeforeRelayRuns(self):
+        mock_block = Mock(Block)
+        mock_block.index = 36
+        mock_block.transactions = []
+        mock_latest_block = Mock(Block)
+        mock_latest_block.index = 35
+        mock_blockchain = Mock(Blockchain)
+        mock_blockchain.get_latest_block.return_value = mock_latest_block
+        mock_blockchain.add_block.return_value = True
+        mock_queue = Mock()
+        mock_queue.get.side_effect = [(mock_block, "127.0.0.2", None), KeyboardInterrupt]
+
+        with patch.object(FullNode, '__init__', return_value=None) as patched_init, \
+                patch.object(FullNode, 'broadcast_block') as patched_broadcast_block, \
+                patch("crankycoin.node.reactor") as patched_reactor:
+            node = FullNode("127.0.0.1", "reward_address")
+            node.blockchain = mock_blockchain
+            node._block_cache = Mock(EncodedBlockCache)
+            node._block_queue = mock_queue
+            node._block_gate = PriorityGate()
+            node._block_gate.enter()
+
+            self.assertRaises(KeyboardInterrupt, node._process_blocks)
+
+            self.assertTrue(node._block_gate.is_open())
+            patched_broadcast_block.assert_not_called()
+            patched_reactor.callInThread.assert_called_once_with(node.broadcast_block, mock_block)
+
+    def test_process_blocks_whenBlockRejected_thenForgetsBlockHash(self):
+        mock_block = Mock(Block)
+        mock_block.current_hash = "block_hash"
+        mock_queue = Mock()
+        mock_queue.get.side_effect = [(mock_block, "127.0.0.2", None), KeyboardInterrupt]
+
+        with patch.object(FullNode, '__init__', return_value=None) as patched_init, \
+                patch.object(FullNode, 'process_block', return_value=False) as patched_process_block:
+            node = FullNode("127.0.0.1", "reward_address")
+            node._block_queue = mock_queue
+            node._block_gate = Mock()
+            node.inventory.add("block_hash")
+
+            self.assertRaises(KeyboardInterrupt, node._process_blocks)
+
+            patched_process_block.assert_called_once_with(mock_block, "127.0.0.2", None)
+            self.assertNotIn("block_hash", node.inventory)
+            node._block_gate.leave.assert_called_once_with()
+
+    def test_get_tip_lag_thenRecordsLagBehindBestPeerTip(self):
+        mock_blockchain = Mock(Blockchain)
+        mock_blockchain.get_height.return_value = 35
+
+        with patch.object(FullNode, '__init__', return_value=None) as patched_init:
+            node = FullNode("127.0.0.1", "reward_address")
+            node.blockchain = mock_blockchain
+            node._metrics = Metrics()
+
+            resp = node.get_tip_lag({
+                "127.0.0.2": {"index": 38, "current_hash": "0000_hash_one"},
+                "127.0.0.3": {"index": 30, "current_hash": "0000_hash_two"}
+            })
+
+            self.assertEqual(resp, 3)
+            self.assertEqual(node.metrics.get_gauge("tip_lag"), 3)
+
+    def test_check_sync_whenLagWithinThreshold_thenDoesNotSynchronize(self):
+        tips = {"127.0.0.2": {"index": 36, "current_hash": "0000_hash_one"}}
+        with patch.object(FullNode, '__init__', return_value=None) as patched_init, \
+                patch.object(FullNode, 'request_tips', return_value=tips), \
+                patch.object(FullNode, 'get_tip_lag', return_value=FullNode.SYNC_LAG_THRESHOLD), \
+                patch.object(FullNode, 'synchronize') as patched_synchronize:
+            node = FullNode("127.0.0.1", "reward_address")
+            node._metrics = Metrics()
+
+            resp = node.check_sync()
+
+            self.assertTrue(resp)
+            patched_synchronize.assert_not_called()
+
+    def test_check_sync_whenLagAboveThresholdAndSyncFails_thenReturnsFalse(self):
+        tips = {"127.0.0.2": {"index": 40, "current_hash": "0000_hash_one"}}
+        with patch.object(FullNode, '__init__', return_value=None) as patched_init, \
+                patch.object(FullNode, 'request_tips', return_value=tips), \
+                patch.object(FullNode, 'get_tip_lag', return_value=FullNode.SYNC_LAG_THRESHOLD + 1), \
+                patch.object(FullNode, 'synchronize', return_value=False) as patched_synchronize:
+            node = FullNode("127.0.0.1", "reward_address")
+            node._metrics = Metrics()
+
+            resp = node.check_sync()
+
+            self.assertFalse(resp)
+            patched_synchronize.assert_called_once_with(tips)
+            self.assertEqual(node.metrics.get_counter("sync_failures"), 1)
+
+    def test_synchronize_thenSyncsFromPeerWithHighestTipFirst(self):
+        mock_latest_block = Mock(Block)
+        mock_latest_block.index = 35
+        mock_blockchain = Mock(Blockchain)
+        mock_blockchain.get_latest_block.return_value = mock_latest_block
+        tips = {
+            "127.0.0.2": {"index": 37, "current_hash": "0000_hash_one"},
+            "127.0.0.3": {"index": 39, "current_hash": "0000_hash_two"},
+            "127.0.0.4": {"index": 34, "current_hash": "0000_hash_three"}
+        }
+
+        with patch.object(FullNode, '__init__', return_value=None) as patched_init, \
+                patch.object(FullNode, '_sync_from', side_effect=[False, True]) as patched_sync_from:
+            node = FullNode("127.0.0.1", "reward_address")
+            node.blockchain = mock_blockchain
+
+            resp = node.synchronize(tips)
+
+            self.assertTrue(resp)
+            patched_sync_from.assert_has_calls([call("127.0.0.3", 39), call("127.0.0.2", 37)])
+
+    def test_synchronize_whenPeerServesMismatchedHash_thenRecordsFailureAndTriesNextPeer(self):
+        mock_latest_block = Mock(Block)
+        mock_latest_block.index = 35
+        mock_latest_block.current_hash = "0000_latest_hash"
+        mock_bad_block = Mock(Block)
+        mock_bad_block.index = 36
+        mock_bad_block.current_hash = "0000_actual_hash"
+        mock_block = Mock(Block)
+        mock_block.previous_hash = "0000_latest_hash"
+        mock_blockchain = Mock(Blockchain)
+        mock_blockchain.get_latest_block.return_value = mock_latest_block
+        mock_blockchain.add_block.return_value = True
+        tips = {
+            "127.0.0.2": {"index": 36, "current_hash": "0000_hash_one"},
+            "127.0.0.3": {"index": 37, "current_hash": "0000_hash_two"}
+        }
+
+        def iter_blocks_range(node, port, start_index, stop_index):
+            if node == "127.0.0.3":
+                yield FullNode._check_block_hash(mock_bad_block, "0000_claimed_hash")
+            yield mock_block
+
+        with patch.object(FullNode, '__init__', return_value=None) as patched_init, \
+                patch.object(FullNode, 'iter_blocks_range', side_effect=iter_blocks_range) as patched_iter_blocks_range:
+            node = FullNode("127.0.0.1", "reward_address")
+            node.blockchain = mock_blockchain
+            node._sync_lock = threading.Lock()
+            node._block_cache = Mock(EncodedBlockCache)
+
+            resp = node.synchronize(tips)
+
+            self.assertTrue(resp)
+            self.assertEqual(node.peer_health.get_failures("127.0.0.3"), 1)
+            mock_blockchain.add_block.assert_called_once_with(mock_block)
+
+    def test_sync_from_thenAddsBlocksWhileHoldingSyncLock(self):
+        mock_latest_block = Mock(Block)
+        mock_latest_block.index = 35
+        mock_latest_block.current_hash = "0000_latest_hash"
+        mock_block = Mock(Block)
+        mock_block.previous_hash = "0000_latest_hash"
+        mock_blockchain = Mock(Blockchain)
+        mock_blockchain.get_latest_block.return_value = mock_latest_block
+
+        with patch.object(FullNode, '__init__', return_value=None) as patched_init, \
+                patch.object(FullNode, 'iter_blocks_range', return_value=(block for block in [mock_block])):
+            node = FullNode("127.0.0.1", "reward_address")
+            node.blockchain = mock_blockchain
+            node._block_cache = Mock(EncodedBlockCache)
+            mock_blockchain.add_block.side_effect = lambda block: node.sync_lock.locked()
+
+            resp = node._sync_from("127.0.0.2", 36)
+
+            self.assertTrue(resp)
+            mock_blockchain.add_block.assert_called_once_with(mock_block)
+            self.assertFalse(node.sync_lock.locked())
+
+    def test_sync_from_whenTipReachedIndexWhileWaiting_thenReturnsTrueWithoutFetching(self):
+        mock_latest_block = Mock(Block)
+        mock_latest_block.index = 37
+        mock_blockchain = Mock(Blockchain)
+        mock_blockchain.get_latest_block.return_value = mock_latest_block
+
+        with patch.object(FullNode, '__init__', return_value=None) as patched_init, \
+                patch.object(FullNode, 'iter_blocks_range') as patched_iter_blocks_range:
+            node = FullNode("127.0.0.1", "reward_address")
+            node.blockchain = mock_blockchain
+
+            resp = node._sync_from("127.0.0.2", 36)
+
+            self.assertTrue(resp)
+            patched_iter_blocks_range.assert_not_called()
+
     def test_request_blocks_range(self):
         pass
 
@@ -182,8 +1642,79 @@ class TestNode(unittest.TestCase):
     def test_broadcast_node(self):
         pass
 
-    def test_load_blockchain(self):
-        pass
+    def test_load_blockchain_whenSavedEarlier_thenRestoresChain(self):
+        directory = tempfile.mkdtemp()
+        block_path = os.path.join(directory, "blocks.dat")
+        try:
+            with patch.object(FullNode, '__init__', return_value=None) as patched_init:
+                node = FullNode("127.0.0.1", "reward_address")
+                node._save_lock = threading.Lock()
+                with patch("crankycoin.transaction.time.time", return_value=1508823223):
+                    node.blockchain = Blockchain()
+                node.save_blockchain(block_path)
+                saved_block_file = node.block_file
+
+                with patch("crankycoin.transaction.time.time", return_value=1508829999):
+                    node.load_blockchain(block_path)
+
+                self.assertEqual(node.blockchain.get_size(), 1)
+                self.assertEqual(node.blockchain.get_latest_block(), Blockchain().get_genesis_block())
+                # the replaced file is left open for requests still slicing it
+                self.assertEqual(saved_block_file.get_hash(0), node.blockchain.get_block_hash(0))
+        finally:
+            shutil.rmtree(directory)
+
+    def test_load_blockchain_whenStoredBlockIsRejected_thenRaises(self):
+        directory = tempfile.mkdtemp()
+        block_path = os.path.join(directory, "blocks.dat")
+        genesis_block = Blockchain().get_genesis_block()
+        orphan_block = Block(1, [Transaction("0", "reward_address", 50, 0, "0", 1508823225)], "0000_other_hash", 1508823300)
+        try:
+            BlockFile.write(block_path, [genesis_block, orphan_block])
+            with patch.object(FullNode, '__init__', return_value=None) as patched_init:
+                node = FullNode("127.0.0.1", "reward_address")
+                node.blockchain = None
+
+                with self.assertRaises(BlockchainException) as raised:
+                    node.load_blockchain(block_path)
+
+                self.assertNotIsInstance(raised.exception, InvalidHash)
+                self.assertEqual(raised.exception.index, 1)
+                self.assertIsNone(node.blockchain)
+        finally:
+            shutil.rmtree(directory)
+
+    def test_shutdown_whenNodeHasBlockPath_thenSavesBlockchain(self):
+        with patch.object(FullNode, '__init__', return_value=None) as patched_init, \
+                patch.object(FullNode, 'save_blockchain') as patched_save_blockchain, \
+                patch("crankycoin.node.reactor") as patched_reactor:
+            node = FullNode("127.0.0.1", "reward_address")
+            node.block_path = "/tmp/blocks"
+
+            node.shutdown(True)
+
+            patched_save_blockchain.assert_called_once_with("/tmp/blocks")
+            patched_reactor.callFromThread.assert_called_once_with(patched_reactor.stop)
+
+    def test_shutdown_whenSaveFails_thenStillStopsReactor(self):
+        with patch.object(FullNode, '__init__', return_value=None) as patched_init, \
+                patch.object(FullNode, 'save_blockchain', side_effect=IOError("disk full")) as patched_save_blockchain, \
+                patch("crankycoin.node.reactor") as patched_reactor:
+            node = FullNode("127.0.0.1", "reward_address")
+            node.block_path = "/tmp/blocks"
+
+            node.shutdown(True)
+
+            patched_reactor.callFromThread.assert_called_once_with(patched_reactor.stop)
+
+    def test_start_block_saving_whenNodeHasNoBlockPath_thenDoesNotStartThread(self):
+        with patch.object(FullNode, '__init__', return_value=None) as patched_init, \
+                patch("crankycoin.node.threading.Thread") as patched_thread:
+            node = FullNode("127.0.0.1", "reward_address")
+
+            node.start_block_saving()
+
+            patched_thread.assert_not_called()
 
     def test_synchronize(self):
         pass
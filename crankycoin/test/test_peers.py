@@ -0,0 +1,87 @@
+import unittest
+from mock import patch, Mock, MagicMock, call
+from crankycoin.peers import *
+
+
+class TestPeerHealth(unittest.TestCase):
+
+    def test_record_success_whenMultipleSamples_thenSmoothsLatency(self):
+        subject = PeerHealth()
+
+        subject.record_success("127.0.0.2", 1.0)
+        subject.record_success("127.0.0.2", 2.0)
+
+        self.assertAlmostEqual(subject.get_latency("127.0.0.2"), 1.0 + PeerHealth.LATENCY_SMOOTHING)
+
+    def test_record_failure_whenBelowFailureThreshold_thenPeerStaysAvailable(self):
+        subject = PeerHealth()
+
+        for i in range(PeerHealth.FAILURE_THRESHOLD - 1):
+            subject.record_failure("127.0.0.2", now=1000)
+
+        self.assertTrue(subject.is_available("127.0.0.2", now=1000))
+
+    def test_record_failure_whenFailureThresholdReached_thenOpensCircuitUntilBackoffExpires(self):
+        subject = PeerHealth()
+
+        for i in range(PeerHealth.FAILURE_THRESHOLD):
+            subject.record_failure("127.0.0.2", now=1000)
+
+        self.assertFalse(subject.is_available("127.0.0.2", now=1000))
+        self.assertTrue(subject.is_available("127.0.0.2", now=1000 + PeerHealth.BACKOFF_BASE))
+
+    def test_is_available_whenBackoffExpires_thenLetsSingleTrialRequestThrough(self):
+        subject = PeerHealth()
+        for i in range(PeerHealth.FAILURE_THRESHOLD):
+            subject.record_failure("127.0.0.2", now=1000)
+
+        self.assertTrue(subject.is_available("127.0.0.2", now=1000 + PeerHealth.BACKOFF_BASE))
+        self.assertFalse(subject.is_available("127.0.0.2", now=1000 + PeerHealth.BACKOFF_BASE))
+
+        subject.record_success("127.0.0.2", 0.2)
+
+        self.assertTrue(subject.is_available("127.0.0.2", now=1000 + PeerHealth.BACKOFF_BASE))
+        self.assertTrue(subject.is_available("127.0.0.2", now=1000 + PeerHealth.BACKOFF_BASE))
+
+    def test_record_failure_whenFailuresContinue_thenBackoffDoublesUpToMaximum(self):
+        subject = PeerHealth()
+
+        for i in range(PeerHealth.FAILURE_THRESHOLD + 1):
+            subject.record_failure("127.0.0.2", now=1000)
+
+        self.assertFalse(subject.is_available("127.0.0.2", now=1000 + PeerHealth.BACKOFF_BASE))
+        self.assertTrue(subject.is_available("127.0.0.2", now=1000 + PeerHealth.BACKOFF_BASE * 2))
+
+        for i in range(PeerHealth.EVICTION_THRESHOLD * 4):
+            subject.record_failure("127.0.0.2", now=1000)
+
+        self.assertTrue(subject.is_available("127.0.0.2", now=1000 + PeerHealth.BACKOFF_MAX))
+
+    def test_record_failure_whenEvictionThresholdReached_thenReturnsTrue(self):
+        subject = PeerHealth()
+
+        evictions = [subject.record_failure("127.0.0.2") for i in range(PeerHealth.EVICTION_THRESHOLD)]
+
+        self.assertFalse(any(evictions[:-1]))
+        self.assertTrue(evictions[-1])
+
+    def test_record_success_whenCircuitOpen_thenClosesCircuit(self):
+        subject = PeerHealth()
+        for i in range(PeerHealth.FAILURE_THRESHOLD):
+            subject.record_failure("127.0.0.2", now=1000)
+
+        subject.record_success("127.0.0.2", 0.2)
+
+        self.assertTrue(subject.is_available("127.0.0.2", now=1000))
+        self.assertEqual(subject.get_failures("127.0.0.2"), 0)
+
+    def test_rank_thenReturnsAvailablePeersFastestFirst(self):
+        subject = PeerHealth()
+        subject.record_success("127.0.0.2", 0.3)
+        subject.record_success("127.0.0.3", 0.1)
+        for i in range(PeerHealth.FAILURE_THRESHOLD):
+            subject.record_failure("127.0.0.4", now=1000)
+
+        peers = subject.rank(["127.0.0.2", "127.0.0.3", "127.0.0.4", "127.0.0.5"], now=1000)
+
+        self.assertEqual(peers, ["127.0.0.5", "127.0.0.3", "127.0.0.2"])
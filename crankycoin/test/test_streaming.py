@@ -0,0 +1,188 @@
+import unittest
+import zlib
+from mock import patch, Mock, MagicMock, call
+from twisted.internet.defer import Deferred
+from twisted.web.test.requesthelper import DummyRequest
+from crankycoin.streaming import *
+
+
+class TestChunkProducer(unittest.TestCase):
+
+    def test_start_thenWritesEachChunkAndFinishes(self):
+        request = DummyRequest([])
+
+        done = []
+
+        ChunkProducer(request, iter(["[", "1", ", 2", "]"])).start().addCallback(done.append)
+
+        self.assertEqual(request.written, ["[", "1", ", 2", "]"])
+        self.assertEqual(done, [None])
+        self.assertFalse(request.go)
+
+    def test_resumeProducing_thenProducesChunksLazily(self):
+        mock_request = Mock()
+        produced = []
+
+        def chunks():
+            for chunk in ["a", "b"]:
+                produced.append(chunk)
+                yield chunk
+
+        subject = ChunkProducer(mock_request, chunks())
+        subject.resumeProducing()
+
+        self.assertEqual(produced, ["a"])
+        mock_request.write.assert_called_once_with("a")
+
+    def test_resumeProducing_whenChunkIsProducedOnPool_thenWritesItOnceFromCallback(self):
+        mock_request = Mock()
+        pending = Deferred()
+
+        with patch("crankycoin.streaming.deferToThreadPool", return_value=pending) as patched_defer_to_thread_pool:
+            subject = ChunkProducer(mock_request, iter(["a", "b"]), pool=Mock())
+            subject.resumeProducing()
+            subject.resumeProducing()
+
+            self.assertEqual(patched_defer_to_thread_pool.call_count, 1)
+            mock_request.write.assert_not_called()
+            pending.callback("a")
+
+        mock_request.write.assert_called_once_with("a")
+
+    def test_resumeProducing_whenChunkFails_thenDropsConnectionAndFires(self):
+        mock_request = Mock()
+        done = []
+
+        def chunks():
+            yield "a"
+            raise ValueError("bad block")
+
+        subject = ChunkProducer(mock_request, chunks())
+        subject._done.addCallback(done.append)
+        subject.resumeProducing()
+        subject.resumeProducing()
+
+        mock_request.unregisterProducer.assert_called_once_with()
+        mock_request.loseConnection.assert_called_once_with()
+        self.assertEqual(done, [None])
+
+    def test_stopProducing_thenWritesNothingMore(self):
+        mock_request = Mock()
+        subject = ChunkProducer(mock_request, iter(["a", "b"]))
+
+        subject.stopProducing()
+        subject.resumeProducing()
+
+        mock_request.write.assert_not_called()
+        self.assertTrue(subject._done.called)
+
+
+class TestJsonArrayParser(unittest.TestCase):
+
+    def test_feed_whenSplitAnywhere_thenReturnsEachElementOnce(self):
+        payload = '[{"a": "]}\\"{", "b": [1, {"c": 2}]}, "{\\"d\\": 3}", []]'
+
+        for size in range(1, len(payload) + 1):
+            subject = JsonArrayParser()
+            elements = []
+            for i in range(0, len(payload), size):
+                elements.extend(subject.feed(payload[i:i + size]))
+            subject.close()
+
+            self.assertEqual(elements, ['{"a": "]}\\"{", "b": [1, {"c": 2}]}', '"{\\"d\\": 3}"', '[]'])
+
+    def test_feed_whenElementCompletes_thenReturnsItBeforeTheArrayEnds(self):
+        subject = JsonArrayParser()
+
+        self.assertEqual(subject.feed('[{"index": 0}, {"ind'), ['{"index": 0}'])
+        self.assertEqual(subject.feed('ex": 1}'), ['{"index": 1}'])
+        self.assertRaises(ValueError, subject.close)
+
+    def test_feed_whenNotAnArray_thenRaisesValueError(self):
+        self.assertRaises(ValueError, JsonArrayParser().feed, '{"index": 0}')
+        self.assertRaises(ValueError, JsonArrayParser().feed, '[] []')
+
+
+class TestResponseCompression(unittest.TestCase):
+
+    def request(self, accept_encoding=None):
+        request = DummyRequest([])
+        if accept_encoding is not None:
+            request.requestHeaders.setRawHeaders('Accept-Encoding', [accept_encoding])
+        return request
+
+    def test_negotiate_thenPicksHighestQualitySupportedEncoding(self):
+        subject = ResponseCompression(threshold=0)
+
+        self.assertEqual(subject.negotiate(self.request("gzip, deflate")), "gzip")
+        self.assertEqual(subject.negotiate(self.request("gzip;q=0.5, deflate")), "deflate")
+        self.assertEqual(subject.negotiate(self.request("br, *;q=0.1")), "gzip")
+        self.assertIsNone(subject.negotiate(self.request("gzip;q=0, identity")))
+        self.assertIsNone(subject.negotiate(self.request()))
+
+    def test_respond_whenBodyReachesThreshold_thenCompressesAndCounts(self):
+        mock_metrics = Mock()
+        subject = ResponseCompression(threshold=100, metrics=mock_metrics)
+        body = '{"source": "' + "ab" * 100 + '"}'
+        request = self.request("deflate")
+
+        resp = subject.respond(request, body)
+
+        self.assertEqual(zlib.decompress(resp), body)
+        self.assertEqual(request.responseHeaders.getRawHeaders('Content-Encoding'), ["deflate"])
+        mock_metrics.increment.assert_has_calls([call("response_bytes.uncompressed", len(body)),
+                                                 call("response_bytes.compressed", len(resp))])
+
+    def test_respond_whenBodyBelowThreshold_thenAnswersItUncompressed(self):
+        subject = ResponseCompression(threshold=100)
+        request = self.request("gzip")
+
+        resp = subject.respond(request, '{"index": 1}')
+
+        self.assertEqual(resp, '{"index": 1}')
+        self.assertIsNone(request.responseHeaders.getRawHeaders('Content-Encoding'))
+
+    def test_compress_thenTouchesNoRequest(self):
+        subject = ResponseCompression(threshold=10)
+        body = '{"source": "' + "ab" * 100 + '"}'
+
+        resp, encoding = subject.compress(body, "gzip")
+
+        self.assertEqual(zlib.decompress(resp, 16 + zlib.MAX_WBITS), body)
+        self.assertEqual(encoding, "gzip")
+        self.assertEqual(subject.compress(body, None), (body, None))
+
+    def test_stream_whenClientAcceptsGzip_thenCompressesChunksLazily(self):
+        subject = ResponseCompression(threshold=10)
+        chunks = ["[", '{"index": 0}'] + [', {"index": %d}' % i for i in range(1, 50)] + ["]"]
+        produced = []
+
+        def produce():
+            for chunk in chunks:
+                produced.append(chunk)
+                yield chunk
+
+        resp, encoding = subject.stream(produce(), "gzip")
+
+        self.assertEqual(encoding, "gzip")
+        self.assertLess(len(produced), len(chunks))
+        self.assertEqual(zlib.decompress("".join(resp), 16 + zlib.MAX_WBITS), "".join(chunks))
+
+    def test_stream_whenResponseBelowThreshold_thenStreamsItUncompressed(self):
+        subject = ResponseCompression(threshold=1000)
+
+        resp, encoding = subject.stream(["[", "]"], "gzip")
+
+        self.assertEqual("".join(resp), "[]")
+        self.assertIsNone(encoding)
+
+    def test_apply_thenSetsContentEncodingAndPassesBodyOn(self):
+        request = self.request("gzip")
+
+        self.assertEqual(ResponseCompression.apply(("body", "gzip"), request), "body")
+        self.assertEqual(request.responseHeaders.getRawHeaders('Content-Encoding'), ["gzip"])
+        self.assertEqual(ResponseCompression.apply(("body", None), self.request()), "body")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,7 +1,130 @@
+import coincurve
+import json
 import unittest
 from mock import patch, Mock, MagicMock, call
 from crankycoin.transaction import *
 
 
 class TestTransaction(unittest.TestCase):
-    pass
+
+    def test_Transaction_whenConstructedFromJson_thenAddressesAreInternedStrings(self):
+        transaction = json.loads(Transaction("source", "destination", 1, 0.1, "signature", 1498923800).to_json())
+
+        subject = Transaction(
+            transaction['source'],
+            transaction['destination'],
+            transaction['amount'],
+            transaction['fee'],
+            transaction['signature'],
+            transaction['timestamp']
+        )
+
+        self.assertIs(type(subject.source), str)
+        self.assertIs(subject.source, intern_address(u"source"))
+        self.assertIs(subject.destination, intern_address("destination"))
+
+    def test_Transaction_whenAddressIsNotAscii_thenRaisesValueError(self):
+        self.assertRaises(ValueError, Transaction, u"sourc\u00e9", "destination", 1, 0.1, "signature", 1498923800)
+
+    def test_raw_tx_hash_thenReturnsDigestBehindTxHash(self):
+        subject = Transaction("source", "destination", 1, 0.1, "signature", 1498923800)
+
+        self.assertEqual(subject.raw_tx_hash, subject._calculate_tx_hash())
+        self.assertEqual(subject.raw_tx_hash.encode('hex'), subject.tx_hash)
+
+    def test_tx_hash_thenReturnsHexOfStoredDigest(self):
+        subject = Transaction("source", "destination", 1, 0.1, "signature", 1498923800)
+
+        self.assertEqual(len(subject.tx_hash), 64)
+        self.assertEqual(subject.tx_hash, subject._calculate_tx_hash().encode('hex'))
+
+    def test_to_json_thenContainsHexTxHash(self):
+        subject = Transaction("source", "destination", 1, 0.1, "signature", 1498923800)
+
+        resp = json.loads(subject.to_json())
+
+        self.assertEqual(resp['tx_hash'], subject.tx_hash)
+        self.assertEqual(resp['source'], "source")
+        self.assertEqual(resp['signature'], "signature")
+
+    def test_eq_whenSameFields_thenTransactionsAreEqual(self):
+        subject = Transaction("source", "destination", 1, 0.1, "signature", 1498923800)
+
+        self.assertEqual(subject, Transaction(u"source", u"destination", 1, 0.1, u"signature", 1498923800))
+        self.assertNotEqual(subject, Transaction("source", "destination", 2, 0.1, "signature", 1498923800))
+
+    def test_eq_whenOnlyOneHasBuiltSignableString_thenTransactionsAreEqual(self):
+        subject = Transaction("source", "destination", 1, 0.1, "signature", 1498923800)
+        other = Transaction("source", "destination", 1, 0.1, "signature", 1498923800)
+        subject.to_signable()
+
+        self.assertEqual(subject, other)
+
+    def test_tx_hash_whenUnsigned_thenReturnsNone(self):
+        subject = Transaction("source", "destination", 1, 0.1)
+
+        self.assertIsNone(subject.tx_hash)
+
+    def test_verify_whenSignedBySource_thenReturnsTrue(self):
+        private_key = coincurve.PrivateKey()
+        source = private_key.public_key.format(compressed=True).encode('hex')
+        subject = Transaction(source, "destination", 1, 0.1, timestamp=1498923800)
+        subject.sign(private_key.to_hex())
+
+        self.assertTrue(subject.verify())
+
+    def test_verify_whenSignatureDoesNotMatch_thenReturnsFalse(self):
+        private_key = coincurve.PrivateKey()
+        source = coincurve.PrivateKey().public_key.format(compressed=True).encode('hex')
+        subject = Transaction(source, "destination", 1, 0.1, timestamp=1498923800)
+        subject.sign(private_key.to_hex())
+
+        self.assertFalse(subject.verify())
+
+    def test_verify_whenSourceOrSignatureMalformed_thenReturnsFalse(self):
+        self.assertFalse(Transaction("source", "destination", 1, 0.1, "signature", 1498923800).verify())
+        self.assertFalse(Transaction("0", "destination", 50, 0, "0", 1498923800).verify())
+        self.assertFalse(Transaction("source", "destination", 1, 0.1).verify())
+
+    def test_to_signable_whenCalledTwice_thenReturnsSameString(self):
+        subject = Transaction("source", "destination", 1, 0.1, "signature", 1498923800)
+
+        self.assertEqual(subject.to_signable(), "source:destination:1:0.1:1498923800")
+        self.assertIs(subject.to_signable(), subject.to_signable())
+
+
+class TestPublicKeyCache(unittest.TestCase):
+
+    def test_get_whenCalledTwice_thenParsesKeyOnce(self):
+        address = coincurve.PrivateKey().public_key.format(compressed=True).encode('hex')
+        subject = PublicKeyCache(capacity=2)
+
+        with patch('crankycoin.transaction.coincurve.PublicKey') as patched_public_key:
+            resp_one = subject.get(address)
+            resp_two = subject.get(address)
+
+            patched_public_key.assert_called_once_with(address.decode('hex'))
+            self.assertIs(resp_one, resp_two)
+
+    def test_get_whenFull_thenEvictsLeastRecentlyUsedKey(self):
+        addresses = [coincurve.PrivateKey().public_key.format(compressed=True).encode('hex') for i in range(3)]
+        subject = PublicKeyCache(capacity=2)
+
+        subject.get(addresses[0])
+        subject.get(addresses[1])
+        subject.get(addresses[0])
+        subject.get(addresses[2])
+
+        self.assertEqual(len(subject), 2)
+        self.assertEqual(list(subject._keys), [addresses[0], addresses[2]])
+
+    def test_get_whenAddressIsNotAPublicKey_thenRaisesValueErrorAndCachesNothing(self):
+        subject = PublicKeyCache(capacity=2)
+
+        with self.assertRaises(ValueError):
+            subject.get("02" + "00" * 32)
+        self.assertEqual(len(subject), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,142 @@
+import json
+import unittest
+from mock import patch, Mock, MagicMock, call
+from twisted.internet.defer import fail, succeed, TimeoutError
+from twisted.internet.error import ConnectionRefusedError
+from twisted.test.proto_helpers import StringTransport
+from crankycoin.wire import *
+
+
+class TestPeerWire(unittest.TestCase):
+
+    def connect(self, wire):
+        protocol = PeerWireProtocol(wire)
+        protocol.makeConnection(StringTransport())
+        return protocol
+
+    def frames(self, protocol):
+        """
+        :return: kind, request id and payload of each frame the protocol wrote
+        """
+        data = protocol.transport.value()
+        frames = []
+        while data:
+            length, = struct.unpack('>I', data[:4])
+            message, data = data[4:4 + length], data[4 + length:]
+            kind, request_id = PeerWire.HEADER.unpack_from(message, 0)
+            frames.append((kind, request_id, message[PeerWire.HEADER.size:]))
+        return frames
+
+    def deliver(self, protocol, kind, request_id, payload):
+        protocol.dataReceived(struct.pack(">I", PeerWire.HEADER.size + len(payload)) +
+                              PeerWire.HEADER.pack(kind, request_id) + payload)
+
+    def test_connectionMade_thenAnnouncesHost(self):
+        protocol = self.connect(PeerWire("127.0.0.1", {}))
+
+        self.assertEqual(self.frames(protocol), [(PeerWire.HELLO, 0, "127.0.0.1")])
+
+    def test_stringReceived_whenRequest_thenAnswersWithHandlersCodeAndBody(self):
+        def post_block(request):
+            request.setResponseCode(202)
+            return json.dumps({'host': request.getHeader('X-Host'), 'type': request.getHeader('Content-Type'),
+                               'body': request.content.read()})
+
+        wire = PeerWire("127.0.0.1", {PeerWire.BLOCK: post_block},
+                        headers={PeerWire.BLOCK: {'Content-Type': 'application/x-crankycoin'}}, host_header='X-Host')
+        protocol = self.connect(wire)
+        protocol.transport.clear()
+
+        self.deliver(protocol, PeerWire.HELLO, 0, "127.0.0.2")
+        self.deliver(protocol, PeerWire.BLOCK, 7, "block_bytes")
+
+        kind, request_id, payload = self.frames(protocol)[0]
+        self.assertEqual((kind, request_id), (PeerWire.RESPONSE, 7))
+        self.assertEqual(PeerWire.STATUS.unpack_from(payload, 0), (202,))
+        self.assertEqual(json.loads(payload[PeerWire.STATUS.size:]),
+                         {'host': '127.0.0.2', 'type': 'application/x-crankycoin', 'body': 'block_bytes'})
+
+    def test_stringReceived_whenHandlerAnswersLater_thenSendsResponseWhenItFires(self):
+        d = Deferred()
+        protocol = self.connect(PeerWire("127.0.0.1", {PeerWire.TRANSACTIONS: lambda request: d}))
+        protocol.transport.clear()
+
+        self.deliver(protocol, PeerWire.TRANSACTIONS, 3, "[]")
+        self.assertEqual(self.frames(protocol), [])
+        d.callback('{"results": []}')
+
+        self.assertEqual(self.frames(protocol), [(PeerWire.RESPONSE, 3, PeerWire.STATUS.pack(200) + '{"results": []}')])
+
+    def test_stringReceived_whenKindUnknown_thenAnswersServerError(self):
+        protocol = self.connect(PeerWire("127.0.0.1", {}))
+        protocol.transport.clear()
+
+        self.deliver(protocol, 99, 4, "")
+
+        kind, request_id, payload = self.frames(protocol)[0]
+        self.assertEqual((kind, request_id), (PeerWire.RESPONSE, 4))
+        self.assertEqual(PeerWire.STATUS.unpack_from(payload, 0), (500,))
+
+    def test_request_whenResponseArrives_thenFiresWithIt(self):
+        protocol = self.connect(PeerWire("127.0.0.1", {}))
+        protocol.transport.clear()
+        responses = []
+
+        protocol.request(PeerWire.TIP, "").addCallback(responses.append)
+        protocol.request(PeerWire.TIP, "").addCallback(responses.append)
+        self.deliver(protocol, PeerWire.RESPONSE, 2, PeerWire.STATUS.pack(200) + '{"index": 2}')
+
+        self.assertEqual([frame[:2] for frame in self.frames(protocol)], [(PeerWire.TIP, 1), (PeerWire.TIP, 2)])
+        self.assertEqual(len(responses), 1)
+        self.assertEqual(responses[0].status_code, 200)
+        self.assertEqual(responses[0].json(), {"index": 2})
+
+    def test_connectionLost_thenFailsPendingRequestsAndForgetsConnection(self):
+        wire = PeerWire("127.0.0.1", {})
+        protocol = self.connect(wire)
+        wire._connections["127.0.0.2"] = protocol
+        failures = []
+
+        protocol.request(PeerWire.TIP, "").addErrback(failures.append)
+        protocol.connectionLost(Exception("connection lost"))
+
+        self.assertEqual(len(failures), 1)
+        self.assertEqual(wire._connections, {})
+
+    def test_request_whenPeerRecentlyUnreachable_thenReturnsNone(self):
+        wire = PeerWire("127.0.0.1", {})
+        wire._unreachable["127.0.0.2"] = time.time() + 60
+
+        with patch("crankycoin.wire.blockingCallFromThread") as patched_blocking_call_from_thread:
+            resp = wire.request("127.0.0.2", PeerWire.TIP, "")
+
+        self.assertIsNone(resp)
+        patched_blocking_call_from_thread.assert_not_called()
+
+    def test_connect_whenPeerRefuses_thenMarksItUnreachable(self):
+        wire = PeerWire("127.0.0.1", {})
+        failures = []
+
+        with patch("crankycoin.wire.connectProtocol", return_value=fail(ConnectionRefusedError())) as patched_connect_protocol:
+            wire._connect("127.0.0.2").addErrback(failures.append)
+
+        self.assertTrue(failures[0].check(PeerUnreachable))
+        self.assertFalse(wire.available("127.0.0.2"))
+
+    def test_request_whenPeerUnreachable_thenReturnsNoneForHttpFallback(self):
+        wire = PeerWire("127.0.0.1", {})
+
+        with patch("crankycoin.wire.blockingCallFromThread", side_effect=PeerUnreachable("refused")) as patched_blocking_call_from_thread:
+            resp = wire.request("127.0.0.2", PeerWire.TIP, "")
+
+        self.assertIsNone(resp)
+
+    def test_request_whenSentRequestTimesOut_thenRaisesWireRequestFailed(self):
+        wire = PeerWire("127.0.0.1", {})
+
+        with patch("crankycoin.wire.blockingCallFromThread", side_effect=TimeoutError()) as patched_blocking_call_from_thread:
+            self.assertRaises(WireRequestFailed, wire.request, "127.0.0.2", PeerWire.TIP, "")
+
+
+if __name__ == '__main__':
+    unittest.main()
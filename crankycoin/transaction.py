@@ -1,24 +1,104 @@
 import coincurve
 import hashlib
 import json
+import threading
 import time
+from collections import OrderedDict
 
+from config import *
 from errors import *
 
 
+# shared so json.dumps doesn't build a new encoder for every transaction hash
+_hash_encoder = json.JSONEncoder(sort_keys=True)
+
+
+def intern_address(address):
+    """
+    Addresses repeat across many transactions, so every transaction holding one shares a single string
+
+    :raises ValueError: if the address is unicode with non ASCII characters, which no address has
+    :rtype: str
+    """
+    if address is None:
+        return None
+    if isinstance(address, unicode):
+        try:
+            address = address.encode('ascii')
+        except UnicodeEncodeError:
+            raise ValueError("Address is not ASCII: {!r}".format(address))
+    return intern(str(address))
+
+
+class PublicKeyCache(object):
+    """
+    Least recently used cache of parsed public keys, so a hot sender's key is parsed from hex once
+    rather than on every signature check
+    """
+
+    CAPACITY = config['network']['public_key_cache_size']
+
+    def __init__(self, capacity=CAPACITY):
+        self.capacity = capacity
+        self._lock = threading.Lock()
+        self._keys = OrderedDict()
+
+    def get(self, address):
+        """
+        :raises ValueError: if the address is not a valid public key
+        :rtype: coincurve.PublicKey
+        """
+        with self._lock:
+            public_key = self._keys.pop(address, None)
+            if public_key is None:
+                public_key = coincurve.PublicKey(address.decode('hex'))
+                if len(self._keys) >= self.capacity:
+                    self._keys.popitem(last=False)
+            self._keys[address] = public_key
+            return public_key
+
+    def __len__(self):
+        return len(self._keys)
+
+
+public_keys = PublicKeyCache()
+
+
 class Transaction(object):
+    """
+    Slotted, with addresses interned and the transaction hash kept as raw bytes.  Hex is only produced
+    at the API boundary (tx_hash, to_dict, to_json).  The signed fields never change, so the signable
+    string is built once, on first use.
+    """
+
+    __slots__ = ('_source', '_destination', '_amount', '_fee', '_timestamp', '_signature', '_tx_hash', '_signable')
 
-    def __init__(self, source, destination, amount, fee, signature=None):
-        self._source = source
-        self._destination = destination
+    def __init__(self, source, destination, amount, fee, signature=None, timestamp=None):
+        self._source = intern_address(source)
+        self._destination = intern_address(destination)
         self._amount = amount
         self._fee = fee
-        self._timestamp = int(time.time())
-        self._signature = signature
+        self._timestamp = timestamp if timestamp is not None else int(time.time())
+        self._signature = str(signature) if signature is not None else None
         self._tx_hash = None
+        self._signable = None
         if signature is not None:
             self._tx_hash = self._calculate_tx_hash()
 
+    @classmethod
+    def from_dict(cls, transaction_dict):
+        """
+        Builds a transaction from the dict form of its json.  The hash is recomputed, not taken from the dict.
+        """
+        return cls(
+            transaction_dict['source'],
+            transaction_dict['destination'],
+            transaction_dict['amount'],
+            transaction_dict['fee'],
+            transaction_dict['signature'],
+            transaction_dict['timestamp']
+        )
+
     @property
     def source(self):
         return self._source
@@ -41,6 +121,13 @@ class Transaction(object):
 
     @property
     def tx_hash(self):
+        return self._tx_hash.encode('hex') if self._tx_hash is not None else None
+
+    @property
+    def raw_tx_hash(self):
+        """
+        The sha256 digest tx_hash is the hex of, for comparing hashes without encoding them
+        """
         return self._tx_hash
 
     @property
@@ -51,7 +138,7 @@ class Transaction(object):
         """
         Calculates sha256 hash of transaction (source, destination, amount, timestamp, signature)
 
-        :return: sha256 hash
+        :return: raw sha256 digest
         :rtype: str
         """
         data = {
@@ -62,9 +149,9 @@ class Transaction(object):
             "timestamp": self._timestamp,
             "signature": self._signature
         }
-        data_json = json.dumps(data, sort_keys=True)
+        data_json = _hash_encoder.encode(data)
         hash_object = hashlib.sha256(data_json)
-        return hash_object.hexdigest()
+        return hash_object.digest()
 
     def sign(self, private_key):
         signature = coincurve.PrivateKey.from_hex(private_key).sign(self.to_signable()).encode('hex')
@@ -73,29 +160,50 @@ class Transaction(object):
         return signature
 
     def to_signable(self):
-        return ":".join((
-            self._source,
-            self._destination,
-            str(self._amount),
-            str(self._fee),
-            str(self._timestamp)
-        ))
+        if self._signable is None:
+            self._signable = ":".join((
+                self._source,
+                self._destination,
+                str(self._amount),
+                str(self._fee),
+                str(self._timestamp)
+            ))
+        return self._signable
 
     def verify(self):
-        return coincurve.PublicKey(self._source).verify(self._signature, self.to_signable())
+        """
+        :return: False if the signature doesn't match, or the source or signature are missing or malformed
+        :rtype: bool
+        """
+        try:
+            public_key = public_keys.get(self._source)
+            return public_key.verify(self._signature.decode('hex'), self.to_signable())
+        except (AttributeError, TypeError, ValueError):
+            return False
+
+    def to_dict(self):
+        return {
+            "source": self._source,
+            "destination": self._destination,
+            "amount": self._amount,
+            "fee": self._fee,
+            "timestamp": self._timestamp,
+            "signature": self._signature,
+            "tx_hash": self.tx_hash
+        }
 
     def to_json(self):
-        return json.dumps(self, default=lambda o: {key.lstrip('_'): value for key, value in o.__dict__.items()},
-                          sort_keys=True)
+        return json.dumps(self.to_dict(), sort_keys=True)
 
     def __repr__(self):
-        return "<Transaction {}>".format(self._tx_hash)
+        return "<Transaction {}>".format(self.tx_hash)
 
     def __str__(self):
-        return str(self.__dict__)
+        return str(self.to_dict())
 
     def __eq__(self, other):
-        return self.__dict__ == other.__dict__
+        # the signable string is derived from the other fields, so it is left out
+        return all(getattr(self, slot) == getattr(other, slot) for slot in self.__slots__ if slot != '_signable')
 
     def __ne__(self, other):
         return not self == other
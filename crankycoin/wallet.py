@@ -41,7 +41,7 @@ class Client(NodeMixin):
             node = random.sample(self.full_nodes, 1)[0]
         url = self.BALANCE_URL.format(node, self.FULL_NODE_PORT, address)
         try:
-            response = requests.get(url)
+            response = self._request(requests.get, node, url)
             return response.json()
         except requests.exceptions.RequestException as re:
             pass
@@ -54,7 +54,7 @@ class Client(NodeMixin):
             node = random.sample(self.full_nodes, 1)[0]
         url = self.TRANSACTION_HISTORY_URL.format(node, self.FULL_NODE_PORT, address)
         try:
-            response = requests.get(url)
+            response = self._request(requests.get, node, url)
             return response.json()
         except requests.exceptions.RequestException as re:
             pass
@@ -70,6 +70,24 @@ class Client(NodeMixin):
         transaction.sign(self.get_private_key())
         return self.broadcast_transaction(transaction)
 
+    def create_transactions(self, payments):
+        """
+        Signs and submits many payments in bulk
+
+        :param payments: destination, amount and fee of each payment
+        :type payments: list of tuple
+        :return: whether each payment was accepted by at least one node
+        :rtype: list of bool
+        """
+        public_key = self.get_public_key()
+        private_key = self.get_private_key()
+        transactions = []
+        for to, amount, fee in payments:
+            transaction = Transaction(public_key, to, amount, fee)
+            transaction.sign(private_key)
+            transactions.append(transaction)
+        return self.broadcast_transactions(transactions)
+
 
 if __name__ == "__main__":
     pass
@@ -0,0 +1,256 @@
+import json
+import struct
+import time
+from StringIO import StringIO
+
+from twisted.internet import reactor
+from twisted.internet.defer import Deferred, fail, maybeDeferred, succeed
+from twisted.internet.endpoints import TCP4ClientEndpoint, connectProtocol
+from twisted.internet.protocol import Factory
+from twisted.internet.threads import blockingCallFromThread
+from twisted.protocols.basic import Int32StringReceiver
+from twisted.python import threadable
+
+from config import *
+
+
+class PeerUnreachable(Exception):
+    """
+    A peer's wire port could not be reached, so the message was never sent
+    """
+    pass
+
+
+class WireRequestFailed(Exception):
+    """
+    A message was sent to a peer but not answered, e.g. it timed out or the connection dropped.  The peer
+    may already have handled it.
+    """
+    pass
+
+
+class WireRequest(object):
+    """
+    The part of a twisted.web request the peer route handlers use, built from a wire message, so a message
+    is handled by the same code as the matching HTTP route
+    """
+
+    def __init__(self, payload, headers=None):
+        self.content = StringIO(payload)
+        self.code = 200
+        self.args = {}
+        self._request_headers = headers or {}
+        self.response_headers = {}
+
+    def getHeader(self, name):
+        return self._request_headers.get(name)
+
+    def setHeader(self, name, value):
+        self.response_headers[name] = value
+
+    def setResponseCode(self, code):
+        self.code = code
+
+
+class WireResponse(object):
+    """
+    A wire answer, shaped like the parts of a requests response the peer clients read
+    """
+
+    def __init__(self, status_code, content):
+        self.status_code = status_code
+        self.content = content
+        self.headers = {}
+
+    def json(self):
+        return json.loads(self.content)
+
+
+class PeerWireProtocol(Int32StringReceiver):
+    """
+    One long lived connection between two full nodes.  Each frame is a 32 bit length prefix and a message:
+    its kind, a request id, and the payload.  Either end may send requests; every request is answered with
+    a RESPONSE frame carrying the same id, a status code and the body.
+    """
+
+    MAX_LENGTH = config['network']['wire_max_message_size']
+
+    def __init__(self, wire):
+        self.wire = wire
+        self.peer_host = None
+        self._next_id = 1
+        self._pending = {}
+
+    def connectionMade(self):
+        self.sendMessage(PeerWire.HELLO, 0, self.wire.host)
+
+    def connectionLost(self, reason):
+        pending, self._pending = self._pending, {}
+        for d in pending.values():
+            d.errback(reason)
+        self.wire.connection_lost(self)
+
+    def sendMessage(self, kind, request_id, payload):
+        self.sendString(PeerWire.HEADER.pack(kind, request_id) + payload)
+
+    def request(self, kind, payload):
+        """
+        :return: Deferred firing with a WireResponse
+        :rtype: Deferred
+        """
+        request_id = self._next_id
+        self._next_id = self._next_id % 0xffffffff + 1
+        d = Deferred(lambda d: self._pending.pop(request_id, None))
+        self._pending[request_id] = d
+        self.sendMessage(kind, request_id, payload)
+        return d
+
+    def stringReceived(self, data):
+        try:
+            kind, request_id = PeerWire.HEADER.unpack_from(data, 0)
+        except struct.error:
+            self.transport.loseConnection()
+            return
+        payload = data[PeerWire.HEADER.size:]
+        if kind == PeerWire.RESPONSE:
+            d = self._pending.pop(request_id, None)
+            if d is not None:
+                status_code, = PeerWire.STATUS.unpack_from(payload, 0)
+                d.callback(WireResponse(status_code, payload[PeerWire.STATUS.size:]))
+        elif kind == PeerWire.HELLO:
+            self.peer_host = payload
+        else:
+            self.wire.handle(self, kind, request_id, payload)
+
+    def lengthLimitExceeded(self, length):
+        logger.warning("Dropping peer %s: %s byte message exceeds the limit", self.peer_host, length)
+        self.transport.loseConnection()
+
+
+class PeerWire(object):
+    """
+    Persistent framed TCP connections between full nodes, an alternative to one HTTP request per gossip
+    message.  Incoming messages are dispatched to handlers taking a WireRequest; outgoing requests reuse
+    one connection per peer, opened on first use.  Peers that can't be reached on the wire port are not
+    tried again for RETRY_INTERVAL seconds, so callers fall back to HTTP for them.
+    """
+
+    HEADER = struct.Struct('>BI')  # message kind, request id
+    STATUS = struct.Struct('>H')
+
+    RESPONSE = 0
+    HELLO = 1
+    INVENTORY = 2
+    TRANSACTION = 3
+    TRANSACTIONS = 4
+    BLOCK = 5
+    COMPACT_BLOCK = 6
+    TIP = 7
+
+    PORT = config['network']['wire_port']
+    TIMEOUT = config['network']['request_timeout']
+    RETRY_INTERVAL = config['network']['wire_retry_interval']
+
+    def __init__(self, host, handlers, headers=None, host_header=None, port=PORT, timeout=TIMEOUT):
+        """
+        :param handlers: route handler for each message kind
+        :type handlers: dict
+        :param headers: request headers a handler sees for each message kind
+        :type headers: dict
+        :param host_header: request header that carries the host the sending peer announced
+        :type host_header: str
+        """
+        self.host = host
+        self.handlers = handlers
+        self.headers = headers or {}
+        self.host_header = host_header
+        self.port = port
+        self.timeout = timeout
+        self._connections = {}
+        self._unreachable = {}
+
+    def listen(self, interface=''):
+        return reactor.listenTCP(self.port, Factory.forProtocol(lambda: PeerWireProtocol(self)), interface=interface)
+
+    def handle(self, protocol, kind, request_id, payload):
+        handler = self.handlers.get(kind)
+        headers = dict(self.headers.get(kind, {}))
+        if self.host_header is not None:
+            headers[self.host_header] = protocol.peer_host
+        request = WireRequest(payload, headers)
+        if handler is None:
+            d = fail(ValueError("Unknown message kind {}".format(kind)))
+        else:
+            d = maybeDeferred(handler, request)
+
+        def answer(body):
+            protocol.sendMessage(self.RESPONSE, request_id, self.STATUS.pack(request.code) + (body or ""))
+
+        def failed(failure):
+            logger.warning("Wire message %s from %s failed: %s", kind, protocol.peer_host, failure.getErrorMessage())
+            request.setResponseCode(500)
+            answer(json.dumps({'message': failure.getErrorMessage()}))
+
+        d.addCallbacks(answer, failed)
+
+    def connection_lost(self, protocol):
+        for node, connection in self._connections.items():
+            if connection is protocol:
+                del self._connections[node]
+
+    def _connect(self, node):
+        connection = self._connections.get(node)
+        if connection is not None:
+            return succeed(connection)
+        endpoint = TCP4ClientEndpoint(reactor, node, self.port, timeout=self.timeout)
+        d = connectProtocol(endpoint, PeerWireProtocol(self))
+
+        def connected(protocol):
+            existing = self._connections.get(node)
+            if existing is not None:
+                # another request connected first
+                protocol.transport.loseConnection()
+                return existing
+            self._connections[node] = protocol
+            return protocol
+
+        def unreachable(failure):
+            self._unreachable[node] = time.time() + self.RETRY_INTERVAL
+            raise PeerUnreachable(failure.getErrorMessage())
+
+        return d.addCallbacks(connected, unreachable)
+
+    def _request(self, node, kind, payload):
+        d = self._connect(node)
+        d.addCallback(lambda protocol: protocol.request(kind, payload))
+        return d.addTimeout(self.timeout, reactor)
+
+    def available(self, node):
+        return self._unreachable.get(node, 0) <= time.time()
+
+    def request(self, node, kind, payload):
+        """
+        Sends a request to a peer and waits for its answer.  Must be called off the reactor thread.
+
+        :raises WireRequestFailed: if the request was sent but not answered, so it must not be sent again
+        :return: the answer, or None if the peer is not reachable on the wire and the request was not sent
+        :rtype: WireResponse
+        """
+        if not self.available(node) or threadable.isInIOThread():
+            return None
+        try:
+            return blockingCallFromThread(reactor, self._request, node, kind, payload)
+        except PeerUnreachable as e:
+            logger.debug("Peer %s is not reachable on the wire: %s", node, e)
+            return None
+        except Exception as e:
+            raise WireRequestFailed("Wire request to {} failed: {}".format(node, e))
+
+    def close(self):
+        for protocol in self._connections.values():
+            protocol.transport.loseConnection()
+        self._connections.clear()
+
+
+if __name__ == "__main__":
+    pass
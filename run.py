@@ -94,7 +94,7 @@ def full():
         sys.exit(1)
     else:
         print("\n\nfull node starting...\n\n")
-        fullnode = FullNode(ip, public_key)
+        fullnode = FullNode(ip, public_key, block_path=config['user']['block_path'])
 
     while True:
         cmd = raw_input("{} ({}) full node > ".format(config['network']['name'], config['network']['ticker_symbol']))
@@ -152,7 +152,7 @@ def miner():
         sys.exit(1)
     else:
         print("\n\nmining node starting...\n\n")
-        fullnode = FullNode(ip, public_key, mining=True)
+        fullnode = FullNode(ip, public_key, block_path=config['user']['block_path'], mining=True)
 
     while True:
         cmd = raw_input("{} ({}) full node > ".format(config['network']['name'], config['network']['ticker_symbol']))
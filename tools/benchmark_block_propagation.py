@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+"""
+Measures what a receiving node pays to accept a freshly mined block, sending it in full (POST /blocks)
+versus as a compact block rebuilt from the receiver's mempool (POST /blocks/compact).
+
+The receiver's mempool is a SharedMempool, as on a running node, optionally padded with transactions that
+are not in the block.
+
+usage: tools/benchmark_block_propagation.py [transactions per block] [percent of transactions in mempool]
+    [other transactions in mempool]
+"""
+
+from __future__ import print_function
+
+import json
+import sys
+import time
+import coincurve
+
+sys.path.insert(0, '.')
+from crankycoin import *
+
+
+def build_block(transaction_count):
+    private_key = coincurve.PrivateKey()
+    source = private_key.public_key.format(compressed=True).encode('hex')
+    transactions = []
+    for i in range(transaction_count):
+        transaction = Transaction(source, coincurve.PrivateKey().public_key.format(compressed=True).encode('hex'), i, 0.1)
+        transaction.sign(private_key.to_hex())
+        transactions.append(transaction)
+    transactions.append(Transaction("0", source, 50, 0, "0"))
+    return Block(1, transactions, "0" * 64, int(time.time()), 0)
+
+
+def rebuild_full_block(payload):
+    return Block.from_dict(json.loads(json.loads(payload)['block']))
+
+
+def rebuild_compact_block(node, block, payload):
+    block_rebuilt, missing = node._reconstruct_compact_block(json.loads(json.loads(payload)['block']))
+    round_trips = 1
+    if block_rebuilt is None:
+        payload = json.dumps({"block": block.to_compact_json(missing), "host": "127.0.0.1"})
+        block_rebuilt, missing = node._reconstruct_compact_block(json.loads(json.loads(payload)['block']))
+        round_trips += 1
+    return block_rebuilt, round_trips, len(payload)
+
+
+def main(argv):
+    transaction_count = int(argv[0]) if len(argv) > 0 else config['network']['max_transactions_per_block']
+    mempool_percent = int(argv[1]) if len(argv) > 1 else 100
+    other_count = int(argv[2]) if len(argv) > 2 else 0
+    block = build_block(transaction_count)
+    in_mempool = block.transactions[:-1][:transaction_count * mempool_percent / 100]
+    others = [Transaction("0" * 66, "1" * 66, i, 0.1, "signature_{}".format(i)) for i in range(other_count)]
+
+    mempool = SharedMempool(capacity=max(SharedMempool.CAPACITY, len(in_mempool) + other_count))
+    for transaction in in_mempool + others:
+        mempool.push(transaction)
+    node = FullNode.__new__(FullNode)
+    node.blockchain = Blockchain(unconfirmed_transactions=mempool)
+
+    full_payload = json.dumps({"block": block.to_json(), "host": "127.0.0.1"})
+    start = time.time()
+    full_block = rebuild_full_block(full_payload)
+    full_elapsed = time.time() - start
+    assert full_block.current_hash == block.current_hash
+
+    compact_payload = json.dumps({"block": block.to_compact_json(), "host": "127.0.0.1"})
+    start = time.time()
+    compact_block, round_trips, fallback_bytes = rebuild_compact_block(node, block, compact_payload)
+    compact_elapsed = time.time() - start
+    assert compact_block.current_hash == block.current_hash
+
+    print("transactions: {}, in receiver mempool: {}%, other mempool transactions: {}".format(
+        transaction_count, mempool_percent, other_count))
+    print("full block:    {:>10} bytes  {:8.1f} ms".format(len(full_payload), full_elapsed * 1000))
+    print("compact block: {:>10} bytes  {:8.1f} ms  ({} round trip(s){})".format(
+        len(compact_payload), compact_elapsed * 1000, round_trips,
+        ", {} bytes resent".format(fallback_bytes) if round_trips > 1 else ""))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
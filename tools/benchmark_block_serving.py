@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+"""
+Measures what serving a range of blocks costs in bytes and encode time, and what decoding it costs the
+client: the old json string of json strings, a single json layer, and the binary format.
+
+usage: tools/benchmark_block_serving.py [blocks] [transactions per block]
+"""
+
+from __future__ import print_function
+
+import hashlib
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, '.')
+from crankycoin import *
+
+
+def build_blocks(block_count, transaction_count):
+    addresses = ["02" + os.urandom(32).encode('hex') for i in range(100)]
+    blocks = []
+    for index in range(block_count):
+        transactions = [Transaction(
+            addresses[i % len(addresses)],
+            addresses[(i + index) % len(addresses)],
+            i,
+            0.1,
+            os.urandom(71).encode('hex'),
+            1508823223 + i
+        ) for i in range(transaction_count)]
+        transactions.append(Transaction("0", addresses[index % len(addresses)], 50, 0, "0", 1508823223))
+        blocks.append(Block(index, transactions, os.urandom(32).encode('hex'), 1508823300 + index, 0))
+    return blocks
+
+
+def timed(function, *args):
+    start = time.time()
+    result = function(*args)
+    return result, (time.time() - start) * 1000
+
+
+def main(argv):
+    block_count = int(argv[0]) if len(argv) > 0 else 1000
+    transaction_count = int(argv[1]) if len(argv) > 1 else 20
+    # serving only reads block hashes, so sha256 stands in for scrypt to keep setup short
+    Block._calculate_block_hash = lambda self: hashlib.sha256(self.block_header.to_hashable()).hexdigest()
+    blocks = build_blocks(block_count, transaction_count)
+    for block in blocks:
+        block.current_hash
+
+    encoders = [
+        ("double json", lambda: json.dumps([block.to_json() for block in blocks]),
+         lambda payload: [Block.from_dict(json.loads(block)) for block in json.loads(payload)]),
+        ("single json", lambda: FullNode._blocks_json(blocks),
+         lambda payload: [Block.from_dict(block) for block in json.loads(payload)]),
+        ("binary", lambda: BinaryCodec.encode_blocks(blocks),
+         lambda payload: [block for block, current_hash in BinaryCodec.decode_blocks(payload)]),
+    ]
+
+    print("blocks: {}, transactions per block: {}".format(block_count, transaction_count + 1))
+    for name, encode, decode in encoders:
+        payload, encode_elapsed = timed(encode)
+        decoded, decode_elapsed = timed(decode, payload)
+        assert decoded == blocks
+        print("{:<12} {:>12} bytes  encode {:8.1f} ms  decode {:8.1f} ms".format(
+            name, len(payload), encode_elapsed, decode_elapsed))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
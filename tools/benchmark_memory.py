@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+"""
+Measures the memory a chain of blocks holds once decoded from the wire, reported as bytes per transaction.
+Objects shared between transactions (e.g. interned addresses) are counted once.
+
+usage: tools/benchmark_memory.py [blocks] [transactions per block] [distinct addresses]
+"""
+
+from __future__ import print_function
+
+import gc
+import json
+import os
+import sys
+import time
+import types
+
+sys.path.insert(0, '.')
+from crankycoin import *
+
+
+def deep_size(root):
+    seen = set()
+    pending = [root]
+    size = 0
+    while pending:
+        obj = pending.pop()
+        if id(obj) in seen or isinstance(obj, (type, types.ModuleType, types.FunctionType)):
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+        pending.extend(gc.get_referents(obj))
+    return size
+
+
+def build_addresses(count):
+    return ["02" + os.urandom(32).encode('hex') for i in range(count)]
+
+
+def build_block_json(index, transaction_count, addresses):
+    transactions = []
+    for i in range(transaction_count):
+        transaction = Transaction(
+            addresses[i % len(addresses)],
+            addresses[(i * 7 + 1) % len(addresses)],
+            i,
+            0.1,
+            os.urandom(71).encode('hex'),
+            1508823223 + i
+        )
+        transactions.append(json.loads(transaction.to_json()))
+    return {"index": index, "previous_hash": os.urandom(32).encode('hex'), "transactions": transactions}
+
+
+def decode_block(remote_block):
+    # the same decoding a node does on blocks received from peers
+    return Block(
+        remote_block['index'],
+        [Transaction.from_dict(transaction) for transaction in remote_block['transactions']],
+        remote_block['previous_hash'],
+        1508823300,
+        0
+    )
+
+
+def main(argv):
+    block_count = int(argv[0]) if len(argv) > 0 else 50
+    transaction_count = int(argv[1]) if len(argv) > 1 else config['network']['max_transactions_per_block']
+    address_count = int(argv[2]) if len(argv) > 2 else 1000
+    addresses = build_addresses(address_count)
+
+    start = time.time()
+    blocks = [decode_block(build_block_json(i, transaction_count, addresses)) for i in range(block_count)]
+    elapsed = time.time() - start
+    for block in blocks:
+        block.current_hash
+    total = deep_size(blocks)
+
+    print("blocks: {}, transactions per block: {}, distinct addresses: {}".format(
+        block_count, transaction_count, address_count))
+    print("total: {:>14} bytes  ({:.1f} s to build)".format(total, elapsed))
+    print("per transaction: {:>8.1f} bytes".format(float(total) / (block_count * transaction_count)))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
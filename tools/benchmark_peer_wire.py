@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+"""
+Compares gossip over HTTP with the persistent framed peer wire on loopback: round trip latency of
+sequential inventory announcements, and message throughput with several sending threads.
+
+usage: tools/benchmark_peer_wire.py [messages] [threads]
+"""
+
+from __future__ import print_function
+
+import json
+import os
+import sys
+import threading
+import time
+
+import requests
+from klein import Klein
+from twisted.internet import reactor
+from twisted.web.server import Site
+
+sys.path.insert(0, '.')
+from crankycoin import *
+
+HTTP_PORT = 30113
+WIRE_PORT = 30114
+URL = "http://127.0.0.1:{}/inventory".format(HTTP_PORT)
+
+
+class InventoryServer(object):
+    app = Klein()
+
+    @app.route('/inventory', methods=['POST'])
+    def post_inventory(self, request):
+        body = json.loads(request.content.read())
+        return json.dumps({"blocks": body.get('blocks', []), "transactions": []})
+
+
+def start_servers():
+    server = InventoryServer()
+    reactor.listenTCP(HTTP_PORT, Site(server.app.resource()), interface="127.0.0.1")
+    PeerWire("127.0.0.1", {PeerWire.INVENTORY: server.post_inventory}, port=WIRE_PORT).listen("127.0.0.1")
+    thread = threading.Thread(target=reactor.run, kwargs={"installSignalHandlers": False})
+    thread.daemon = True
+    thread.start()
+    time.sleep(0.5)
+
+
+def run(send, message_count, thread_count):
+    latencies = []
+    lock = threading.Lock()
+
+    def worker(count):
+        mine = []
+        for i in range(count):
+            start = time.time()
+            send()
+            mine.append(time.time() - start)
+        with lock:
+            latencies.extend(mine)
+
+    threads = [threading.Thread(target=worker, args=(message_count / thread_count,)) for i in range(thread_count)]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - start
+    latencies.sort()
+    return len(latencies) / elapsed, latencies[len(latencies) / 2] * 1000, latencies[int(len(latencies) * 0.99)] * 1000
+
+
+def main(argv):
+    message_count = int(argv[0]) if len(argv) > 0 else 2000
+    thread_count = int(argv[1]) if len(argv) > 1 else 8
+    start_servers()
+    data = {"host": "127.0.0.2", "blocks": [os.urandom(32).encode('hex')],
+            "transactions": [os.urandom(32).encode('hex') for i in range(10)]}
+    payload = json.dumps(data)
+    session = requests.Session()
+    wire = PeerWire("127.0.0.2", {}, port=WIRE_PORT)
+
+    def http_post():
+        assert requests.post(URL, json=data, timeout=5).status_code == 200
+
+    def http_keep_alive():
+        assert session.post(URL, json=data, timeout=5).status_code == 200
+
+    def wire_request():
+        assert wire.request("127.0.0.1", PeerWire.INVENTORY, payload).status_code == 200
+
+    transports = [
+        ("http, connection per message", http_post),
+        ("http, keep-alive session", http_keep_alive),
+        ("peer wire", wire_request),
+    ]
+    print("messages: {}, inventory of {} bytes".format(message_count, len(payload)))
+    for name, send in transports:
+        send()
+        for threads in (1, thread_count):
+            throughput, median, p99 = run(send, message_count, threads)
+            print("{:<30} {:>2} threads  {:8.0f} msg/s  median {:6.2f} ms  p99 {:6.2f} ms".format(
+                name, threads, throughput, median, p99))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+"""
+Measures the bytes a full sync transfers, page by page as GET /blocks serves it, in json and binary, with
+no compression, deflate and gzip, and what compressing costs the server.
+
+usage: tools/benchmark_sync_compression.py [blocks] [transactions per block]
+"""
+
+from __future__ import print_function
+
+import hashlib
+import sys
+import time
+
+from twisted.web.test.requesthelper import DummyRequest
+
+sys.path.insert(0, '.')
+from crankycoin import *
+from benchmark_block_serving import build_blocks
+
+
+def sync_bytes(pages, accept_encoding, encode):
+    compression = ResponseCompression()
+    total = 0
+    start = time.time()
+    for page in pages:
+        request = DummyRequest([])
+        if accept_encoding is not None:
+            request.requestHeaders.setRawHeaders('Accept-Encoding', [accept_encoding])
+        total += sum(len(chunk) for chunk in encode(compression, request, page))
+    return total, (time.time() - start) * 1000
+
+
+def main(argv):
+    block_count = int(argv[0]) if len(argv) > 0 else 1000
+    transaction_count = int(argv[1]) if len(argv) > 1 else 20
+    # serving only reads block hashes, so sha256 stands in for scrypt to keep setup short
+    Block._calculate_block_hash = lambda self: hashlib.sha256(self.block_header.to_hashable()).hexdigest()
+    blocks = build_blocks(block_count, transaction_count)
+    for block in blocks:
+        block.current_hash
+    page_size = FullNode.MAX_BLOCKS_PER_RESPONSE
+    pages = [blocks[start:start + page_size] for start in range(0, len(blocks), page_size)]
+
+    formats = [
+        ("json", lambda compression, request, page:
+            compression.apply(compression.stream(FullNode._blocks_json_chunks(page), compression.negotiate(request)),
+                              request)),
+        ("binary", lambda compression, request, page:
+            [compression.respond(request, BinaryCodec.encode_blocks(page))]),
+    ]
+
+    print("blocks: {}, transactions per block: {}, pages of {}".format(
+        block_count, transaction_count + 1, page_size))
+    for name, encode in formats:
+        plain, plain_elapsed = sync_bytes(pages, None, encode)
+        for accept_encoding in (None, "deflate", "gzip"):
+            total, elapsed = sync_bytes(pages, accept_encoding, encode)
+            print("{:<7} {:<8} {:>12} bytes  {:5.1f}% saved  serve {:8.1f} ms".format(
+                name, accept_encoding or "none", total, 100.0 * (plain - total) / plain, elapsed))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+"""
+Measures transactions verified per second, parsing the sender's public key on every check versus
+taking it from the public key cache.  Best of three passes over the same transactions.
+
+usage: tools/benchmark_verify.py [transactions] [distinct senders]
+"""
+
+from __future__ import print_function
+
+import sys
+import time
+import coincurve
+
+sys.path.insert(0, '.')
+from crankycoin import *
+
+
+def build_transactions(transaction_count, sender_count):
+    private_keys = [coincurve.PrivateKey() for i in range(sender_count)]
+    transactions = []
+    for i in range(transaction_count):
+        private_key = private_keys[i % sender_count]
+        source = private_key.public_key.format(compressed=True).encode('hex')
+        transaction = Transaction(source, "02" + "ab" * 32, i, 0.1)
+        transaction.sign(private_key.to_hex())
+        transactions.append(transaction)
+    return transactions
+
+
+def verify_uncached(transaction):
+    public_key = coincurve.PublicKey(transaction.source.decode('hex'))
+    return public_key.verify(transaction.signature.decode('hex'), transaction.to_signable())
+
+
+def rate(verify, transactions, repeat=3):
+    best = None
+    for i in range(repeat):
+        start = time.time()
+        for transaction in transactions:
+            assert verify(transaction)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return len(transactions) / best
+
+
+def main(argv):
+    transaction_count = int(argv[0]) if len(argv) > 0 else 20000
+    sender_count = int(argv[1]) if len(argv) > 1 else 100
+    transactions = build_transactions(transaction_count, sender_count)
+
+    print("transactions: {}, distinct senders: {}".format(transaction_count, sender_count))
+    print("parsed per check: {:>10.0f} verified/s".format(rate(verify_uncached, transactions)))
+    print("cached:           {:>10.0f} verified/s".format(rate(Transaction.verify, transactions)))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])